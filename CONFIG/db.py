@@ -8,7 +8,10 @@ import psycopg2.extras
 import json
 import os
 import logging
-from typing import Optional, Dict, Any
+import uuid
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+import numpy as np
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -49,6 +52,86 @@ def get_connection():
         raise
 
 
+def iterar_lotes_columnares(query: str, columnas: List[Tuple[str, str]], params=None,
+                            tamano_lote: int = 5000) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Recorre una consulta con un cursor con nombre (lado del servidor) y entrega
+    los resultados por lotes como columnas NumPy, sin materializar toda la tabla
+    
+    Args:
+        query: Consulta SQL; el orden del SELECT debe coincidir con `columnas`
+        columnas: Lista de (nombre, dtype NumPy). Los dtypes flotantes convierten
+                  NULL en NaN; usar 'O' para texto
+        params: Parámetros de la consulta
+        tamano_lote: Filas por lote (también usado como itersize del cursor)
+    
+    Yields:
+        Dict {columna: np.ndarray} con a lo sumo `tamano_lote` filas
+        
+    Raises:
+        psycopg2.Error: Si falla la conexión o la consulta
+    """
+    conn = get_connection()
+    try:
+        # Un cursor con nombre mantiene el resultado en PostgreSQL y solo
+        # transfiere `tamano_lote` filas por cada fetchmany()
+        cursor = conn.cursor(name=f"lotes_{uuid.uuid4().hex[:12]}")
+        cursor.itersize = tamano_lote
+        cursor.execute(query, params)
+        
+        while True:
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                break
+            
+            lote = {}
+            for idx, (nombre, dtype) in enumerate(columnas):
+                dtype = np.dtype(dtype)
+                if dtype.kind == 'f':
+                    lote[nombre] = np.fromiter(
+                        (np.nan if fila[idx] is None else fila[idx] for fila in filas),
+                        dtype=dtype, count=len(filas)
+                    )
+                elif dtype.kind in 'iu':
+                    lote[nombre] = np.fromiter((fila[idx] for fila in filas), dtype=dtype, count=len(filas))
+                else:
+                    lote[nombre] = np.array([fila[idx] for fila in filas], dtype=object)
+            yield lote
+        
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def iterar_filas(query: str, params=None, tamano_lote: int = 5000) -> Iterator[Dict[str, Any]]:
+    """
+    Recorre una consulta fila por fila (dicts) con un cursor con nombre, para
+    respuestas en streaming con memoria acotada
+    
+    Args:
+        query: Consulta SQL
+        params: Parámetros de la consulta
+        tamano_lote: Filas transferidas por viaje al servidor (itersize)
+    
+    Yields:
+        Dict por fila (RealDictRow)
+        
+    Raises:
+        psycopg2.Error: Si falla la conexión o la consulta
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(name=f"filas_{uuid.uuid4().hex[:12]}",
+                             cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.itersize = tamano_lote
+        cursor.execute(query, params)
+        for fila in cursor:
+            yield fila
+        cursor.close()
+    finally:
+        conn.close()
+
+
 def obtener_aviso_por_numero(numero_aviso: int) -> Optional[Dict[str, Any]]:
     """
     Obtiene un aviso de la base de datos por número
@@ -74,12 +157,8 @@ def obtener_aviso_por_numero(numero_aviso: int) -> Optional[Dict[str, Any]]:
         
         if aviso:
             logger.info(f"Aviso {numero_aviso} obtenido de BD")
-            # Convertir objetos date/datetime a strings para JSON serialization
-            aviso_dict = dict(aviso)
-            for key, value in aviso_dict.items():
-                if hasattr(value, 'isoformat'):  # date, datetime, time objects
-                    aviso_dict[key] = value.isoformat()
-            return aviso_dict
+            # Fechas como date/datetime: el proveedor JSON de la app las emite en ISO
+            return dict(aviso)
         else:
             logger.warning(f"Aviso {numero_aviso} no encontrado en BD")
             return None
@@ -89,6 +168,11 @@ def obtener_aviso_por_numero(numero_aviso: int) -> Optional[Dict[str, Any]]:
         return None
 
 
+def _valor_json(valor):
+    """default= de json.dump: fechas en ISO 8601, el resto como texto"""
+    return valor.isoformat() if hasattr(valor, 'isoformat') else str(valor)
+
+
 def guardar_aviso_json(numero_aviso: int, output_path: str = ".") -> bool:
     """
     Descarga un aviso de BD y lo guarda en archivo JSON
@@ -109,7 +193,7 @@ def guardar_aviso_json(numero_aviso: int, output_path: str = ".") -> bool:
         filepath = os.path.join(output_path, f"aviso_{numero_aviso}.json")
         
         with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(aviso, f, default=str, indent=2, ensure_ascii=False)
+            json.dump(aviso, f, default=_valor_json, indent=2, ensure_ascii=False)
         
         logger.info(f"Aviso guardado en: {filepath}")
         return True
@@ -188,6 +272,31 @@ def guardar_csv_aviso(numero_aviso: int, tipo: str, ruta_csv: str) -> bool:
         return False
 
 
+def listar_avisos_vigentes(dias_gracia: int = 2) -> List[int]:
+    """
+    Números de aviso cuya fecha_fin (máxima entre sus días) no pasó hace más
+    de `dias_gracia` días
+    
+    Raises:
+        psycopg2.Error: Si falla la consulta
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT numero_aviso FROM avisos_completos
+               GROUP BY numero_aviso
+               HAVING MAX(fecha_fin) >= NOW() - %s * INTERVAL '1 day'
+               ORDER BY numero_aviso""",
+            (dias_gracia,)
+        )
+        numeros = [fila[0] for fila in cursor.fetchall()]
+        cursor.close()
+    finally:
+        conn.close()
+    return numeros
+
+
 if __name__ == "__main__":
     # Para pruebas locales
     logging.basicConfig(level=logging.INFO)
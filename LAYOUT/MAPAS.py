@@ -402,7 +402,13 @@ shp_riesgo_path = os.getenv('SHP_RIESGO_PATH', 'DESCARGADOS_DB/aviso_452_3/view_
 if not os.path.exists(shp_riesgo_path):
     print(f"❌ Error: SHP de riesgo no encontrado en {shp_riesgo_path}")
     sys.exit(1)
-shp_riesgo = gpd.read_file(shp_riesgo_path)
+# Capa disuelta por nivel generada por el pipeline (GeoParquet, pocos vértices);
+# mismas columnas 'nivel'/geometry que el SHP
+shp_riesgo_disuelto_path = os.getenv('SHP_RIESGO_DISUELTO_PATH')
+if shp_riesgo_disuelto_path and os.path.exists(shp_riesgo_disuelto_path):
+    shp_riesgo = gpd.read_parquet(shp_riesgo_disuelto_path)
+else:
+    shp_riesgo = gpd.read_file(shp_riesgo_path)
 
 if DEPARTAMENTO_OBJETIVO not in shp_deptos['DPTONOM02'].values:
     print(f"El departamento '{DEPARTAMENTO_OBJETIVO}' no se encuentra en los datos.")
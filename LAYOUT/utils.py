@@ -187,7 +187,7 @@ def extraer_distritos_afectados(shp_riesgo_path):
         shp_riesgo_path: Ruta al shapefile de riesgo del día crítico
     
     Returns:
-        DataFrame con columnas: DEPARTAMEN, PROVINCIA, DISTRITO
+        DataFrame con columnas: DEPARTAMEN, PROVINCIA, DISTRITO, IDDIST (UBIGEO)
     """
     shp_riesgo = gpd.read_file(shp_riesgo_path)
     shp_distritos = gpd.read_file('DELIMITACIONES/DISTRITOS/DISTRITOS.shp')
@@ -202,7 +202,7 @@ def extraer_distritos_afectados(shp_riesgo_path):
     shp_alto = shp_alto.to_crs(shp_distritos.crs)
     riesgo_con_dist = gpd.sjoin(shp_alto, shp_distritos, how='left', predicate='intersects')
     
-    distritos_afectados = riesgo_con_dist[['DEPARTAMEN', 'PROVINCIA', 'DISTRITO']].dropna().drop_duplicates()
+    distritos_afectados = riesgo_con_dist[['DEPARTAMEN', 'PROVINCIA', 'DISTRITO', 'IDDIST']].dropna().drop_duplicates()
     print(f"✓ Distritos afectados: {len(distritos_afectados)}")
     
     return distritos_afectados
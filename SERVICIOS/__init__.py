@@ -0,0 +1,3 @@
+"""
+Módulo SERVICIOS - Cachés, índices y cálculos compartidos por las rutas
+"""
@@ -0,0 +1,86 @@
+"""
+Envío de archivos de OUTPUT/ (mapas, CSV, Excel)
+Tres modos (MODO_ENVIO_ARCHIVOS):
+    flask       send_file con ETag/Last-Modified, 304 y rangos (Range)
+    x-accel     cabecera X-Accel-Redirect: nginx sirve el archivo desde una
+                location `internal` (PREFIJO_X_ACCEL -> OUTPUT/) y el worker
+                queda libre
+    x-sendfile  cabecera X-Sendfile con la ruta absoluta (Apache/lighttpd)
+
+Las imágenes se envían en línea (se muestran en el navegador); el resto como
+adjunto. Las URLs con ?v=<versión> (ver url_versionada) y los archivos con
+hash en el nombre se marcan inmutables; las demás se revalidan con ETag,
+porque el pipeline sobrescribe los mapas con el mismo nombre.
+
+Ejemplo nginx para x-accel:
+    location /_output/ { internal; alias /app/OUTPUT/; }
+"""
+import mimetypes
+import os
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+BASE_DIR = Path(__file__).parent.parent
+OUTPUT_DIR = BASE_DIR / os.getenv('OUTPUT_DIR', 'OUTPUT')
+
+MODO_ENVIO = os.getenv('MODO_ENVIO_ARCHIVOS', 'flask').lower()
+PREFIJO_X_ACCEL = os.getenv('PREFIJO_X_ACCEL', '/_output/')
+
+EXTENSIONES_EN_LINEA = {'.webp', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.pdf'}
+# nombre.<hash hex de 8+ caracteres>.ext
+PATRON_HASH = re.compile(r'\.[0-9a-f]{8,64}\.[A-Za-z0-9]+$')
+
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDAR = 'no-cache'
+
+
+def version_archivo(ruta):
+    """Versión barata del archivo (mtime + tamaño): cambia si se sobrescribe"""
+    st = Path(ruta).stat()
+    return f'{st.st_mtime_ns:x}{st.st_size:x}'
+
+
+def url_versionada(url, ruta):
+    """URL con ?v=<versión>: cacheable indefinidamente mientras no cambie el archivo"""
+    return f'{url}?v={version_archivo(ruta)}'
+
+
+def _es_inmutable(ruta):
+    return bool(PATRON_HASH.search(ruta.name)) or request.args.get('v') == version_archivo(ruta)
+
+
+def enviar_output(ruta_relativa):
+    """
+    Response para un archivo de OUTPUT/ según MODO_ENVIO_ARCHIVOS
+
+    Args:
+        ruta_relativa: Ruta dentro de OUTPUT/ (p. ej. 'aviso_447/CUSCO.webp')
+
+    Raises:
+        NotFound: Si la ruta sale de OUTPUT/ o el archivo no existe
+    """
+    ruta_str = safe_join(str(OUTPUT_DIR), ruta_relativa)
+    if ruta_str is None or not os.path.isfile(ruta_str):
+        raise NotFound()
+    ruta = Path(ruta_str)
+    en_linea = ruta.suffix.lower() in EXTENSIONES_EN_LINEA
+
+    if MODO_ENVIO in ('x-accel', 'x-sendfile'):
+        respuesta = Response(mimetype=mimetypes.guess_type(ruta.name)[0] or 'application/octet-stream')
+        if MODO_ENVIO == 'x-accel':
+            respuesta.headers['X-Accel-Redirect'] = PREFIJO_X_ACCEL + quote(ruta.relative_to(OUTPUT_DIR).as_posix())
+        else:
+            respuesta.headers['X-Sendfile'] = str(ruta.resolve())
+        if not en_linea:
+            respuesta.headers.set('Content-Disposition', 'attachment', filename=ruta.name)
+    else:
+        # conditional=True: ETag, Last-Modified, 304 y Range
+        respuesta = send_file(ruta, conditional=True, as_attachment=not en_linea)
+
+    respuesta.headers['Cache-Control'] = CACHE_INMUTABLE if _es_inmutable(ruta) else CACHE_REVALIDAR
+    return respuesta
@@ -0,0 +1,262 @@
+"""
+Caché de respuestas para las rutas GET /api/avisos/<numero>/... de solo lectura
+Cada vista se habilita explícitamente con @respuesta_cacheable (las que
+disparan trabajo, como /procesar, nunca pasan por aquí). Guarda el cuerpo JSON en SQLite (CACHE_DIR/respuestas.sqlite), compartido
+entre workers de gunicorn, y responde 304 con ETag fuerte.
+
+La clave combina la ruta (con query string), la versión de la tabla clientes
+y contadores de generación que se incrementan con invalidar_aviso() /
+invalidar_clientes(). Quien escribe archivos de un aviso (procesar_aviso,
+descargar_aviso, areas, decisiones) llama a invalidar_aviso(): no se recorre
+OUTPUT/TEMP por petición.
+
+Las peticiones que negocian NDJSON por Accept no pasan por la caché (se
+responden en streaming y la URL es la misma que la de la variante JSON).
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from flask import Response, current_app, g, request
+
+BASE_DIR = Path(__file__).parent.parent
+CACHE_DIR = Path(os.getenv('CACHE_DIR', str(BASE_DIR / 'TEMP' / 'cache')))
+DB_PATH = CACHE_DIR / 'respuestas.sqlite'
+
+CACHE_HABILITADO = os.getenv('CACHE_RESPUESTAS', '1') not in ('0', 'false', 'no')
+# Tope de entradas (rutas con bbox/zoom generan muchas variantes)
+MAX_RESPUESTAS_CACHE = int(os.getenv('MAX_RESPUESTAS_CACHE', '5000'))
+
+MIMETYPE_NDJSON = 'application/x-ndjson'
+
+logger = logging.getLogger(__name__)
+
+# El esquema se crea una vez por proceso (no en cada petición)
+_esquema_lock = threading.Lock()
+_esquema_listo = False
+
+
+# ============================================================================
+# ALMACÉN SQLITE
+# ============================================================================
+
+def _crear_esquema(conn):
+    """Modo WAL (persistente en el archivo) y tablas"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS respuestas (
+            clave TEXT PRIMARY KEY,
+            numero INTEGER NOT NULL,
+            ruta TEXT NOT NULL,
+            etag TEXT NOT NULL,
+            mimetype TEXT NOT NULL,
+            cuerpo BLOB NOT NULL,
+            creado REAL NOT NULL
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_respuestas_numero ON respuestas(numero)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_respuestas_ruta ON respuestas(ruta)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_respuestas_creado ON respuestas(creado)')
+    conn.execute('CREATE TABLE IF NOT EXISTS generaciones (ambito TEXT PRIMARY KEY, valor INTEGER NOT NULL)')
+
+
+def _conectar():
+    """Conexión SQLite; la primera del proceso crea el esquema"""
+    global _esquema_listo
+    if not _esquema_listo:
+        with _esquema_lock:
+            if not _esquema_listo:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(str(DB_PATH), timeout=5)
+                _crear_esquema(conn)
+                _esquema_listo = True
+                return conn
+    return sqlite3.connect(str(DB_PATH), timeout=5)
+
+
+def _descartar_esquema():
+    """Tras un error SQLite la próxima conexión vuelve a crear el esquema
+    (p. ej. si se borró CACHE_DIR con la app en marcha)"""
+    global _esquema_listo
+    _esquema_listo = False
+
+
+def _incrementar_generacion(conn, ambito):
+    conn.execute("""
+        INSERT INTO generaciones (ambito, valor) VALUES (?, 1)
+        ON CONFLICT(ambito) DO UPDATE SET valor = valor + 1
+    """, (ambito,))
+
+
+def _generaciones(conn, numero):
+    """Tupla (generación de clientes, generación del aviso)"""
+    filas = dict(conn.execute(
+        'SELECT ambito, valor FROM generaciones WHERE ambito IN (?, ?)',
+        ('clientes', f'aviso:{numero}')
+    ).fetchall())
+    return filas.get('clientes', 0), filas.get(f'aviso:{numero}', 0)
+
+
+# ============================================================================
+# VERSIONES
+# ============================================================================
+
+def _version_clientes():
+    """Versión de la tabla clientes; None si la BD no está disponible"""
+    try:
+        from SERVICIOS.snapshot_clientes import obtener_version_snapshot
+        return obtener_version_snapshot()
+    except Exception as e:
+        logger.warning("Caché de respuestas sin versión de clientes: %s", e)
+        return None
+
+
+# ============================================================================
+# INVALIDACIÓN (llamada desde procesar_aviso, areas y asignar_distritos)
+# ============================================================================
+
+def invalidar_aviso(numero):
+    """Descarta las respuestas cacheadas de un aviso"""
+    try:
+        conn = _conectar()
+        with conn:
+            _incrementar_generacion(conn, f'aviso:{numero}')
+            conn.execute('DELETE FROM respuestas WHERE numero = ?', (numero,))
+        conn.close()
+        logger.info("Caché de respuestas invalidada para aviso %d", numero)
+    except sqlite3.Error as e:
+        _descartar_esquema()
+        logger.warning("No se pudo invalidar caché del aviso %d: %s", numero, e)
+
+
+def invalidar_clientes():
+    """Descarta todas las respuestas cacheadas (cambió la tabla clientes)"""
+    try:
+        conn = _conectar()
+        with conn:
+            _incrementar_generacion(conn, 'clientes')
+            conn.execute('DELETE FROM respuestas')
+        conn.close()
+        logger.info("Caché de respuestas invalidada por cambios en clientes")
+    except sqlite3.Error as e:
+        _descartar_esquema()
+        logger.warning("No se pudo invalidar caché de clientes: %s", e)
+
+
+# ============================================================================
+# HOOKS FLASK
+# ============================================================================
+
+def respuesta_cacheable(vista):
+    """
+    Habilita la caché para una vista GET /api/avisos/<int:numero>/... de solo
+    lectura (va debajo de @bp.route)
+    """
+    vista.cache_respuestas = True
+    return vista
+
+
+def _numero_aviso_de_request():
+    """Número de aviso si la petición es un GET a una vista cacheable, si no None"""
+    if request.method != 'GET':
+        return None
+    vista = current_app.view_functions.get(request.endpoint)
+    if not getattr(vista, 'cache_respuestas', False):
+        return None
+    if request.accept_mimetypes.best == MIMETYPE_NDJSON:
+        return None
+    numero = (request.view_args or {}).get('numero')
+    return numero if isinstance(numero, int) else None
+
+
+def _preparar_respuesta(respuesta, etag, estado):
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.vary.add('Accept')
+    respuesta.headers['X-Cache'] = estado
+    return respuesta.make_conditional(request)
+
+
+def _servir_desde_cache():
+    """before_request: responde desde SQLite (o 304) si la entrada está vigente"""
+    numero = _numero_aviso_de_request()
+    if numero is None:
+        return None
+
+    version_clientes = _version_clientes()
+    if version_clientes is None:
+        return None
+
+    try:
+        conn = _conectar()
+        gen_clientes, gen_aviso = _generaciones(conn, numero)
+        ruta = request.full_path.rstrip('?')
+        clave = hashlib.sha1('|'.join([
+            ruta, version_clientes, str(gen_clientes), str(gen_aviso)
+        ]).encode('utf-8')).hexdigest()
+        fila = conn.execute(
+            'SELECT etag, mimetype, cuerpo FROM respuestas WHERE clave = ?', (clave,)
+        ).fetchone()
+        conn.close()
+    except sqlite3.Error as e:
+        _descartar_esquema()
+        logger.warning("Caché de respuestas no disponible: %s", e)
+        return None
+
+    g.cache_respuesta = {'clave': clave, 'numero': numero, 'ruta': ruta}
+    if fila is None:
+        return None
+
+    etag, mimetype, cuerpo = fila
+    return _preparar_respuesta(Response(cuerpo, mimetype=mimetype), etag, 'HIT')
+
+
+def _guardar_en_cache(respuesta):
+    """after_request: guarda respuestas JSON 200 completas (no streaming)"""
+    entrada = g.pop('cache_respuesta', None)
+    if (entrada is None or respuesta.headers.get('X-Cache') == 'HIT'
+            or respuesta.status_code != 200 or respuesta.is_streamed
+            or respuesta.direct_passthrough or respuesta.mimetype != 'application/json'):
+        return respuesta
+
+    cuerpo = respuesta.get_data()
+    etag = hashlib.sha1(cuerpo).hexdigest()
+    try:
+        conn = _conectar()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (entrada['clave'], entrada['numero'], entrada['ruta'], etag,
+                 respuesta.mimetype, cuerpo, time.time())
+            )
+            # Solo la versión vigente de cada ruta
+            conn.execute('DELETE FROM respuestas WHERE ruta = ? AND clave <> ?',
+                         (entrada['ruta'], entrada['clave']))
+            conn.execute('''
+                DELETE FROM respuestas WHERE clave IN (
+                    SELECT clave FROM respuestas ORDER BY creado DESC LIMIT -1 OFFSET ?
+                )
+            ''', (MAX_RESPUESTAS_CACHE,))
+        conn.close()
+    except sqlite3.Error as e:
+        _descartar_esquema()
+        logger.warning("No se pudo guardar respuesta en caché: %s", e)
+
+    return _preparar_respuesta(respuesta, etag, 'MISS')
+
+
+def registrar_cache_respuestas(app):
+    """Activa la caché de respuestas en la app (desactivable con CACHE_RESPUESTAS=0)"""
+    if not CACHE_HABILITADO:
+        logger.info("Caché de respuestas desactivada (CACHE_RESPUESTAS=0)")
+        return
+    try:
+        _conectar().close()
+    except sqlite3.Error as e:
+        logger.warning("Caché de respuestas sin esquema inicial: %s", e)
+    app.before_request(_servir_desde_cache)
+    app.after_request(_guardar_en_cache)
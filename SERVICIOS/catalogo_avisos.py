@@ -0,0 +1,332 @@
+"""
+Catálogo de avisos en memoria (BD + JSON/ + OUTPUT/ + galería de mapas)
+/api/avisos y la página /avisos consultaban la BD completa, parseaban cada
+JSON/aviso_*.json y recorrían OUTPUT/ con globs en cada petición. El catálogo
+mantiene el índice fusionado y lo refresca de forma incremental, como mucho
+cada INTERVALO_CATALOGO_SEG:
+
+    BD        una fila agregada por aviso; solo números mayores al último
+              visto menos AVISOS_RECHEQUEO (días agregados después)
+    JSON/     stat de cada archivo; se parsean solo los nuevos o modificados
+    OUTPUT/   se relistan las carpetas aviso_N si cambió el mtime de OUTPUT/
+    mapas     índice SQLite de la galería (SERVICIOS/galeria_mapas.py)
+
+Los departamentos del CSV (distritos_afectados.csv) se cachean por aviso con
+la versión de sus mapas en la galería: al regenerarlos se vuelven a leer.
+invalidar_catalogo() fuerza el refresco en la siguiente consulta.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from SERVICIOS.galeria_mapas import consultar_mapas, resumen_avisos
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    from CONFIG.db import get_connection
+    BD_DISPONIBLE = True
+except ImportError:
+    BD_DISPONIBLE = False
+
+BASE_DIR = Path(__file__).parent.parent
+JSON_DIR = BASE_DIR / 'JSON'
+OUTPUT_DIR = BASE_DIR / os.getenv('OUTPUT_DIR', 'OUTPUT')
+
+INTERVALO_CATALOGO_SEG = float(os.getenv('INTERVALO_CATALOGO_SEG', '15'))
+# Últimos números de aviso que se releen de BD en cada refresco
+AVISOS_RECHEQUEO = int(os.getenv('AVISOS_RECHEQUEO', '10'))
+COLORES_CATALOGO = ('rojo', 'naranja')
+INCLUDES = ('info', 'departamentos', 'mapas')
+
+# Valores por defecto de /api/avisos para avisos sin fila en BD
+FECHA_POR_DEFECTO = '2026-02-01'
+
+# Una fila por aviso: la del día de color más severo (desempate: día más antiguo)
+QUERY_AVISOS_BD = """
+    SELECT DISTINCT ON (numero_aviso)
+        numero_aviso, titulo, nivel, color,
+        MIN(fecha_emision) OVER (PARTITION BY numero_aviso) AS fecha_emision
+    FROM avisos_completos
+    WHERE numero_aviso > %s
+    ORDER BY numero_aviso,
+        CASE LOWER(color) WHEN 'rojo' THEN 1 WHEN 'naranja' THEN 2
+                          WHEN 'amarillo' THEN 3 ELSE 4 END,
+        fecha_emision, titulo
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class _Catalogo:
+    """Estado del catálogo; se modifica solo bajo `lock`"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refrescado = 0.0
+        self.max_numero_bd = 0
+        self.bd = {}
+        self.json = {}
+        self.firmas_json = {}
+        self.output = set()
+        self.mtime_output = None
+        self.departamentos_csv = {}
+
+
+_catalogo = _Catalogo()
+
+
+# ============================================================================
+# REFRESCO INCREMENTAL
+# ============================================================================
+
+def _refrescar_bd(cat):
+    """
+    Avisos con numero_aviso > último visto - AVISOS_RECHEQUEO (todos los colores)
+
+    avisos_completos tiene una fila por día: se agrega por aviso tomando la
+    fila del color más severo (rojo > naranja > amarillo) y la fecha de
+    emisión más antigua, como el filtro anterior `color IN (...)` que listaba
+    el aviso si algún día calificaba. Los últimos AVISOS_RECHEQUEO números se
+    releen en cada refresco para captar días agregados o corregidos después;
+    cambios en avisos más antiguos requieren invalidar_catalogo(completo=True).
+    """
+    if not BD_DISPONIBLE:
+        return
+    desde = max(cat.max_numero_bd - AVISOS_RECHEQUEO, 0)
+    try:
+        conn = get_connection()
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(QUERY_AVISOS_BD, (desde,))
+            filas = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        logger.warning("Catálogo: BD no disponible (%s), se usan JSON/ y OUTPUT/", e)
+        return
+
+    nuevos = 0
+    for fila in filas:
+        numero = fila['numero_aviso']
+        nuevos += numero > cat.max_numero_bd
+        cat.bd[numero] = {
+            'titulo': fila['titulo'],
+            'nivel': fila['nivel'],
+            'color': fila.get('color') or 'plomo',
+            'fecha_emision': str(fila.get('fecha_emision', ''))
+        }
+        cat.max_numero_bd = max(cat.max_numero_bd, numero)
+    if nuevos:
+        logger.info("Catálogo: %d avisos nuevos de BD (último aviso %d)", nuevos, cat.max_numero_bd)
+
+
+def _leer_json(ruta):
+    """Campos del JSON del aviso que usa el catálogo"""
+    with open(ruta, 'r', encoding='utf-8') as f:
+        datos = json.load(f)
+    deptos = set()
+    for dia in range(1, 4):
+        valor = datos.get('dep_afectados_dia{}'.format(dia))
+        if valor:
+            deptos.update(d.strip() for d in valor.split(','))
+    return {
+        'titulo': datos.get('titulo'),
+        'nivel': datos.get('nivel'),
+        'color': datos.get('color', 'plomo'),
+        'fecha_emision': datos.get('fecha_emision'),
+        'departamentos': sorted(deptos)
+    }
+
+
+def _refrescar_json(cat):
+    """Parsea solo los JSON nuevos o modificados (mtime/tamaño)"""
+    firmas = {}
+    if JSON_DIR.exists():
+        for entrada in os.scandir(JSON_DIR):
+            if not (entrada.name.startswith('aviso_') and entrada.name.endswith('.json')):
+                continue
+            try:
+                numero = int(entrada.name[len('aviso_'):-len('.json')])
+                st = entrada.stat()
+            except (ValueError, OSError):
+                continue
+            firmas[numero] = (st.st_mtime_ns, st.st_size)
+
+    for numero in set(cat.json) - set(firmas):
+        del cat.json[numero]
+    for numero, firma in firmas.items():
+        if cat.firmas_json.get(numero) == firma:
+            continue
+        try:
+            cat.json[numero] = _leer_json(JSON_DIR / 'aviso_{}.json'.format(numero))
+        except (ValueError, AttributeError, OSError) as e:
+            logger.warning("Catálogo: JSON del aviso %d ilegible: %s", numero, e)
+            cat.json.pop(numero, None)
+    cat.firmas_json = firmas
+
+
+def _refrescar_output(cat):
+    """Carpetas OUTPUT/aviso_N (solo si cambió el directorio)"""
+    try:
+        mtime = OUTPUT_DIR.stat().st_mtime_ns
+    except OSError:
+        cat.output, cat.mtime_output = set(), None
+        return
+    if mtime == cat.mtime_output:
+        return
+    numeros = set()
+    for entrada in os.scandir(OUTPUT_DIR):
+        sufijo = entrada.name[len('aviso_'):]
+        if entrada.name.startswith('aviso_') and sufijo.isdigit() and entrada.is_dir():
+            numeros.add(int(sufijo))
+    cat.output, cat.mtime_output = numeros, mtime
+
+
+def _refrescar(forzar=False):
+    cat = _catalogo
+    if not forzar and time.monotonic() - cat.refrescado < INTERVALO_CATALOGO_SEG:
+        return
+    with cat.lock:
+        if not forzar and time.monotonic() - cat.refrescado < INTERVALO_CATALOGO_SEG:
+            return
+        _refrescar_bd(cat)
+        _refrescar_json(cat)
+        _refrescar_output(cat)
+        cat.refrescado = time.monotonic()
+
+
+def invalidar_catalogo(completo=False):
+    """
+    La próxima consulta vuelve a revisar BD, JSON/ y OUTPUT/
+
+    Args:
+        completo: Releer todos los avisos de BD (no solo los recientes)
+    """
+    if completo:
+        with _catalogo.lock:
+            _catalogo.max_numero_bd = 0
+    _catalogo.refrescado = 0.0
+
+
+# ============================================================================
+# CONSULTAS
+# ============================================================================
+
+def _departamentos_csv(numero, version):
+    """DEPARTAMEN únicos de distritos_afectados.csv, cacheados por versión de mapas"""
+    cache = _catalogo.departamentos_csv.get(numero)
+    if cache and cache[0] == version:
+        return cache[1]
+
+    departamentos = set()
+    csv_path = OUTPUT_DIR / 'aviso_{}'.format(numero) / 'distritos_afectados.csv'
+    try:
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                depto = (row.get('DEPARTAMEN') or '').strip()
+                if depto:
+                    departamentos.add(depto)
+    except (OSError, ValueError):
+        pass
+    lista = sorted(departamentos)
+    _catalogo.departamentos_csv[numero] = (version, lista)
+    return lista
+
+
+def _base(cat, numero):
+    """Campos de lista con la misma precedencia que /api/avisos: BD > JSON > OUTPUT"""
+    if numero in cat.bd:
+        return dict(cat.bd[numero], fuente='bd')
+    if numero in cat.json:
+        datos = cat.json[numero]
+        return {
+            'titulo': datos['titulo'] or 'Aviso {}'.format(numero),
+            'nivel': datos['nivel'] or 'AMARILLO',
+            'color': datos['color'],
+            'fecha_emision': datos['fecha_emision'] or FECHA_POR_DEFECTO,
+            'fuente': 'json'
+        }
+    return {
+        'titulo': 'Aviso {}'.format(numero),
+        'nivel': 'N/A',
+        'color': 'plomo',
+        'fecha_emision': FECHA_POR_DEFECTO,
+        'fuente': 'output'
+    }
+
+
+def listar_avisos(aviso=None, include=(), colores=COLORES_CATALOGO):
+    """
+    Avisos del catálogo, número descendente
+
+    Args:
+        aviso: Número de aviso (opcional; sin filtro de color)
+        include: Subconjunto de INCLUDES a anexar en cada aviso:
+                 info (= /api/avisos/<n>/info), departamentos (= .../departamentos)
+                 y mapas (= /api/mapas/aviso/<n>)
+        colores: Colores de BD/JSON a listar cuando no se pide un aviso concreto
+
+    Returns:
+        Lista de dicts de aviso
+    """
+    _refrescar()
+    cat = _catalogo
+    galeria = {int(a['numero']): a for a in resumen_avisos()}
+
+    with cat.lock:
+        numeros = set(cat.bd) | set(cat.json) | cat.output
+        if aviso is not None:
+            numeros &= {aviso}
+        avisos = []
+        for numero in sorted(numeros, reverse=True):
+            base = _base(cat, numero)
+            # Las carpetas de OUTPUT/ sin BD ni JSON se listan siempre (color plomo)
+            if (aviso is None and base['fuente'] != 'output' and
+                    str(base['color']).lower() not in colores):
+                continue
+            descargado = numero in cat.json
+            mapas_creados = numero in galeria
+            entrada = {
+                'numero': numero,
+                'titulo': base['titulo'],
+                'nivel': base['nivel'],
+                'color': base['color'],
+                'fecha_emision': base['fecha_emision'],
+                'descargado': '✅' if descargado else '⏳',
+                'mapa_creado': '✅' if mapas_creados else '⏳',
+                'fuente': base['fuente']
+            }
+            if 'info' in include:
+                # /info prioriza el JSON descargado sobre la fila de BD
+                datos = cat.json.get(numero, {})
+                entrada['info'] = {
+                    'titulo': datos.get('titulo') or base['titulo'],
+                    'nivel': datos.get('nivel') or base['nivel'],
+                    'color': datos.get('color') or base['color'],
+                    'departamentos': datos.get('departamentos', []),
+                    'mapas_creados': mapas_creados,
+                    'fecha_emision': datos.get('fecha_emision') or base['fecha_emision']
+                }
+            if 'departamentos' in include:
+                entrada['departamentos'] = (_departamentos_csv(numero, galeria[numero]['version'])
+                                            if mapas_creados else [])
+            avisos.append(entrada)
+
+    if 'mapas' in include:
+        por_aviso = {}
+        for mapa in consultar_mapas(aviso=aviso, por_pagina=None)[0]:
+            por_aviso.setdefault(int(mapa['numero_aviso']), []).append({
+                'nombre': mapa['departamento'],
+                'archivo': mapa['nombre'],
+                'url': mapa['url']
+            })
+        for entrada in avisos:
+            entrada['mapas'] = por_aviso.get(entrada['numero'], [])
+
+    return avisos
@@ -0,0 +1,157 @@
+"""
+Clustering jerárquico de clientes por grilla (estilo supercluster)
+Proyecta los puntos a Web Mercator y, para cada zoom, los agrupa en celdas
+de RADIO_CLUSTER_PX píxeles. Las celdas de un zoom caen dentro de una sola
+celda del zoom anterior, por lo que la jerarquía es consistente al acercar.
+
+Cada cluster lleva el total de clientes y, por color, clientes, hectáreas y
+monto asegurado. Por encima de ZOOM_MAX_CLUSTERS se devuelven puntos sueltos.
+"""
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+RADIO_CLUSTER_PX = int(os.getenv('RADIO_CLUSTER_PX', '60'))
+ZOOM_MAX_CLUSTERS = int(os.getenv('ZOOM_MAX_CLUSTERS', '13'))
+MAX_PUNTOS_CLUSTER = int(os.getenv('MAX_PUNTOS_CLUSTER', '5000'))
+ZOOM_MAXIMO = 22
+TAMANO_TESELA_PX = 256
+LATITUD_MAX_MERCATOR = 85.05112878
+
+# bbox por defecto (oeste, sur, este, norte)
+BBOX_MUNDO = (-180.0, -90.0, 180.0, 90.0)
+
+
+# ============================================================================
+# CONSTRUCCIÓN DEL ÍNDICE
+# ============================================================================
+
+def proyectar_mercator(lon, lat):
+    """lon/lat (grados) -> x/y Web Mercator normalizados en [0, 1)"""
+    lat = np.clip(np.asarray(lat, dtype='float64'), -LATITUD_MAX_MERCATOR, LATITUD_MAX_MERCATOR)
+    x = (np.asarray(lon, dtype='float64') + 180.0) / 360.0
+    seno = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + seno) / (1 - seno)) / (4 * math.pi)
+    return np.clip(x, 0.0, 1.0 - 1e-12), np.clip(y, 0.0, 1.0 - 1e-12)
+
+
+def _clusters_zoom(puntos, zoom, colores):
+    """Agrega los puntos en las celdas del zoom: centroide, total y métricas por color"""
+    escala = TAMANO_TESELA_PX * (2 ** zoom) / RADIO_CLUSTER_PX
+    celdas = puntos.assign(
+        cx=np.floor(puntos['_x'].to_numpy() * escala).astype('int64'),
+        cy=np.floor(puntos['_y'].to_numpy() * escala).astype('int64')
+    )
+
+    base = celdas.groupby(['cx', 'cy'], sort=False).agg(
+        total=('nivel', 'size'), longitud=('longitud', 'mean'), latitud=('latitud', 'mean')
+    )
+    por_color = (celdas.groupby(['cx', 'cy', 'nivel'], sort=False)
+                       .agg(clientes=('nivel', 'size'), hectareas=('hectareas', 'sum'),
+                            monto=('monto_asegurado', 'sum'))
+                       .unstack('nivel', fill_value=0))
+    por_color = por_color.reindex(
+        columns=pd.MultiIndex.from_product([['clientes', 'hectareas', 'monto'], colores]), fill_value=0
+    )
+    por_color.columns = [f'{metrica}_{color}' for metrica, color in por_color.columns]
+
+    return base.join(por_color).reset_index(drop=True).sort_values('total', ascending=False, kind='stable')
+
+
+def construir_indice_clusters(puntos, colores):
+    """
+    Precalcula los clusters de todos los zooms
+
+    Args:
+        puntos: DataFrame con id, longitud, latitud, nivel, hectareas, monto_asegurado
+        colores: Niveles que se desglosan en cada cluster (orden de salida)
+
+    Returns:
+        Dict {'zooms': {zoom: DataFrame}, 'puntos': DataFrame, 'colores': list}
+    """
+    puntos = puntos.dropna(subset=['longitud', 'latitud']).reset_index(drop=True)
+    puntos = puntos.fillna({'hectareas': 0.0, 'monto_asegurado': 0.0})
+    x, y = proyectar_mercator(puntos['longitud'], puntos['latitud'])
+    puntos = puntos.assign(_x=x, _y=y)
+
+    zooms = {zoom: _clusters_zoom(puntos, zoom, colores) for zoom in range(ZOOM_MAX_CLUSTERS + 1)}
+    return {'zooms': zooms, 'puntos': puntos.drop(columns=['_x', '_y']), 'colores': list(colores)}
+
+
+# ============================================================================
+# CONSULTA POR ZOOM + BBOX
+# ============================================================================
+
+def parsear_bbox(texto):
+    """
+    'oeste,sur,este,norte' (formato de Leaflet toBBoxString) -> tupla de floats
+
+    Raises:
+        ValueError: Si no son 4 números finitos
+    """
+    if not texto:
+        return BBOX_MUNDO
+    partes = [float(v) for v in texto.split(',')]
+    if len(partes) != 4 or not all(math.isfinite(v) for v in partes):
+        raise ValueError('bbox debe ser oeste,sur,este,norte')
+    return tuple(partes)
+
+
+def _en_bbox(df, bbox):
+    oeste, sur, este, norte = bbox
+    return df[df['longitud'].between(oeste, este) & df['latitud'].between(sur, norte)]
+
+
+def _feature(lon, lat, propiedades):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [round(float(lon), 6), round(float(lat), 6)]},
+        'properties': propiedades
+    }
+
+
+def consultar_clusters(indice, zoom, bbox):
+    """
+    FeatureCollection visible en el bbox: clusters hasta ZOOM_MAX_CLUSTERS,
+    puntos sueltos (hasta MAX_PUNTOS_CLUSTER) por encima
+    """
+    zoom = max(0, min(int(zoom), ZOOM_MAXIMO))
+    colores = indice['colores']
+
+    if zoom > ZOOM_MAX_CLUSTERS:
+        visibles = _en_bbox(indice['puntos'], bbox)
+        truncado = len(visibles) > MAX_PUNTOS_CLUSTER
+        features = [
+            _feature(fila.longitud, fila.latitud, {
+                'cluster': False,
+                'id': int(fila.id),
+                'nivel': fila.nivel,
+                'hectareas': round(float(fila.hectareas), 2),
+                'monto_asegurado': round(float(fila.monto_asegurado), 2)
+            })
+            for fila in visibles.head(MAX_PUNTOS_CLUSTER).itertuples(index=False)
+        ]
+        return {'type': 'FeatureCollection', 'modo': 'puntos', 'zoom': zoom,
+                'features': features, 'total': len(visibles), 'truncado': truncado}
+
+    visibles = _en_bbox(indice['zooms'][zoom], bbox)
+    features = []
+    for fila in visibles.to_dict('records'):
+        por_color = {
+            color: {
+                'clientes': int(fila[f'clientes_{color}']),
+                'hectareas': round(float(fila[f'hectareas_{color}']), 2),
+                'monto': round(float(fila[f'monto_{color}']), 2)
+            }
+            for color in colores if fila[f'clientes_{color}']
+        }
+        features.append(_feature(fila['longitud'], fila['latitud'], {
+            'cluster': True,
+            'total': int(fila['total']),
+            'por_color': por_color
+        }))
+
+    return {'type': 'FeatureCollection', 'modo': 'clusters', 'zoom': zoom, 'features': features,
+            'total': int(visibles['total'].sum()) if len(visibles) else 0, 'truncado': False}
@@ -0,0 +1,396 @@
+"""
+Capas de delimitación precompiladas (departamentos, provincias, distritos)
+Cada FeatureCollection se genera una sola vez desde DELIMITACIONES/ y se guarda
+en ASSETS_DIR como .geojson, .geojson.gz y .geojson.br (si brotli está
+instalado) con el hash del contenido en el nombre, junto a su versión
+TopoJSON cuantizada (.topojson, ?format=topojson). manifest.json indica la
+versión vigente de cada capa; solo se regenera si cambia el SHP de origen.
+
+Las URLs con hash son inmutables (Cache-Control: immutable); las rutas
+clásicas /api/delimitaciones/<capa> sirven los mismos bytes con ETag.
+Los filtros (?bbox=, ?departamento=, ?provincia=) se resuelven con un índice
+en memoria construido a partir de la misma capa.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from SERVICIOS.geojson import (
+    PRECISION_COORDENADAS, coleccion_json, escribir_atomico,
+    feature_collection, features_json, guardar_precomprimido, propiedades_a_json
+)
+from SERVICIOS.json_rapido import dumps
+from SERVICIOS.topojson import CUANTIZACION, topologia
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo): sin bloqueo entre procesos
+    fcntl = None
+
+BASE_DIR = Path(__file__).parent.parent
+DELIMITACIONES_DIR = BASE_DIR / 'DELIMITACIONES'
+CACHE_DIR = Path(os.getenv('CACHE_DIR', str(BASE_DIR / 'TEMP' / 'cache')))
+ASSETS_DIR = CACHE_DIR / 'delimitaciones'
+MANIFEST_PATH = ASSETS_DIR / 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_manifest = {}
+
+
+# ============================================================================
+# PROPIEDADES POR CAPA (mismo contrato que las rutas originales)
+# ============================================================================
+
+def _columna(gdf, nombre, defecto):
+    """Columna de la capa o `defecto` si no existe"""
+    return gdf[nombre] if nombre in gdf.columns else pd.Series(defecto, index=gdf.index, dtype=object)
+
+
+def _propiedades_departamentos(gdf):
+    # Primera columna de nombre con valor, en este orden de preferencia
+    nombre = pd.Series('Sin nombre', index=gdf.index, dtype=object)
+    for col in reversed(['DPTONOM02', 'DEPARTAMEN', 'NAME', 'NOMBDEP', 'DEPARTAMENTO']):
+        if col in gdf.columns:
+            valores = gdf[col]
+            con_valor = valores.notna() & (valores.astype(str) != '')
+            nombre = nombre.where(~con_valor, valores.astype(str).str.upper().str.strip())
+    return pd.DataFrame({'DEPARTAMEN': nombre, 'nombre': nombre, 'tipo': 'departamento'})
+
+
+def _propiedades_provincias(gdf):
+    provincia = _columna(gdf, 'PROVINCIA', 'Sin nombre')
+    return pd.DataFrame({
+        'PROVINCIA': provincia, 'DEPARTAMEN': _columna(gdf, 'DEPARTAMEN', ''),
+        'nombre': provincia, 'tipo': 'provincia'
+    })
+
+
+def _propiedades_distritos(gdf):
+    distrito = _columna(gdf, 'DISTRITO', 'Sin nombre')
+    return pd.DataFrame({
+        'DISTRITO': distrito, 'PROVINCIA': _columna(gdf, 'PROVINCIA', ''),
+        'DEPARTAMEN': _columna(gdf, 'DEPARTAMEN', ''), 'nombre': distrito, 'tipo': 'distrito'
+    })
+
+
+CAPAS = {
+    'departamentos': ('DEPARTAMENTOS/DEPARTAMENTOS.shp', _propiedades_departamentos),
+    'provincias': ('PROVINCIAS/PROVINCIAS.shp', _propiedades_provincias),
+    'distritos': ('DISTRITOS/DISTRITOS.shp', _propiedades_distritos),
+}
+
+
+# ============================================================================
+# CONSTRUCCIÓN
+# ============================================================================
+
+def _firma_fuente(shp_path):
+    """[tamaño, mtime_ns] del .shp y su .dbf: cambia si se reemplaza la capa"""
+    firma = []
+    for ruta in (shp_path, shp_path.with_suffix('.dbf')):
+        if ruta.exists():
+            st = ruta.stat()
+            firma.extend([st.st_size, st.st_mtime_ns])
+    return firma
+
+
+def _leer_manifest():
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _vigente(entrada, capa):
+    """True si la entrada del manifest corresponde al SHP actual y sus archivos existen"""
+    if not entrada:
+        return False
+    shp_path = DELIMITACIONES_DIR / CAPAS[capa][0]
+    return (entrada.get('fuente') == _firma_fuente(shp_path)
+            and entrada.get('precision') == PRECISION_COORDENADAS
+            and entrada.get('cuantizacion') == CUANTIZACION
+            and (ASSETS_DIR / entrada['archivo']).exists()
+            and (ASSETS_DIR / entrada['topojson']['archivo']).exists())
+
+
+def leer_capa(capa):
+    """
+    Capa en EPSG:4326 y sus propiedades publicadas
+
+    Returns:
+        Tupla (GeoDataFrame, DataFrame de propiedades con el mismo índice)
+
+    Raises:
+        FileNotFoundError: Si el SHP no existe
+    """
+    shp_rel, propiedades = CAPAS[capa]
+    shp_path = DELIMITACIONES_DIR / shp_rel
+    if not shp_path.exists():
+        raise FileNotFoundError(f'Shapefile no encontrado: {shp_path}')
+
+    gdf = gpd.read_file(str(shp_path))
+    # Leaflet trabaja en WGS84
+    if gdf.crs and gdf.crs != 'EPSG:4326':
+        gdf = gdf.to_crs('EPSG:4326')
+    return gdf, propiedades(gdf)
+
+
+def serializar_capa(capa):
+    """
+    FeatureCollection (coordenadas redondeadas a PRECISION_GEOJSON decimales) y
+    Topology (cuantizada a CUANTIZACION_TOPOJSON) de la capa en EPSG:4326
+
+    Returns:
+        Tupla (bytes GeoJSON, bytes TopoJSON, número de features)
+
+    Raises:
+        FileNotFoundError: Si el SHP no existe
+    """
+    gdf, propiedades = leer_capa(capa)
+    extra = {'total': len(gdf)}
+    geojson = feature_collection(gdf.geometry, propiedades, extra=extra)
+    topojson = topologia(gdf.geometry, propiedades, nombre=capa, extra=extra)
+    return bytes(geojson), bytes(topojson), len(gdf)
+
+
+def construir_capa(capa):
+    """
+    Genera los archivos con hash de una capa y retorna su entrada de manifest
+
+    Returns:
+        Dict {'hash', 'archivo', 'total', 'bytes', 'codificaciones', 'fuente', 'precision',
+              'cuantizacion', 'topojson': {'archivo', 'bytes', 'codificaciones'}}
+    """
+    shp_path = DELIMITACIONES_DIR / CAPAS[capa][0]
+    fuente = _firma_fuente(shp_path)
+    datos, topo, total = serializar_capa(capa)
+    version = hashlib.sha256(datos + topo).hexdigest()[:16]
+    archivo = f'{capa}.{version}.geojson'
+    archivo_topo = f'{capa}.{version}.topojson'
+
+    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+    codificaciones = guardar_precomprimido(ASSETS_DIR / archivo, datos)
+    codificaciones_topo = guardar_precomprimido(ASSETS_DIR / archivo_topo, topo)
+
+    # Versiones anteriores de la misma capa
+    for viejo in ASSETS_DIR.glob(f'{capa}.*'):
+        if not viejo.name.startswith(f'{capa}.{version}.'):
+            viejo.unlink(missing_ok=True)
+
+    logger.info("Delimitación %s precompilada: %d features, %.1f MB GeoJSON, %.1f MB TopoJSON (%s)",
+                capa, total, len(datos) / 1e6, len(topo) / 1e6, ', '.join(codificaciones))
+    return {'hash': version, 'archivo': archivo, 'total': total, 'bytes': len(datos),
+            'codificaciones': codificaciones, 'fuente': fuente, 'precision': PRECISION_COORDENADAS,
+            'cuantizacion': CUANTIZACION,
+            'topojson': {'archivo': archivo_topo, 'bytes': len(topo), 'codificaciones': codificaciones_topo}}
+
+
+def construir_delimitaciones(capas=None, forzar=False):
+    """
+    Precompila las capas pendientes (o todas con forzar=True) y actualiza el manifest.
+    Un bloqueo de archivo evita que varios workers construyan a la vez.
+
+    Returns:
+        Manifest {capa: entrada}
+    """
+    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+    with _lock, open(ASSETS_DIR / '.lock', 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        manifest = _leer_manifest()
+        cambio = False
+        for capa in capas or CAPAS:
+            if not forzar and _vigente(manifest.get(capa), capa):
+                continue
+            try:
+                manifest[capa] = construir_capa(capa)
+                cambio = True
+            except FileNotFoundError as e:
+                logger.warning("Delimitación %s no disponible: %s", capa, e)
+                manifest.pop(capa, None)
+
+        if cambio:
+            escribir_atomico(MANIFEST_PATH, json.dumps(manifest, indent=2).encode('utf-8'))
+        _manifest.clear()
+        _manifest.update(manifest)
+        return dict(manifest)
+
+
+# ============================================================================
+# CONSULTA
+# ============================================================================
+
+def obtener_capa(capa, construir=True):
+    """
+    Entrada vigente del manifest para la capa (la construye si falta)
+
+    Returns:
+        Dict de construir_capa() o None si la capa no está disponible
+    """
+    entrada = _manifest.get(capa)
+    if _vigente(entrada, capa):
+        return entrada
+
+    entrada = _leer_manifest().get(capa)
+    if not _vigente(entrada, capa):
+        if not construir:
+            return None
+        entrada = construir_delimitaciones([capa]).get(capa)
+    if entrada:
+        _manifest[capa] = entrada
+    return entrada
+
+
+def url_capa(capa, entrada, formato='geojson'):
+    return f"/api/delimitaciones/{capa}.{entrada['hash']}.{formato}"
+
+
+def urls_delimitaciones():
+    """{capa: URL inmutable} de las capas ya precompiladas (no construye nada)"""
+    urls = {}
+    for capa in CAPAS:
+        entrada = obtener_capa(capa, construir=False)
+        if entrada:
+            urls[capa] = url_capa(capa, entrada)
+    return urls
+
+
+# ============================================================================
+# CONSULTAS FILTRADAS (bbox / departamento / provincia)
+# Índice en memoria por proceso: STRtree de geometrías, posiciones por
+# departamento y provincia, y cada Feature ya serializado, de modo que una
+# consulta solo elige posiciones y concatena bytes
+# ============================================================================
+
+_indices_lock = threading.Lock()
+_indices = {}  # capa -> (hash de la capa, índice)
+
+
+def _normalizada(propiedades, columna):
+    """Columna en mayúsculas sin espacios extremos ('' si no existe)"""
+    if columna not in propiedades.columns:
+        return pd.Series('', index=propiedades.index)
+    return propiedades[columna].fillna('').astype(str).str.upper().str.strip()
+
+
+def construir_indice(capa):
+    """Índice de consulta de la capa (ver sección)"""
+    gdf, propiedades = leer_capa(capa)
+    propiedades = propiedades.reset_index(drop=True)
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+
+    departamento = _normalizada(propiedades, 'DEPARTAMEN')
+    provincia = _normalizada(propiedades, 'PROVINCIA')
+    limites = np.round(shapely.bounds(geoms), PRECISION_COORDENADAS)
+    props_json = propiedades_a_json(propiedades, len(propiedades))
+
+    return {
+        'arbol': shapely.STRtree(geoms),
+        # Para TopoJSON de subconjuntos (la topología depende de la selección)
+        'geometrias': geoms,
+        'propiedades': propiedades,
+        'features': features_json(geoms, propiedades),
+        'sin_geometria': [
+            b'{"type":"Feature","geometry":null,"bbox":' + dumps(caja.tolist()) + b',"properties":' + p + b'}'
+            for caja, p in zip(limites, props_json)
+        ],
+        # {clave: array de posiciones}
+        'por_departamento': departamento.groupby(departamento).indices,
+        'por_provincia': departamento.groupby(departamento + '|' + provincia).indices,
+    }
+
+
+def obtener_indice(capa):
+    """
+    Índice vigente de la capa (se reconstruye si cambió su versión)
+
+    Returns:
+        Dict de construir_indice() o None si la capa no está disponible
+    """
+    entrada = obtener_capa(capa)
+    if entrada is None:
+        return None
+    with _indices_lock:
+        en_cache = _indices.get(capa)
+        if en_cache and en_cache[0] == entrada['hash']:
+            return en_cache[1]
+        indice = construir_indice(capa)
+        _indices[capa] = (entrada['hash'], indice)
+        logger.info("Índice de delimitación %s: %d features", capa, len(indice['features']))
+        return indice
+
+
+def parsear_bbox(texto):
+    """
+    'minx,miny,maxx,maxy' -> tupla de floats
+
+    Raises:
+        ValueError: Si no son 4 números finitos o el rango está invertido
+    """
+    partes = [float(v) for v in texto.split(',')]
+    if (len(partes) != 4 or not all(math.isfinite(v) for v in partes)
+            or partes[0] > partes[2] or partes[1] > partes[3]):
+        raise ValueError('bbox debe ser minx,miny,maxx,maxy')
+    return tuple(partes)
+
+
+def consultar_capa(capa, bbox=None, departamentos=None, provincia=None, solo_propiedades=False,
+                   formato='geojson'):
+    """
+    Features de la capa que cumplen todos los filtros dados
+
+    Args:
+        bbox: (minx, miny, maxx, maxy) en lon/lat; se incluyen las que lo intersectan
+        departamentos: Lista de nombres de departamento (cualquiera de ellos)
+        provincia: Nombre de provincia (dentro de los departamentos indicados)
+        solo_propiedades: Features sin geometría, con su bbox (solo GeoJSON)
+        formato: 'geojson' o 'topojson' (topología de la selección, calculada al vuelo)
+
+    Returns:
+        FragmentoJSON (FeatureCollection o Topology, con total) o None si la capa no existe
+    """
+    indice = obtener_indice(capa)
+    if indice is None:
+        return None
+
+    seleccion = None
+    if departamentos:
+        deptos = [d.upper().strip() for d in departamentos]
+        if provincia:
+            claves = [f'{d}|{provincia.upper().strip()}' for d in deptos]
+            grupos = [indice['por_provincia'].get(c) for c in claves]
+        else:
+            grupos = [indice['por_departamento'].get(d) for d in deptos]
+        grupos = [g for g in grupos if g is not None]
+        seleccion = np.unique(np.concatenate(grupos)) if grupos else np.array([], dtype='int64')
+    elif provincia:
+        sufijo = f'|{provincia.upper().strip()}'
+        grupos = [pos for clave, pos in indice['por_provincia'].items() if clave.endswith(sufijo)]
+        seleccion = np.unique(np.concatenate(grupos)) if grupos else np.array([], dtype='int64')
+
+    if bbox is not None:
+        en_bbox = indice['arbol'].query(shapely.box(*bbox), predicate='intersects')
+        seleccion = en_bbox if seleccion is None else np.intersect1d(seleccion, en_bbox)
+
+    if seleccion is None:
+        seleccion = np.arange(len(indice['features']))
+    seleccion = np.sort(seleccion)
+
+    if formato == 'topojson':
+        return topologia(indice['geometrias'][seleccion], indice['propiedades'].iloc[seleccion],
+                         nombre=capa, extra={'total': len(seleccion)})
+
+    origen = indice['sin_geometria'] if solo_propiedades else indice['features']
+    return coleccion_json([origen[i] for i in seleccion], extra={'total': len(seleccion)})
@@ -0,0 +1,229 @@
+"""
+Índice de la galería de mapas (CACHE_DIR/galeria.sqlite)
+Una fila por mapa generado (aviso, departamento, archivo, tamaño, mtime), de
+modo que /api/mapas, el panel de WhatsApp y /status consultan SQLite
+en lugar de recorrer OUTPUT/ en cada petición.
+
+procesar_aviso.py llama a indexar_aviso() al terminar los mapas de un aviso.
+Si el índice nunca se construyó (instalación existente), la primera consulta
+lo arma recorriendo OUTPUT/ una sola vez; reconstruir_galeria() lo rehace.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+OUTPUT_DIR = BASE_DIR / os.getenv('OUTPUT_DIR', 'OUTPUT')
+CACHE_DIR = Path(os.getenv('CACHE_DIR', str(BASE_DIR / 'TEMP' / 'cache')))
+DB_PATH = CACHE_DIR / 'galeria.sqlite'
+
+EXTENSIONES_MAPA = ('.webp', '.png')
+MAPAS_POR_PAGINA = int(os.getenv('MAPAS_POR_PAGINA', '48'))
+
+logger = logging.getLogger(__name__)
+
+_init_lock = threading.Lock()
+_inicializada = False
+
+
+# ============================================================================
+# ALMACÉN SQLITE
+# ============================================================================
+
+def _conectar():
+    """Conexión SQLite en modo WAL (lecturas concurrentes entre procesos)"""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(DB_PATH), timeout=5)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mapas (
+            numero_aviso INTEGER NOT NULL,
+            departamento TEXT NOT NULL COLLATE NOCASE,
+            archivo TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            PRIMARY KEY (numero_aviso, archivo)
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mapas_departamento ON mapas(departamento)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mapas_mtime ON mapas(mtime_ns)')
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)')
+    return conn
+
+
+def _filas_aviso(numero):
+    """Mapas presentes en OUTPUT/aviso_N como filas de la tabla"""
+    directorio = OUTPUT_DIR / f'aviso_{numero}'
+    if not directorio.is_dir():
+        return []
+    filas = []
+    for archivo in sorted(directorio.iterdir()):
+        if archivo.suffix.lower() in EXTENSIONES_MAPA and archivo.is_file():
+            st = archivo.stat()
+            filas.append((numero, archivo.stem, archivo.name, st.st_size, st.st_mtime_ns))
+    return filas
+
+
+def _reemplazar_aviso(conn, numero, filas):
+    conn.execute('DELETE FROM mapas WHERE numero_aviso = ?', (numero,))
+    conn.executemany('INSERT INTO mapas VALUES (?, ?, ?, ?, ?)', filas)
+
+
+# ============================================================================
+# ACTUALIZACIÓN (pipeline)
+# ============================================================================
+
+def indexar_aviso(numero):
+    """Reindexa los mapas de un aviso (se llama tras generarlos)"""
+    try:
+        filas = _filas_aviso(numero)
+        conn = _conectar()
+        with conn:
+            _reemplazar_aviso(conn, numero, filas)
+        conn.close()
+        logger.info("Galería: aviso %d indexado (%d mapas)", numero, len(filas))
+    except sqlite3.Error as e:
+        logger.warning("No se pudo indexar la galería del aviso %d: %s", numero, e)
+
+
+def reconstruir_galeria():
+    """
+    Rehace el índice completo recorriendo OUTPUT/
+
+    Returns:
+        Número de mapas indexados
+    """
+    numeros = []
+    if OUTPUT_DIR.exists():
+        for directorio in OUTPUT_DIR.iterdir():
+            sufijo = directorio.name[len('aviso_'):]
+            if directorio.is_dir() and directorio.name.startswith('aviso_') and sufijo.isdigit():
+                numeros.append(int(sufijo))
+
+    filas = [fila for numero in numeros for fila in _filas_aviso(numero)]
+    conn = _conectar()
+    with conn:
+        conn.execute('DELETE FROM mapas')
+        conn.executemany('INSERT INTO mapas VALUES (?, ?, ?, ?, ?)', filas)
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('construida', ?)", (str(time.time()),))
+    conn.close()
+    logger.info("Galería reconstruida: %d mapas de %d avisos", len(filas), len(numeros))
+    return len(filas)
+
+
+def _asegurar_indice():
+    """Construye el índice la primera vez (instalaciones previas al índice)"""
+    global _inicializada
+    if _inicializada:
+        return
+    with _init_lock:
+        if _inicializada:
+            return
+        conn = _conectar()
+        construida = conn.execute("SELECT 1 FROM meta WHERE clave = 'construida'").fetchone()
+        conn.close()
+        if not construida:
+            reconstruir_galeria()
+        _inicializada = True
+
+
+# ============================================================================
+# CONSULTAS
+# ============================================================================
+
+def _mapa(fila):
+    numero, departamento, archivo, tamano, mtime_ns = fila
+    url = f'/mapas/imagen/{numero}/{archivo}'
+    return {
+        'id': f'{numero}_{Path(archivo).stem}',
+        'nombre': archivo,
+        'numero_aviso': str(numero),
+        'departamento': departamento,
+        # Misma versión que SERVICIOS/archivos_output.version_archivo
+        'url': f'{url}?v={mtime_ns:x}{tamano:x}',
+        'fecha': datetime.fromtimestamp(mtime_ns / 1e9).strftime('%d/%m/%Y')
+    }
+
+
+def consultar_mapas(aviso=None, departamento=None, pagina=1, por_pagina=MAPAS_POR_PAGINA):
+    """
+    Mapas de la galería, más recientes primero
+
+    Args:
+        aviso: Número de aviso (opcional)
+        departamento: Nombre de departamento (opcional, sin distinguir mayúsculas)
+        pagina: Página desde 1
+        por_pagina: Mapas por página (None = todos)
+
+    Returns:
+        Tupla (lista de dicts de mapa, total sin paginar)
+    """
+    _asegurar_indice()
+    condiciones, params = [], []
+    if aviso is not None:
+        condiciones.append('m.numero_aviso = ?')
+        params.append(int(aviso))
+    if departamento:
+        condiciones.append('m.departamento = ?')
+        params.append(departamento.strip())
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+
+    conn = _conectar()
+    total = conn.execute(f'SELECT COUNT(*) FROM mapas m {where}', params).fetchone()[0]
+    # Avisos ordenados por su mapa más reciente (como el mtime de la carpeta)
+    query = f"""
+        SELECT m.numero_aviso, m.departamento, m.archivo, m.bytes, m.mtime_ns
+        FROM mapas m
+        JOIN (SELECT numero_aviso, MAX(mtime_ns) AS reciente FROM mapas GROUP BY numero_aviso) a
+          ON a.numero_aviso = m.numero_aviso
+        {where}
+        ORDER BY a.reciente DESC, m.numero_aviso DESC, m.departamento
+    """
+    if por_pagina:
+        query += ' LIMIT ? OFFSET ?'
+        params = params + [por_pagina, (max(pagina, 1) - 1) * por_pagina]
+    filas = conn.execute(query, params).fetchall()
+    conn.close()
+    return [_mapa(f) for f in filas], total
+
+
+def resumen_avisos(limite=None):
+    """
+    Avisos con mapas, más recientes primero
+
+    Returns:
+        Lista de dicts {'numero', 'mapas', 'departamentos', 'fecha', 'version'}
+        (version = mtime_ns del mapa más reciente: cambia al regenerarlos)
+    """
+    _asegurar_indice()
+    query = """
+        SELECT numero_aviso, COUNT(*), GROUP_CONCAT(departamento, '|'), MAX(mtime_ns)
+        FROM mapas GROUP BY numero_aviso ORDER BY MAX(mtime_ns) DESC
+    """
+    params = []
+    if limite:
+        query += ' LIMIT ?'
+        params.append(limite)
+    conn = _conectar()
+    filas = conn.execute(query, params).fetchall()
+    conn.close()
+    return [{
+        'numero': str(numero),
+        'mapas': cantidad,
+        'departamentos': sorted(deptos.split('|')),
+        'fecha': datetime.fromtimestamp(mtime_ns / 1e9).strftime('%d/%m/%Y'),
+        'version': mtime_ns
+    } for numero, cantidad, deptos, mtime_ns in filas]
+
+
+def totales_galeria():
+    """Dict {'avisos', 'mapas'} del índice"""
+    _asegurar_indice()
+    conn = _conectar()
+    avisos, mapas = conn.execute('SELECT COUNT(DISTINCT numero_aviso), COUNT(*) FROM mapas').fetchone()
+    conn.close()
+    return {'avisos': avisos, 'mapas': mapas}
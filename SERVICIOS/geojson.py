@@ -0,0 +1,214 @@
+"""
+Serialización GeoJSON vectorizada
+Las geometrías se redondean y convierten a JSON en bloque (shapely.transform +
+shapely.to_geojson, en C) y las propiedades se serializan con orjson si está
+instalado. El resultado son bytes listos para la respuesta: no se arma un
+dict por feature ni se pasa por jsonify.
+
+FragmentoJSON (SERVICIOS/json_rapido.py) permite incrustar esos bytes dentro
+de una respuesta mayor (p. ej. el bundle de decisiones) sin volver a parsearlos.
+Las capas estáticas se guardan además precomprimidas (gzip y brotli) para
+servirlas sin comprimir en cada petición: ver guardar_precomprimido().
+Las capas grandes generadas al vuelo se envían en streaming por lotes de
+features (respuesta_streaming), con memoria acotada por el tamaño del lote.
+"""
+import gzip
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from flask import Response, request
+from werkzeug.http import parse_accept_header
+
+from SERVICIOS.json_rapido import FragmentoJSON, dumps
+
+try:
+    import brotli
+    BROTLI_DISPONIBLE = True
+except ImportError:
+    BROTLI_DISPONIBLE = False
+
+# Decimales de las coordenadas (5 ≈ 1 m en lon/lat)
+PRECISION_COORDENADAS = int(os.getenv('PRECISION_GEOJSON', '5'))
+
+# Codificaciones precomprimidas en orden de preferencia: (Content-Encoding, sufijo)
+CODIFICACIONES = [('br', '.br'), ('gzip', '.gz')]
+
+# Streaming: features por lote y gzip al vuelo (0 para desactivarlo, p. ej. si
+# el proxy ya comprime)
+TAMANO_LOTE_FEATURES = int(os.getenv('TAMANO_LOTE_FEATURES', '2000'))
+GZIP_STREAMING = os.getenv('GZIP_STREAMING', '1') not in ('0', 'false', 'no')
+NIVEL_GZIP_STREAMING = 5
+
+
+# ============================================================================
+# FEATURECOLLECTION
+# ============================================================================
+
+def geometrias_a_json(geometrias, precision=PRECISION_COORDENADAS):
+    """
+    Geometrías -> lista de bytes GeoJSON ('null' si falta la geometría)
+
+    Args:
+        geometrias: GeoSeries o array de shapely
+        precision: Decimales de las coordenadas (None = sin redondear)
+    """
+    geoms = np.asarray(getattr(geometrias, 'values', geometrias), dtype=object)
+    if precision is not None and len(geoms):
+        # Vértices consecutivos que queden repetidos son GeoJSON válido y
+        # Leaflet los ignora; no se limpian para no colapsar anillos pequeños
+        geoms = shapely.transform(geoms, lambda coords: np.round(coords, precision))
+    textos = shapely.to_geojson(geoms)
+    return [b'null' if t is None else t.encode('utf-8') for t in textos]
+
+
+def propiedades_a_json(propiedades, n):
+    """DataFrame o lista de dicts -> lista de bytes JSON (NaN -> null); None = {}"""
+    if propiedades is None:
+        return [b'{}'] * n
+    if isinstance(propiedades, pd.DataFrame):
+        propiedades = propiedades.astype(object).where(propiedades.notna(), None).to_dict('records')
+    return [dumps(p) for p in propiedades]
+
+
+def features_json(geometrias, propiedades=None, precision=PRECISION_COORDENADAS):
+    """Lista de Features serializados (bytes), uno por geometría"""
+    geoms = geometrias_a_json(geometrias, precision)
+    props = propiedades_a_json(propiedades, len(geoms))
+    return [b'{"type":"Feature","geometry":' + g + b',"properties":' + p + b'}' for g, p in zip(geoms, props)]
+
+
+def coleccion_json(features, extra=None):
+    """Arma la FeatureCollection (FragmentoJSON) con Features ya serializados"""
+    return FragmentoJSON(b''.join(generar_coleccion(features, extra)))
+
+
+def feature_collection(geometrias, propiedades=None, precision=PRECISION_COORDENADAS, extra=None):
+    """
+    FeatureCollection como FragmentoJSON
+
+    Args:
+        geometrias: GeoSeries o array de shapely (EPSG:4326)
+        propiedades: DataFrame (una fila por geometría, columnas = propiedades)
+                     o lista de dicts; None = propiedades vacías
+        precision: Decimales de las coordenadas
+        extra: Dict de claves adicionales del nivel superior (total, dia_critico...)
+    """
+    return coleccion_json(features_json(geometrias, propiedades, precision), extra)
+
+
+# ============================================================================
+# STREAMING
+# ============================================================================
+
+def generar_coleccion(partes, extra=None):
+    """
+    FeatureCollection por partes: cabecera, features y cola
+
+    Args:
+        partes: Iterable de bytes, cada uno un Feature o varios separados por coma
+        extra: Dict de claves del nivel superior, o función sin argumentos que
+               lo retorna (se evalúa al final: totales calculados al recorrer)
+    """
+    yield b'{"type":"FeatureCollection","features":['
+    primero = True
+    for parte in partes:
+        if not parte:
+            continue
+        yield parte if primero else b',' + parte
+        primero = False
+    extra = extra() if callable(extra) else extra
+    yield b']' + b''.join(b',' + dumps(k) + b':' + dumps(v) for k, v in (extra or {}).items()) + b'}'
+
+
+def lotes_features(geometrias, propiedades=None, precision=PRECISION_COORDENADAS, tamano_lote=TAMANO_LOTE_FEATURES):
+    """
+    Features serializados de a `tamano_lote` (bytes separados por coma): solo
+    un lote de GeoJSON existe en memoria a la vez
+    """
+    geoms = np.asarray(getattr(geometrias, 'values', geometrias), dtype=object)
+    for inicio in range(0, len(geoms), tamano_lote):
+        fin = inicio + tamano_lote
+        if isinstance(propiedades, pd.DataFrame):
+            props = propiedades.iloc[inicio:fin]
+        else:
+            props = None if propiedades is None else propiedades[inicio:fin]
+        yield b','.join(features_json(geoms[inicio:fin], props, precision))
+
+
+def comprimir_gzip(partes, nivel=NIVEL_GZIP_STREAMING):
+    """Comprime un iterable de bytes en gzip a medida que se consume"""
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # wbits 31 = cabecera gzip
+    for parte in partes:
+        salida = compresor.compress(parte)
+        if salida:
+            yield salida
+    yield compresor.flush()
+
+
+def respuesta_streaming(partes, mimetype='application/json'):
+    """
+    Response en streaming a partir de un iterable de bytes, comprimida en
+    gzip al vuelo si el cliente lo acepta (desactivable con GZIP_STREAMING=0)
+    """
+    codificacion, _ = elegir_codificacion(request.headers.get('Accept-Encoding'),
+                                          ['gzip'] if GZIP_STREAMING else [])
+    respuesta = Response(comprimir_gzip(partes) if codificacion else partes, mimetype=mimetype)
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.headers['Vary'] = 'Accept-Encoding'
+    return respuesta
+
+
+# ============================================================================
+# ARCHIVOS PRECOMPRIMIDOS
+# ============================================================================
+
+def escribir_atomico(ruta, datos):
+    """Escribe en un temporal y renombra: los lectores nunca ven un archivo a medias"""
+    tmp = ruta.with_name(f'.{ruta.name}.{os.getpid()}.tmp')
+    tmp.write_bytes(datos)
+    os.replace(tmp, ruta)
+
+
+def guardar_precomprimido(ruta, datos):
+    """
+    Guarda `datos` en `ruta` junto a ruta.gz y ruta.br (si brotli está instalado)
+
+    Returns:
+        Lista de Content-Encoding disponibles, en orden de preferencia
+    """
+    escribir_atomico(ruta.with_name(ruta.name + '.gz'), gzip.compress(datos, compresslevel=9, mtime=0))
+    codificaciones = ['gzip']
+    if BROTLI_DISPONIBLE:
+        escribir_atomico(ruta.with_name(ruta.name + '.br'), brotli.compress(datos, quality=11))
+        codificaciones.insert(0, 'br')
+    else:
+        # Un .br de una generación anterior ya no corresponde a `datos`
+        ruta.with_name(ruta.name + '.br').unlink(missing_ok=True)
+    # El archivo sin comprimir al final: su existencia indica que el conjunto está completo
+    escribir_atomico(ruta, datos)
+    return codificaciones
+
+
+def elegir_codificacion(accept_encoding, disponibles):
+    """
+    Mejor codificación precomprimida aceptada por el cliente
+
+    Se respetan los q-values de Accept-Encoding (q=0 la rechaza, * cubre las
+    no listadas); a igual q gana el orden de CODIFICACIONES.
+
+    Returns:
+        Tupla (Content-Encoding o None, sufijo del archivo)
+    """
+    aceptadas = parse_accept_header(accept_encoding)
+    candidatas = [(aceptadas[codificacion], -orden, codificacion, sufijo)
+                  for orden, (codificacion, sufijo) in enumerate(CODIFICACIONES)
+                  if codificacion in disponibles and aceptadas[codificacion] > 0]
+    if not candidatas:
+        return None, ''
+    _, _, codificacion, sufijo = max(candidatas)
+    return codificacion, sufijo
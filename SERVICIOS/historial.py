@@ -0,0 +1,302 @@
+"""
+Historial de exposición entre avisos (Parquet columnar, particionado por fecha)
+
+    HISTORIAL_DIR/
+        exposiciones/fecha=YYYY-MM-DD/aviso_N.parquet  (clientes en Rojo/Naranja/Amarillo)
+        kpis/fecha=YYYY-MM-DD/aviso_N.parquet          (una fila de KPIs por aviso)
+
+Solo se agregan archivos: cada aviso escribe los suyos y reprocesarlo
+reemplaza únicamente esos. Las consultas usan pyarrow.dataset (poda por
+partición de fecha y por columnas) y agregan con group_by de Arrow, sin
+cargar el historial completo en pandas.
+"""
+import logging
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    HISTORIAL_DISPONIBLE = True
+except ImportError:
+    pa = None
+    ds = None
+    pq = None
+    HISTORIAL_DISPONIBLE = False
+
+BASE_DIR = Path(__file__).parent.parent
+HISTORIAL_DIR = Path(os.getenv('HISTORIAL_DIR', str(BASE_DIR / 'HISTORIAL')))
+
+NIVELES_EXPUESTOS = ['Rojo', 'Naranja', 'Amarillo']
+COLORES_HISTORIAL = ['Rojo', 'Naranja', 'Amarillo', 'Verde']
+MAX_TOP_HISTORIAL = 100
+
+# Dimensiones de /api/historial?tipo=top -> columnas de agrupación
+DIMENSIONES_TOP = {
+    'entidad': ['entidad_id', 'entidad_nombre'],
+    'cultivo': ['cultivo_id', 'cultivo_nombre'],
+    'departamento': ['departamento'],
+    'provincia': ['departamento', 'provincia'],
+    'distrito': ['departamento', 'provincia', 'distrito'],
+    'cliente': ['cliente_id'],
+}
+ORDENES_TOP = ['avisos', 'clientes', 'hectareas', 'monto']
+
+logger = logging.getLogger(__name__)
+
+
+def _schema_exposiciones():
+    return pa.schema([
+        ('numero_aviso', pa.int64()),
+        ('cliente_id', pa.int64()),
+        ('nivel', pa.string()),
+        ('en_zona', pa.bool_()),
+        ('entidad_id', pa.int64()),
+        ('entidad_nombre', pa.string()),
+        ('cultivo_id', pa.int64()),
+        ('cultivo_nombre', pa.string()),
+        ('departamento', pa.string()),
+        ('provincia', pa.string()),
+        ('distrito', pa.string()),
+        ('hectareas', pa.float64()),
+        ('monto_asegurado', pa.float64()),
+    ])
+
+
+def _schema_kpis():
+    campos = [('numero_aviso', pa.int64()), ('dia', pa.int64()), ('fuente', pa.string()),
+              ('zonas_afectadas', pa.int64())]
+    for prefijo in ['', 'afectados_'] + [f'{color.lower()}_' for color in COLORES_HISTORIAL]:
+        campos += [(f'{prefijo}clientes', pa.int64()), (f'{prefijo}hectareas', pa.float64()),
+                   (f'{prefijo}poliza', pa.float64())]
+    return pa.schema(campos + [('registrado_en', pa.string())])
+
+
+def _particionamiento():
+    return ds.partitioning(pa.schema([('fecha', pa.string())]), flavor='hive')
+
+
+# ============================================================================
+# ESCRITURA
+# ============================================================================
+
+def normalizar_fecha(valor):
+    """fecha_emision del aviso (str/date/datetime) -> 'YYYY-MM-DD' (hoy si no se puede leer)"""
+    if isinstance(valor, (date, datetime)):
+        return valor.strftime('%Y-%m-%d')
+    fecha = pd.to_datetime(valor, errors='coerce') if valor else pd.NaT
+    return (date.today() if pd.isna(fecha) else fecha).strftime('%Y-%m-%d')
+
+
+def _escribir_particion(tabla, coleccion, fecha, numero_aviso, grupos=None):
+    """
+    Escribe aviso_N.parquet en su partición y borra versiones en otras fechas
+    
+    Args:
+        grupos: Lista de tablas a escribir como row groups separados (las
+                estadísticas por row group permiten saltarlos al filtrar)
+    """
+    nombre = f'aviso_{numero_aviso}.parquet'
+    for anterior in (HISTORIAL_DIR / coleccion).glob(f'fecha=*/{nombre}'):
+        if anterior.parent.name != f'fecha={fecha}':
+            anterior.unlink()
+
+    destino = HISTORIAL_DIR / coleccion / f'fecha={fecha}' / nombre
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    # Prefijo '.': pyarrow.dataset ignora el temporal mientras se escribe
+    tmp = destino.with_name(f'.{nombre}.{os.getpid()}.tmp')
+    with pq.ParquetWriter(str(tmp), tabla.schema) as writer:
+        for grupo in grupos or [tabla]:
+            writer.write_table(grupo)
+    os.replace(tmp, destino)
+    return destino
+
+
+def _columna_arrow(valores, tipo):
+    """Serie pandas (con NaN/NA) -> pa.Array del tipo del schema"""
+    serie = pd.Series(valores).astype(object)
+    return pa.array(serie.where(serie.notna(), None).tolist(), type=tipo)
+
+
+def _fila_kpis(numero_aviso, kpis):
+    """KPIs del aviso aplanados a una fila"""
+    fila = {
+        'numero_aviso': numero_aviso,
+        'dia': kpis.get('dia'),
+        'fuente': kpis.get('fuente'),
+        'zonas_afectadas': kpis.get('zonas_afectadas'),
+        'clientes': kpis['totales']['agricultores'],
+        'hectareas': kpis['totales']['hectareas'],
+        'poliza': kpis['totales']['poliza'],
+        'afectados_clientes': kpis['afectados']['agricultores'],
+        'afectados_hectareas': kpis['afectados']['hectareas'],
+        'afectados_poliza': kpis['afectados']['poliza'],
+    }
+    for color in COLORES_HISTORIAL:
+        datos = kpis['por_color'].get(color, {})
+        fila[f'{color.lower()}_clientes'] = datos.get('agricultores', 0)
+        fila[f'{color.lower()}_hectareas'] = datos.get('hectareas', 0.0)
+        fila[f'{color.lower()}_poliza'] = datos.get('poliza', 0.0)
+    fila['registrado_en'] = datetime.now().isoformat(timespec='seconds')
+    return fila
+
+
+def guardar_historial_aviso(numero_aviso, fecha, frame, kpis):
+    """
+    Agrega (o reemplaza) el aviso en el historial
+
+    Args:
+        numero_aviso: Número del aviso
+        fecha: fecha_emision del aviso (partición)
+        frame: Frame del motor de KPIs (decisiones.construir_frame_aviso)
+        kpis: KPIs del aviso (decisiones.obtener_kpis_aviso)
+
+    Returns:
+        Dict {'fecha', 'exposiciones'} con la partición y filas escritas
+
+    Raises:
+        RuntimeError: Si pyarrow no está instalado
+    """
+    if not HISTORIAL_DISPONIBLE:
+        raise RuntimeError('pyarrow no instalado: historial no disponible')
+
+    fecha = normalizar_fecha(fecha)
+    expuestos = frame[frame['nivel'].isin(NIVELES_EXPUESTOS)]
+    columnas = {
+        'numero_aviso': [numero_aviso] * len(expuestos),
+        'cliente_id': expuestos['id'],
+        'nivel': expuestos['nivel'],
+        'en_zona': expuestos['en_zona'].astype(bool),
+        'entidad_id': expuestos['entidad_id'],
+        'entidad_nombre': expuestos['entidad_nombre'],
+        'cultivo_id': expuestos['cultivo_id'],
+        'cultivo_nombre': expuestos['cultivo_nombre'],
+        'departamento': expuestos['departamento_norm'],
+        'provincia': expuestos['provincia_norm'],
+        'distrito': expuestos['distrito_norm'],
+        'hectareas': expuestos['hectareas'],
+        'monto_asegurado': expuestos['monto_asegurado'],
+    }
+    schema = _schema_exposiciones()
+    arrays = [_columna_arrow(columnas[campo.name], campo.type) for campo in schema]
+    tabla = pa.Table.from_arrays(arrays, schema=schema)
+    # Un row group por nivel: filtrar por nivel lee solo los grupos de ese nivel
+    grupos = [tabla.filter(ds.field('nivel') == nivel) for nivel in NIVELES_EXPUESTOS]
+    _escribir_particion(tabla, 'exposiciones', fecha, numero_aviso, grupos=[g for g in grupos if g.num_rows])
+    _escribir_particion(pa.Table.from_pylist([_fila_kpis(numero_aviso, kpis)], schema=_schema_kpis()),
+                        'kpis', fecha, numero_aviso)
+
+    logger.info("Historial: aviso %d (%s) con %d clientes expuestos", numero_aviso, fecha, len(expuestos))
+    return {'fecha': fecha, 'exposiciones': len(expuestos)}
+
+
+# ============================================================================
+# CONSULTAS
+# ============================================================================
+
+def _leer(coleccion, columnas, desde=None, hasta=None, filtro=None):
+    """Lee columnas de una colección con poda por fecha; None si está vacía"""
+    ruta = HISTORIAL_DIR / coleccion
+    if not ruta.exists() or not any(ruta.glob('fecha=*/*.parquet')):
+        return None
+
+    dataset = ds.dataset(str(ruta), format='parquet', partitioning=_particionamiento())
+    expresion = None
+    for condicion in (
+        ds.field('fecha') >= desde if desde else None,
+        ds.field('fecha') <= hasta if hasta else None,
+        filtro,
+    ):
+        if condicion is not None:
+            expresion = condicion if expresion is None else expresion & condicion
+    return dataset.to_table(columns=columnas, filter=expresion)
+
+
+def _filtro_exposiciones(niveles, entidad_id=None, cultivo_id=None, departamento=None, cliente_id=None):
+    """Expresión Arrow con los filtros de la consulta"""
+    expresion = ds.field('nivel').isin(niveles)
+    for campo, valor in (('entidad_id', entidad_id), ('cultivo_id', cultivo_id),
+                         ('departamento', departamento), ('cliente_id', cliente_id)):
+        if valor is not None:
+            expresion = expresion & (ds.field(campo) == valor)
+    return expresion
+
+
+def serie_exposicion(niveles, desde=None, hasta=None, **filtros):
+    """
+    Serie temporal por aviso: clientes, hectáreas y monto expuestos
+
+    Returns:
+        Lista de dicts {fecha, numero_aviso, clientes, hectareas, monto} por fecha
+    """
+    tabla = _leer('exposiciones', ['fecha', 'numero_aviso', 'cliente_id', 'hectareas', 'monto_asegurado'],
+                  desde, hasta, _filtro_exposiciones(niveles, **filtros))
+    if tabla is None or tabla.num_rows == 0:
+        return []
+
+    agregado = tabla.group_by(['fecha', 'numero_aviso']).aggregate([
+        ('cliente_id', 'count_distinct'), ('hectareas', 'sum'), ('monto_asegurado', 'sum')
+    ]).sort_by([('fecha', 'ascending'), ('numero_aviso', 'ascending')])
+
+    return [
+        {'fecha': fila['fecha'], 'numero_aviso': fila['numero_aviso'],
+         'clientes': fila['cliente_id_count_distinct'],
+         'hectareas': round(fila['hectareas_sum'] or 0.0, 2),
+         'monto': round(fila['monto_asegurado_sum'] or 0.0, 2)}
+        for fila in agregado.to_pylist()
+    ]
+
+
+def top_exposicion(por, niveles, n=10, orden='avisos', desde=None, hasta=None, **filtros):
+    """
+    Top-N de la dimensión `por` (DIMENSIONES_TOP) por exposición acumulada
+
+    Returns:
+        Lista de dicts con las columnas de la dimensión + avisos (número de
+        avisos distintos con exposición), clientes, hectareas y monto
+
+    Raises:
+        ValueError: Si la dimensión u orden no existen
+    """
+    if por not in DIMENSIONES_TOP:
+        raise ValueError(f'por debe ser uno de: {", ".join(DIMENSIONES_TOP)}')
+    if orden not in ORDENES_TOP:
+        raise ValueError(f'orden debe ser uno de: {", ".join(ORDENES_TOP)}')
+
+    claves = DIMENSIONES_TOP[por]
+    columnas = list(dict.fromkeys(claves + ['numero_aviso', 'cliente_id', 'hectareas', 'monto_asegurado']))
+    tabla = _leer('exposiciones', columnas, desde, hasta, _filtro_exposiciones(niveles, **filtros))
+    if tabla is None or tabla.num_rows == 0:
+        return []
+
+    agregaciones = [('numero_aviso', 'count_distinct'), ('hectareas', 'sum'), ('monto_asegurado', 'sum')]
+    if por != 'cliente':
+        agregaciones.append(('cliente_id', 'count_distinct'))
+    agregado = tabla.group_by(claves).aggregate(agregaciones)
+    agregado = agregado.rename_columns([{
+        'numero_aviso_count_distinct': 'avisos', 'cliente_id_count_distinct': 'clientes',
+        'hectareas_sum': 'hectareas', 'monto_asegurado_sum': 'monto'
+    }.get(nombre, nombre) for nombre in agregado.column_names])
+    if por == 'cliente':
+        agregado = agregado.append_column('clientes', pa.array([1] * agregado.num_rows, pa.int64()))
+
+    orden_por = [(orden, 'descending')] + [(c, 'descending') for c in ORDENES_TOP if c != orden]
+    agregado = agregado.sort_by(orden_por).slice(0, max(1, min(int(n), MAX_TOP_HISTORIAL)))
+
+    registros = agregado.to_pylist()
+    for registro in registros:
+        registro['hectareas'] = round(registro['hectareas'] or 0.0, 2)
+        registro['monto'] = round(registro['monto'] or 0.0, 2)
+    return registros
+
+
+def serie_kpis(desde=None, hasta=None):
+    """KPIs materializados de cada aviso del rango, ordenados por fecha"""
+    tabla = _leer('kpis', None, desde, hasta)
+    if tabla is None or tabla.num_rows == 0:
+        return []
+    return tabla.sort_by([('fecha', 'ascending'), ('numero_aviso', 'ascending')]).to_pylist()
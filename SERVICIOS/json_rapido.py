@@ -0,0 +1,178 @@
+"""
+Serialización JSON rápida (orjson con respaldo en json de la librería estándar)
+Convierte de forma nativa Decimal, date/datetime/time, escalares y arrays de
+NumPy y pd.NA/NaT, de modo que las rutas pueden entregar filas de la BD o de
+pandas tal cual, sin recorrerlas para convertir valores. NaN, ±inf, pd.NaT y
+datetime64('NaT') salen como null con ambos backends.
+
+ProveedorJSON lo registra como proveedor JSON de Flask (app.json): jsonify()
+y los retornos dict de las vistas pasan por aquí.
+"""
+import datetime
+import decimal
+import json
+import math
+
+import numpy as np
+import pandas as pd
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+    ORJSON_DISPONIBLE = True
+except ImportError:
+    ORJSON_DISPONIBLE = False
+
+
+class FragmentoJSON(bytes):
+    """JSON ya serializado que dumps() inserta tal cual"""
+
+
+def convertir_json(valor):
+    """Tipos que el backend JSON no conoce -> equivalentes JSON"""
+    # Antes que datetime: pd.NaT es subclase de datetime.datetime
+    if valor is pd.NA or valor is pd.NaT:
+        return None
+    if isinstance(valor, decimal.Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime.datetime, datetime.date, datetime.time)):
+        return valor.isoformat()
+    if isinstance(valor, np.datetime64):
+        return None if np.isnat(valor) else pd.Timestamp(valor).isoformat()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, np.ndarray):
+        if valor.dtype.kind == 'M':
+            # .flat conserva escalares datetime64 (astype(object) daría enteros en ns)
+            fechas = [convertir_json(v) for v in valor.flat]
+            return np.array(fechas, dtype=object).reshape(valor.shape).tolist()
+        return valor.tolist()
+    raise TypeError(f'Tipo no serializable a JSON: {type(valor).__name__}')
+
+
+def _sin_no_finitos(valor):
+    """NaN/±inf -> None (json estándar emitiría NaN/Infinity, que no es JSON)"""
+    if isinstance(valor, float):
+        return valor if math.isfinite(valor) else None
+    if isinstance(valor, dict):
+        return {clave: _sin_no_finitos(v) for clave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_sin_no_finitos(v) for v in valor]
+    return valor
+
+
+class _ContieneFragmento(Exception):
+    """El objeto incluye un FragmentoJSON: hay que ensamblarlo por partes"""
+
+
+def _serializar(obj):
+    """Serialización directa con el backend (falla si hay FragmentoJSON)"""
+    hallado = []
+
+    def por_defecto(valor):
+        if isinstance(valor, FragmentoJSON):
+            # orjson descarta la excepción original de default: se anota aparte
+            hallado.append(True)
+            raise _ContieneFragmento
+        convertido = convertir_json(valor)
+        return convertido if ORJSON_DISPONIBLE else _sin_no_finitos(convertido)
+
+    try:
+        if not ORJSON_DISPONIBLE:
+            return json.dumps(_sin_no_finitos(obj), default=por_defecto, ensure_ascii=False,
+                              separators=(',', ':')).encode('utf-8')
+        try:
+            return orjson.dumps(obj, default=por_defecto, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            if hallado:
+                raise
+            # orjson rechaza datetime64 NaT sin pasar por default: se reintenta
+            # con NumPy convertido por convertir_json
+            return orjson.dumps(obj, default=por_defecto, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        if hallado:
+            raise _ContieneFragmento from None
+        raise
+
+
+def _ensamblar(obj, partes):
+    """
+    Agrega a partes los bytes de obj, que contiene algún FragmentoJSON
+
+    Solo se descompone el camino hasta los fragmentos: cada hijo se intenta
+    serializar entero y únicamente se baja un nivel si contiene uno.
+    """
+    if isinstance(obj, FragmentoJSON):
+        partes.append(bytes(obj))
+        return
+    if isinstance(obj, dict):
+        partes.append(b'{')
+        for i, (clave, valor) in enumerate(obj.items()):
+            if i:
+                partes.append(b',')
+            try:
+                # {"clave":valor} sin las llaves: la clave se convierte igual que en el backend
+                partes.append(_serializar({clave: valor})[1:-1])
+            except _ContieneFragmento:
+                partes.append(_serializar({clave: None})[1:-len(b'null}')])
+                _ensamblar(valor, partes)
+        partes.append(b'}')
+        return
+    if isinstance(obj, (list, tuple)):
+        partes.append(b'[')
+        for i, valor in enumerate(obj):
+            if i:
+                partes.append(b',')
+            try:
+                partes.append(_serializar(valor))
+            except _ContieneFragmento:
+                _ensamblar(valor, partes)
+        partes.append(b']')
+        return
+    partes.append(_serializar(obj))
+
+
+def dumps(obj):
+    """
+    Serializa a bytes JSON (UTF-8, compacto)
+
+    Los FragmentoJSON se insertan tal cual, sin re-serializar: si el objeto
+    contiene alguno, la salida se arma por posición alrededor de ellos.
+    """
+    try:
+        return _serializar(obj)
+    except _ContieneFragmento:
+        partes = []
+        _ensamblar(obj, partes)
+        return b''.join(partes)
+
+
+def loads(datos):
+    """str o bytes JSON -> objeto Python"""
+    if ORJSON_DISPONIBLE:
+        return orjson.loads(datos)
+    return json.loads(datos)
+
+
+# ============================================================================
+# PROVEEDOR FLASK
+# ============================================================================
+
+class ProveedorJSON(JSONProvider):
+    """
+    Proveedor JSON de Flask respaldado por dumps()/loads()
+
+    A diferencia del proveedor por defecto no ordena las claves (se respeta
+    el orden de construcción) y las fechas salen en ISO 8601.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # Los bytes van directo al cuerpo, sin pasar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype='application/json')
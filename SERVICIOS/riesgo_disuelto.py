@@ -0,0 +1,200 @@
+"""
+Capa de riesgo disuelta por nivel
+El view_aviso.shp de SENAMHI trae miles de polígonos (uno por zona/distrito)
+que se solapan dentro de cada nivel. Para pintar el mapa basta con una
+geometría por nivel: se unen, se limpian (make_valid, solo partes
+poligonales) y se simplifican con dos tolerancias.
+
+Junto a cada SHP (TEMP/aviso_N/diaD/) se generan:
+    riesgo_disuelto.parquet          GeoParquet para MAPAS.py (tolerancia de impresión)
+    riesgo_disuelto.geojson(.gz/.br) GeoJSON para /shp-geojson (tolerancia web)
+
+Lo genera procesar_aviso.py tras descargar los SHP; para avisos procesados
+antes, las rutas lo generan bajo demanda. Si el SHP es más nuevo que la capa
+disuelta, la capa se considera vencida.
+"""
+import logging
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from SERVICIOS.geojson import CODIFICACIONES, feature_collection, guardar_precomprimido
+
+try:
+    import pyarrow  # noqa: F401  (requerido por GeoDataFrame.to_parquet)
+    PARQUET_DISPONIBLE = True
+except ImportError:
+    PARQUET_DISPONIBLE = False
+
+# Tolerancias de simplificación en metros (0 = sin simplificar)
+TOLERANCIA_WEB_M = float(os.getenv('TOLERANCIA_RIESGO_WEB_M', '100'))
+TOLERANCIA_IMPRESION_M = float(os.getenv('TOLERANCIA_RIESGO_IMPRESION_M', '20'))
+
+# CRS métrico para unir y simplificar (UTM 18S, el de DELIMITACIONES/)
+CRS_METRICO = 'EPSG:32718'
+
+NOMBRE_PARQUET = 'riesgo_disuelto.parquet'
+NOMBRE_GEOJSON = 'riesgo_disuelto.geojson'
+
+# Colores por nivel para Leaflet (guiado de MAPAS.py)
+COLORES_NIVEL = {
+    'Nivel 4': '#FF0000',  # Rojo - MUY_ALTO
+    'Nivel 3': '#FF8C00',  # Naranja - ALTO
+    'Nivel 2': '#FFFF00',  # Amarillo - MEDIO
+    'Nivel 1': '#90EE90'   # Verde - BAJO
+}
+COLOR_SIN_NIVEL = '#E8E8E8'
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# GEOMETRÍA
+# ============================================================================
+
+def _solo_poligonos(geom):
+    """Descarta puntos/líneas que make_valid o la unión dejen en colecciones"""
+    partes = shapely.get_parts(geom)
+    partes = partes[np.isin(shapely.get_type_id(partes), (3, 6))]  # Polygon, MultiPolygon
+    if len(partes) == 0:
+        return None
+    return shapely.make_valid(shapely.union_all(partes)) if len(partes) > 1 else partes[0]
+
+
+def nombres_zona(gdf):
+    """Nombre de cada polígono del SHP para el popup: DISTRITO, PROVINCIA o 'Sin nombre'"""
+    for columna in ('DISTRITO', 'PROVINCIA'):
+        if columna in gdf.columns:
+            return gdf[columna]
+    return pd.Series('Sin nombre', index=gdf.index)
+
+
+def disolver_por_nivel(gdf):
+    """
+    Une los polígonos de cada nivel en una sola geometría válida
+
+    Args:
+        gdf: GeoDataFrame con columna 'nivel' (cualquier CRS)
+
+    Returns:
+        GeoDataFrame [nivel, name, geometry] en CRS_METRICO, una fila por
+        nivel; name une los nombres (nombres_zona) de las partes disueltas
+    """
+    capa = gdf.loc[gdf['nivel'].notna() & gdf.geometry.notna()]
+    capa = gpd.GeoDataFrame({'nivel': capa['nivel'], 'name': nombres_zona(capa)},
+                            geometry=capa.geometry, crs=gdf.crs)
+    if capa.crs is not None and capa.crs != CRS_METRICO:
+        capa = capa.to_crs(CRS_METRICO)
+
+    geoms = shapely.make_valid(capa.geometry.values)
+    nombres = capa['name'].values
+    niveles, names, geometrias = [], [], []
+    for nivel, posiciones in capa.groupby('nivel').indices.items():
+        union = _solo_poligonos(shapely.union_all(geoms[posiciones]))
+        if union is not None and not union.is_empty:
+            niveles.append(nivel)
+            names.append(', '.join(sorted({str(n).strip() for n in nombres[posiciones]
+                                           if pd.notna(n) and str(n).strip()})) or 'Sin nombre')
+            geometrias.append(union)
+
+    return gpd.GeoDataFrame({'nivel': niveles, 'name': names}, geometry=geometrias, crs=CRS_METRICO)
+
+
+def simplificar(disuelta, tolerancia_m):
+    """Simplifica preservando topología y devuelve la capa en EPSG:4326"""
+    geoms = disuelta.geometry.values
+    if tolerancia_m > 0:
+        geoms = shapely.simplify(geoms, tolerancia_m, preserve_topology=True)
+        geoms = np.array([_solo_poligonos(shapely.make_valid(g)) for g in geoms], dtype=object)
+    capa = gpd.GeoDataFrame({'nivel': disuelta['nivel'].values, 'name': disuelta['name'].values},
+                            geometry=list(geoms), crs=CRS_METRICO)
+    capa = capa[capa.geometry.notna() & ~capa.geometry.is_empty]
+    return capa.to_crs('EPSG:4326').reset_index(drop=True)
+
+
+# ============================================================================
+# GENERACIÓN
+# ============================================================================
+
+def rutas_disueltas(shp_path):
+    """Tupla (ruta GeoParquet, ruta GeoJSON) junto al SHP"""
+    directorio = Path(shp_path).parent
+    return directorio / NOMBRE_PARQUET, directorio / NOMBRE_GEOJSON
+
+
+def _vigente(ruta, shp_path):
+    """True si `ruta` existe y no es anterior al SHP"""
+    return ruta.exists() and ruta.stat().st_mtime_ns >= Path(shp_path).stat().st_mtime_ns
+
+
+def generar_capa_disuelta(shp_path, dia=None):
+    """
+    Genera GeoParquet (impresión) y GeoJSON precomprimido (web) del SHP
+
+    Args:
+        shp_path: Ruta al view_aviso.shp de un día
+        dia: Nombre del día ('dia1'...); por defecto el de la carpeta
+
+    Returns:
+        Dict {'niveles', 'vertices_origen', 'vertices_web', 'parquet', 'geojson'}
+    """
+    shp_path = Path(shp_path)
+    dia = dia or shp_path.parent.name
+    ruta_parquet, ruta_geojson = rutas_disueltas(shp_path)
+
+    gdf = gpd.read_file(str(shp_path))
+    disuelta = disolver_por_nivel(gdf)
+
+    impresion = simplificar(disuelta, TOLERANCIA_IMPRESION_M)
+    if PARQUET_DISPONIBLE:
+        tmp = ruta_parquet.with_name(f'.{ruta_parquet.name}.{os.getpid()}.tmp')
+        impresion.to_parquet(tmp, index=False)
+        os.replace(tmp, ruta_parquet)
+
+    # Mismo contrato que /shp-geojson: nivel, color, name + dia_critico/total
+    # (name: zonas del nivel separadas por coma en lugar de una por feature)
+    web = simplificar(disuelta, TOLERANCIA_WEB_M)
+    propiedades = pd.DataFrame({
+        'nivel': web['nivel'],
+        'color': web['nivel'].map(COLORES_NIVEL).fillna(COLOR_SIN_NIVEL),
+        'name': web['name']
+    })
+    datos = feature_collection(web.geometry, propiedades, extra={'dia_critico': dia, 'total': len(web)})
+    guardar_precomprimido(ruta_geojson, bytes(datos))
+
+    resultado = {
+        'niveles': len(web),
+        'vertices_origen': int(shapely.get_num_coordinates(gdf.geometry.values).sum()),
+        'vertices_web': int(shapely.get_num_coordinates(web.geometry.values).sum()),
+        'parquet': str(ruta_parquet) if PARQUET_DISPONIBLE else None,
+        'geojson': str(ruta_geojson)
+    }
+    logger.info("Capa disuelta %s: %d niveles, %d -> %d vértices (web)",
+                shp_path, resultado['niveles'], resultado['vertices_origen'], resultado['vertices_web'])
+    return resultado
+
+
+def geojson_disuelto(shp_path, generar=True):
+    """
+    GeoJSON web vigente del SHP (lo genera si falta o está vencido)
+
+    Returns:
+        Tupla (Path del .geojson, lista de Content-Encoding disponibles) o None
+    """
+    _, ruta_geojson = rutas_disueltas(shp_path)
+    if not _vigente(ruta_geojson, shp_path):
+        if not generar:
+            return None
+        try:
+            generar_capa_disuelta(shp_path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("No se pudo generar capa disuelta de %s: %s", shp_path, e)
+            return None
+
+    codificaciones = [cod for cod, sufijo in CODIFICACIONES
+                      if ruta_geojson.with_name(ruta_geojson.name + sufijo).exists()]
+    return ruta_geojson, codificaciones
@@ -0,0 +1,429 @@
+"""
+Snapshot columnar de la tabla clientes
+Materializa las columnas que usan las rutas de decisiones (con entidad y cultivo)
+en un archivo Parquet versionado, compartido entre workers de gunicorn.
+
+La versión se calcula con COUNT(*) + MAX(ultima_actualizacion): si no cambió,
+se reutiliza el snapshot en memoria o el Parquet ya escrito por otro worker.
+actualizar_snapshot_incremental() aplica solo las filas cambiadas desde la
+última versión (feed de cambios por sondeo de ultima_actualizacion).
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from CONFIG.db import get_connection, iterar_lotes_columnares
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_DISPONIBLE = True
+except ImportError:
+    pa = None
+    pq = None
+    PARQUET_DISPONIBLE = False
+
+BASE_DIR = Path(__file__).parent.parent
+CACHE_DIR = Path(os.getenv('CACHE_DIR', str(BASE_DIR / 'TEMP' / 'cache')))
+
+# Margen al releer cambios: transacciones largas pueden confirmar filas con
+# ultima_actualizacion anterior a la última marca vista
+VENTANA_CAMBIOS_SEG = float(os.getenv('VENTANA_CAMBIOS_SEG', '60'))
+MAX_REINTENTOS_INCREMENTAL = 3
+
+# Segundos durante los que se confía en la última versión consultada
+# (evita repetir el chequeo cuando una misma petición pide el snapshot varias veces)
+VERSION_TTL = float(os.getenv('SNAPSHOT_VERSION_TTL', '5'))
+
+# Snapshots Parquet que se conservan en disco (el vigente y el anterior)
+SNAPSHOTS_CONSERVADOS = 2
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS_SELECT_SNAPSHOT = """
+           c.id, c.dni_ruc, c.nombre, c.apellido, c.telefono, c.correo,
+           c.latitud::float8, c.longitud::float8,
+           c.departamento, c.provincia, c.distrito,
+           UPPER(TRIM(c.departamento)) AS departamento_norm,
+           UPPER(TRIM(COALESCE(c.provincia, 'SIN PROVINCIA'))) AS provincia_norm,
+           UPPER(TRIM(COALESCE(c.distrito, 'SIN DISTRITO'))) AS distrito_norm,
+           c.hectareas::float8, c.monto_asegurado::float8, c.estado,
+           c.entidad_id, e.nombre AS entidad_nombre,
+           c.cultivo_id, tc.nombre AS cultivo_nombre,
+           c.distrito_id, c.distrito_asignado_en IS NOT NULL AS distrito_asignado
+"""
+JOINS_SNAPSHOT = """
+    FROM clientes c
+    LEFT JOIN entidades e ON c.entidad_id = e.id
+    LEFT JOIN tabla_cultivos tc ON c.cultivo_id = tc.id
+"""
+QUERY_SNAPSHOT = f"SELECT {COLUMNAS_SELECT_SNAPSHOT} {JOINS_SNAPSHOT} ORDER BY c.id"
+
+# Filas tocadas desde una marca (ultima_actualizacion, distrito_asignado_en);
+# {condiciones} se arma por columna en _leer_cambios
+QUERY_CAMBIOS = f"""
+    SELECT {COLUMNAS_SELECT_SNAPSHOT}, c.ultima_actualizacion, c.distrito_asignado_en
+    {JOINS_SNAPSHOT}
+    WHERE {{condiciones}}
+    ORDER BY c.id
+"""
+CONDICION_CAMBIO = "c.{columna} >= %s - %s * INTERVAL '1 second'"
+CONDICION_SIN_MARCA = "c.{columna} IS NOT NULL"
+
+# (columna, dtype NumPy al leer, tipo Arrow al escribir)
+COLUMNAS_SNAPSHOT = [
+    ('id', 'i8', 'int64'),
+    ('dni_ruc', 'O', 'string'),
+    ('nombre', 'O', 'string'),
+    ('apellido', 'O', 'string'),
+    ('telefono', 'O', 'string'),
+    ('correo', 'O', 'string'),
+    ('latitud', 'f8', 'float64'),
+    ('longitud', 'f8', 'float64'),
+    ('departamento', 'O', 'string'),
+    ('provincia', 'O', 'string'),
+    ('distrito', 'O', 'string'),
+    ('departamento_norm', 'O', 'string'),
+    ('provincia_norm', 'O', 'string'),
+    ('distrito_norm', 'O', 'string'),
+    ('hectareas', 'f8', 'float64'),
+    ('monto_asegurado', 'f8', 'float64'),
+    ('estado', 'O', 'string'),
+    ('entidad_id', 'O', 'int64'),
+    ('entidad_nombre', 'O', 'string'),
+    ('cultivo_id', 'O', 'int64'),
+    ('cultivo_nombre', 'O', 'string'),
+    ('distrito_id', 'O', 'int64'),
+    ('distrito_asignado', 'O', 'bool_'),
+]
+COLUMNAS_ENTERAS_NULABLES = ['entidad_id', 'cultivo_id', 'distrito_id']
+
+_lock = threading.Lock()
+_cache = {'version': None, 'df': None, 'estado': None,
+          'version_consultada': None, 'estado_consultado': None, 'consultada_en': 0.0}
+
+
+def obtener_estado_clientes():
+    """
+    Estado de la tabla clientes: (COUNT(*), MAX(ultima_actualizacion),
+    MAX(distrito_asignado_en)); las marcas sirven de punto de partida del feed
+    
+    Raises:
+        psycopg2.Error: Si falla la consulta
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*), MAX(ultima_actualizacion), MAX(distrito_asignado_en) FROM clientes"
+        )
+        estado = tuple(cursor.fetchone())
+        cursor.close()
+    finally:
+        conn.close()
+    return estado
+
+
+def _version_de_estado(estado):
+    total, max_actualizacion, max_asignacion = estado
+    clave = '|'.join([str(total)] + [ts.isoformat() if ts else '' for ts in (max_actualizacion, max_asignacion)])
+    return hashlib.sha1(clave.encode('utf-8')).hexdigest()[:16]
+
+
+def obtener_version_clientes():
+    """
+    Versión barata de la tabla clientes: hash de COUNT(*) + MAX(ultima_actualizacion)
+    + MAX(distrito_asignado_en) (la asignación de distritos no toca ultima_actualizacion)
+    
+    Returns:
+        str de 16 caracteres hex
+        
+    Raises:
+        psycopg2.Error: Si falla la consulta
+    """
+    return _version_de_estado(obtener_estado_clientes())
+
+
+def _registrar_estado(estado):
+    version = _version_de_estado(estado)
+    _cache['version_consultada'] = version
+    _cache['estado_consultado'] = estado
+    _cache['consultada_en'] = time.monotonic()
+    return version
+
+
+def _estado_vigente():
+    """(versión, estado) actuales respetando VERSION_TTL"""
+    if _cache['version_consultada'] and time.monotonic() - _cache['consultada_en'] < VERSION_TTL:
+        return _cache['version_consultada'], _cache['estado_consultado']
+    
+    estado = obtener_estado_clientes()
+    return _registrar_estado(estado), estado
+
+
+def _version_vigente():
+    """Versión actual respetando VERSION_TTL"""
+    return _estado_vigente()[0]
+
+
+def _ruta_snapshot(version):
+    return CACHE_DIR / f'clientes_{version}.parquet'
+
+
+def _normalizar_tipos(df):
+    """Ajusta tipos tras leer (ids nulables como Int64)"""
+    for col in COLUMNAS_ENTERAS_NULABLES:
+        if col in df.columns:
+            df[col] = df[col].astype('Int64')
+    return df
+
+
+def _construir_en_memoria():
+    """Construye el snapshot sin Parquet (fallback sin pyarrow)"""
+    columnas = [(nombre, dtype) for nombre, dtype, _ in COLUMNAS_SNAPSHOT]
+    lotes = [pd.DataFrame(lote) for lote in iterar_lotes_columnares(QUERY_SNAPSHOT, columnas)]
+    if not lotes:
+        return pd.DataFrame(columns=[nombre for nombre, _ in columnas])
+    return _normalizar_tipos(pd.concat(lotes, ignore_index=True))
+
+
+def _schema_snapshot():
+    return pa.schema([(nombre, getattr(pa, tipo)()) for nombre, _, tipo in COLUMNAS_SNAPSHOT])
+
+
+def _tabla_arrow(columnas, schema):
+    """Dict/DataFrame de columnas -> pa.Table con el schema del snapshot"""
+    arrays = [pa.array(columnas[campo.name], type=campo.type, from_pandas=True) for campo in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _construir_parquet(version, df=None):
+    """
+    Escribe el snapshot Parquet y lo publica de forma atómica para que otros
+    workers lo encuentren completo. Sin df, lee la tabla por lotes (memoria
+    acotada); con df (actualización incremental), escribe ese DataFrame.
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    destino = _ruta_snapshot(version)
+    tmp = destino.with_name(f'{destino.name}.{os.getpid()}.tmp')
+    
+    schema = _schema_snapshot()
+    columnas = [(nombre, dtype) for nombre, dtype, _ in COLUMNAS_SNAPSHOT]
+    
+    writer = pq.ParquetWriter(str(tmp), schema)
+    try:
+        if df is not None:
+            # from_pandas toma NaN/None/pd.NA como null columna a columna (también
+            # en Int64): no hace falta copiar el frame completo a object
+            writer.write_table(_tabla_arrow(df, schema))
+        else:
+            for lote in iterar_lotes_columnares(QUERY_SNAPSHOT, columnas):
+                writer.write_table(_tabla_arrow(lote, schema))
+    finally:
+        writer.close()
+    
+    os.replace(tmp, destino)
+    
+    # Eliminar snapshots viejos conservando los SNAPSHOTS_CONSERVADOS más
+    # recientes: otro worker puede estar por leer la versión anterior
+    publicados = []
+    for ruta in CACHE_DIR.glob('clientes_*.parquet'):
+        try:
+            publicados.append((ruta.stat().st_mtime_ns, ruta))
+        except OSError:
+            pass
+    publicados.sort(reverse=True)
+    for _, viejo in publicados[SNAPSHOTS_CONSERVADOS:]:
+        if viejo != destino:
+            try:
+                viejo.unlink()
+            except OSError:
+                pass
+    
+    logger.info("Snapshot de clientes %s escrito en %s", version, destino)
+    return destino
+
+
+def _leer_parquet(ruta):
+    tabla = pq.read_table(str(ruta), memory_map=True)
+    return _normalizar_tipos(tabla.to_pandas())
+
+
+def obtener_snapshot_clientes():
+    """
+    Retorna el DataFrame de clientes (todas las filas, con entidad y cultivo)
+    
+    Se reconstruye solo cuando cambia la versión de la tabla. El DataFrame es
+    compartido: los llamadores no deben modificarlo en sitio.
+    
+    Raises:
+        psycopg2.Error: Si falla el chequeo de versión o la construcción
+    """
+    version, estado = _estado_vigente()
+    if _cache['version'] == version and _cache['df'] is not None:
+        return _cache['df']
+    
+    with _lock:
+        if _cache['version'] == version and _cache['df'] is not None:
+            return _cache['df']
+        
+        if PARQUET_DISPONIBLE:
+            ruta = _ruta_snapshot(version)
+            if not ruta.exists():
+                ruta = _construir_parquet(version)
+            try:
+                df = _leer_parquet(ruta)
+            except FileNotFoundError:
+                # Borrado por la limpieza de otro worker entre exists() y la lectura
+                df = _leer_parquet(_construir_parquet(version))
+        else:
+            df = _construir_en_memoria()
+        
+        # El estado que produjo la versión es la marca de partida del feed de cambios
+        _cache['version'] = version
+        _cache['df'] = df
+        _cache['estado'] = estado
+        logger.info("Snapshot de clientes cargado: versión %s, %d filas", version, len(df))
+        return df
+
+
+def obtener_version_snapshot():
+    """
+    Versión vigente de la tabla clientes (respeta VERSION_TTL), útil como parte
+    de la clave de cachés derivadas del snapshot
+    
+    Raises:
+        psycopg2.Error: Si falla el chequeo de versión
+    """
+    return _version_vigente()
+
+
+def obtener_clientes_activos():
+    """Snapshot filtrado a clientes con estado 'activo'"""
+    df = obtener_snapshot_clientes()
+    return df[df['estado'] == 'activo']
+
+
+def invalidar_snapshot():
+    """Fuerza un nuevo chequeo de versión en la próxima lectura"""
+    with _lock:
+        _cache['version_consultada'] = None
+        _cache['consultada_en'] = 0.0
+
+
+# ============================================================================
+# FEED DE CAMBIOS (actualización incremental)
+# ============================================================================
+
+def _max_marca(actual, valores):
+    """Máximo entre la marca actual y una columna de timestamps (None = sin marca)"""
+    validos = [v for v in valores if v is not None]
+    if actual is not None:
+        validos.append(actual)
+    return max(validos) if validos else None
+
+
+def _leer_cambios(estado):
+    """Filas de clientes tocadas desde las marcas de `estado` (con margen)"""
+    _, max_actualizacion, max_asignacion = estado
+    columnas = ([(nombre, dtype) for nombre, dtype, _ in COLUMNAS_SNAPSHOT]
+                + [('ultima_actualizacion', 'O'), ('distrito_asignado_en', 'O')])
+    # Sin marca (columna NULL en toda la tabla al tomarla) cuenta cualquier
+    # valor no nulo; no se pasa '-infinity' sin tipo a la resta con INTERVAL
+    condiciones, params = [], []
+    for columna, marca in (('ultima_actualizacion', max_actualizacion),
+                           ('distrito_asignado_en', max_asignacion)):
+        if marca is None:
+            condiciones.append(CONDICION_SIN_MARCA.format(columna=columna))
+        else:
+            condiciones.append(CONDICION_CAMBIO.format(columna=columna))
+            params += [marca, VENTANA_CAMBIOS_SEG]
+    query = QUERY_CAMBIOS.format(condiciones=' OR '.join(condiciones))
+    lotes = [pd.DataFrame(lote) for lote in iterar_lotes_columnares(query, columnas, params=tuple(params))]
+    if not lotes:
+        return pd.DataFrame(columns=[nombre for nombre, _ in columnas])
+    return _normalizar_tipos(pd.concat(lotes, ignore_index=True))
+
+
+def actualizar_snapshot_incremental():
+    """
+    Aplica al snapshot en memoria solo las filas cambiadas desde su versión
+    (upsert por id) y publica la nueva versión para los demás workers
+    
+    Si no hay snapshot base o la tabla perdió filas (borrados), recarga completo.
+    
+    Returns:
+        Dict con version_anterior, version, anteriores (filas previas de los ids
+        cambiados), nuevas (filas actuales de esos ids) y completo (True si se
+        recargó todo y no hay deltas)
+        
+    Raises:
+        psycopg2.Error: Si falla la consulta de cambios
+    """
+    with _lock:
+        df, estado_base, version_base = _cache['df'], _cache['estado'], _cache['version']
+    
+    vacio = pd.DataFrame(columns=[nombre for nombre, _, _ in COLUMNAS_SNAPSHOT])
+    
+    def recarga_completa():
+        invalidar_snapshot()
+        obtener_snapshot_clientes()
+        return {'version_anterior': version_base, 'version': _cache['version'],
+                'anteriores': vacio, 'nuevas': vacio, 'completo': True}
+    
+    if df is None or estado_base is None:
+        return recarga_completa()
+    
+    estado = obtener_estado_clientes()
+    if _version_de_estado(estado) == version_base:
+        _registrar_estado(estado)
+        return {'version_anterior': version_base, 'version': version_base,
+                'anteriores': vacio, 'nuevas': vacio, 'completo': False}
+    
+    # Releer hasta que las marcas de las filas leídas alcancen las de la tabla
+    marca = estado_base
+    cambios = []
+    for _ in range(MAX_REINTENTOS_INCREMENTAL):
+        lote = _leer_cambios(marca)
+        cambios.append(lote)
+        marca = (None, _max_marca(marca[1], lote['ultima_actualizacion']),
+                 _max_marca(marca[2], lote['distrito_asignado_en']))
+        estado = obtener_estado_clientes()
+        if estado[1:] == marca[1:]:
+            break
+    else:
+        logger.warning("Feed de clientes no convergió tras %d lecturas: recarga completa", MAX_REINTENTOS_INCREMENTAL)
+        return recarga_completa()
+    
+    nuevas = (pd.concat(cambios, ignore_index=True)
+                .drop_duplicates('id', keep='last')
+                .drop(columns=['ultima_actualizacion', 'distrito_asignado_en'])
+                .reset_index(drop=True))
+    cambiado = df['id'].isin(nuevas['id'])
+    anteriores = df[cambiado].reset_index(drop=True)
+    actualizado = (pd.concat([df[~cambiado], nuevas], ignore_index=True)
+                     .sort_values('id', kind='stable')
+                     .reset_index(drop=True))
+    
+    if len(actualizado) != estado[0]:
+        logger.info("Snapshot incremental con %d filas vs %d en BD (borrados): recarga completa",
+                    len(actualizado), estado[0])
+        return recarga_completa()
+    
+    version = _version_de_estado(estado)
+    with _lock:
+        if PARQUET_DISPONIBLE:
+            _construir_parquet(version, actualizado)
+        _cache['version'] = version
+        _cache['df'] = actualizado
+        _cache['estado'] = estado
+        _registrar_estado(estado)
+    
+    logger.info("Snapshot de clientes %s -> %s: %d filas cambiadas", version_base, version, len(nuevas))
+    return {'version_anterior': version_base, 'version': version,
+            'anteriores': anteriores, 'nuevas': nuevas, 'completo': False}
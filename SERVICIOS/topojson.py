@@ -0,0 +1,200 @@
+"""
+Codificación TopoJSON de capas poligonales
+Provincias y distritos comparten casi todos sus bordes: en GeoJSON cada borde
+común se escribe dos veces. En TopoJSON los anillos se cortan en arcos en los
+puntos donde dos bordes se separan (uniones) y cada arco se guarda una sola
+vez; los polígonos lo referencian por índice (~i si va en sentido inverso).
+
+Las coordenadas se cuantizan a una grilla entera de CUANTIZACION_TOPOJSON
+pasos por eje y los arcos se codifican en diferencias (delta), como el
+formato estándar (topojson-client los decodifica con el `transform`).
+"""
+import os
+
+import numpy as np
+import shapely
+
+from SERVICIOS.geojson import propiedades_a_json
+from SERVICIOS.json_rapido import FragmentoJSON, dumps
+
+# Pasos de la grilla por eje (1e5 ≈ 20 m sobre el ancho del Perú)
+CUANTIZACION = int(os.getenv('CUANTIZACION_TOPOJSON', '100000'))
+
+
+# ============================================================================
+# ANILLOS CUANTIZADOS
+# ============================================================================
+
+def _anillos_cuantizados(geoms, x0, y0, kx, ky, q):
+    """
+    Anillos de todas las geometrías como arrays de claves enteras (qx * q + qy)
+
+    Returns:
+        Tupla (lista de anillos cerrados sin vértices repetidos consecutivos,
+               array geometría de cada anillo, array polígono de cada anillo,
+               array True si el anillo es exterior)
+    """
+    poligonos, geom_de_poligono = shapely.get_parts(geoms, return_index=True)
+    anillos, poligono_de_anillo = shapely.get_rings(poligonos, return_index=True)
+    coords, anillo_de_coord = shapely.get_coordinates(anillos, return_index=True)
+
+    qx = np.round((coords[:, 0] - x0) * kx).astype('int64')
+    qy = np.round((coords[:, 1] - y0) * ky).astype('int64')
+    claves = qx * q + qy
+
+    # Vértices que la cuantización deja repetidos (consecutivos en el mismo anillo)
+    inicio = np.r_[True, anillo_de_coord[1:] != anillo_de_coord[:-1]]
+    conservar = inicio | (claves != np.r_[-1, claves[:-1]])
+    claves, anillo_de_coord = claves[conservar], anillo_de_coord[conservar]
+
+    cortes = np.flatnonzero(np.r_[True, anillo_de_coord[1:] != anillo_de_coord[:-1]])
+    por_anillo = np.split(claves, cortes[1:])
+    ids = anillo_de_coord[cortes]
+
+    # Posición del anillo dentro de su polígono: 0 = exterior
+    es_exterior = np.r_[True, poligono_de_anillo[1:] != poligono_de_anillo[:-1]]
+
+    lista = [None] * len(anillos)
+    for i, anillo in zip(ids, por_anillo):
+        lista[i] = anillo
+    return lista, geom_de_poligono[poligono_de_anillo], poligono_de_anillo, es_exterior
+
+
+def _uniones(anillos):
+    """
+    Claves de los puntos donde se separan dos bordes: aparecen con más de un
+    par de vecinos distinto (sin importar el sentido de recorrido)
+    """
+    abiertos = [a[:-1] for a in anillos if a is not None and len(a) >= 4]
+    if not abiertos:
+        return np.array([], dtype='int64')
+
+    puntos = np.concatenate(abiertos)
+    largos = np.array([len(a) for a in abiertos])
+    inicios = np.repeat(np.cumsum(largos) - largos, largos)
+    local = np.arange(len(puntos)) - inicios
+    n = np.repeat(largos, largos)
+    previo = puntos[inicios + (local - 1) % n]
+    siguiente = puntos[inicios + (local + 1) % n]
+
+    pares = np.unique(np.column_stack([puntos, np.minimum(previo, siguiente), np.maximum(previo, siguiente)]), axis=0)
+    claves, veces = np.unique(pares[:, 0], return_counts=True)
+    return claves[veces > 1]
+
+
+# ============================================================================
+# ARCOS
+# ============================================================================
+
+class _Arcos:
+    """Arcos únicos: el mismo borde recorrido al revés reutiliza el índice (~i)"""
+
+    def __init__(self):
+        self.indice = {}
+        self.arcos = []
+
+    def agregar(self, arco):
+        clave = arco.tobytes()
+        if clave in self.indice:
+            return self.indice[clave]
+        inverso = arco[::-1].tobytes()
+        if inverso in self.indice:
+            return ~self.indice[inverso]
+        self.indice[clave] = len(self.arcos)
+        self.arcos.append(arco)
+        return len(self.arcos) - 1
+
+
+def _cortar_anillo(anillo, es_union, arcos):
+    """Anillo cerrado -> lista de índices de arco"""
+    abierto = anillo[:-1]
+    posiciones = np.flatnonzero(es_union)
+    if not len(posiciones):
+        # Sin uniones: un solo arco que empieza en el menor punto, para que el
+        # mismo anillo compartido (isla / hueco) genere el mismo arco
+        abierto = np.roll(abierto, -int(np.argmin(abierto)))
+        return [arcos.agregar(np.r_[abierto, abierto[:1]])]
+
+    abierto = np.roll(abierto, -int(posiciones[0]))
+    posiciones = posiciones - posiciones[0]
+    cerrado = np.r_[abierto, abierto[:1]]
+    limites = np.r_[posiciones, len(abierto)]
+    return [arcos.agregar(cerrado[a:b + 1]) for a, b in zip(limites[:-1], limites[1:])]
+
+
+def _arco_json(arco, q):
+    """Arco de claves -> JSON de coordenadas cuantizadas en diferencias"""
+    puntos = np.column_stack([arco // q, arco % q])
+    puntos[1:] -= puntos[:-1].copy()
+    return dumps(puntos)
+
+
+# ============================================================================
+# TOPOLOGÍA
+# ============================================================================
+
+def topologia(geometrias, propiedades=None, nombre='capa', cuantizacion=CUANTIZACION, extra=None):
+    """
+    Topology con un GeometryCollection de polígonos
+
+    Args:
+        geometrias: GeoSeries o array de Polygon/MultiPolygon (EPSG:4326)
+        propiedades: DataFrame (una fila por geometría) o lista de dicts
+        nombre: Nombre del objeto dentro de `objects`
+        cuantizacion: Pasos de la grilla por eje
+        extra: Dict de claves adicionales del nivel superior (total...)
+
+    Returns:
+        FragmentoJSON
+    """
+    geoms = np.asarray(getattr(geometrias, 'values', geometrias), dtype=object)
+    props = propiedades_a_json(propiedades, len(geoms))
+    q = int(cuantizacion)
+
+    validas = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms)) if len(geoms) else np.array([], bool)
+    if validas.any():
+        x0, y0, x1, y1 = shapely.total_bounds(geoms[validas])
+    else:
+        x0 = y0 = x1 = y1 = 0.0
+    kx = (q - 1) / (x1 - x0) if x1 > x0 else 1.0
+    ky = (q - 1) / (y1 - y0) if y1 > y0 else 1.0
+
+    anillos, geom_de_anillo, poligono_de_anillo, es_exterior = _anillos_cuantizados(geoms, x0, y0, kx, ky, q)
+    uniones = _uniones(anillos)
+    arcos = _Arcos()
+
+    # geometría -> {polígono: [arcos del exterior, arcos de cada hueco]}
+    partes = [dict() for _ in range(len(geoms))]
+    descartados = set()
+    for anillo, g, p, exterior in zip(anillos, geom_de_anillo, poligono_de_anillo, es_exterior):
+        if anillo is None or len(anillo) < 4:
+            # Colapsado por la cuantización: un exterior descarta su polígono
+            if exterior:
+                descartados.add(p)
+            continue
+        if p in descartados:
+            continue
+        partes[g].setdefault(p, []).append(_cortar_anillo(anillo, np.isin(anillo[:-1], uniones), arcos))
+
+    objetos = []
+    for poligonos, prop in zip(partes, props):
+        poligonos = list(poligonos.values())
+        if not poligonos:
+            objetos.append(b'{"type":null,"properties":' + prop + b'}')
+        elif len(poligonos) == 1:
+            objetos.append(b'{"type":"Polygon","arcs":' + dumps(poligonos[0]) + b',"properties":' + prop + b'}')
+        else:
+            objetos.append(b'{"type":"MultiPolygon","arcs":' + dumps(poligonos) + b',"properties":' + prop + b'}')
+
+    cabecera = dumps({
+        'type': 'Topology',
+        'bbox': [x0, y0, x1, y1],
+        'transform': {'scale': [1 / kx, 1 / ky], 'translate': [x0, y0]},
+    })
+    cola = b''.join(b',' + dumps(k) + b':' + dumps(v) for k, v in (extra or {}).items())
+    return FragmentoJSON(
+        cabecera[:-1]
+        + b',"objects":{' + dumps(nombre) + b':{"type":"GeometryCollection","geometries":[' + b','.join(objetos) + b']}}'
+        + b',"arcs":[' + b','.join(_arco_json(a, q) for a in arcos.arcos) + b']'
+        + cola + b'}'
+    )
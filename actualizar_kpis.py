@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Mantiene frescos los KPIs del Centro de Decisiones ante cambios de clientes
+Sondea la tabla clientes (ultima_actualizacion / distrito_asignado_en),
+reclasifica solo los clientes cambiados contra la capa de cada aviso vigente
+y aplica los deltas a OUTPUT/aviso_N/kpis.json y al CSV de clasificación.
+
+Uso:
+    python actualizar_kpis.py
+    python actualizar_kpis.py --una-vez
+
+Ejemplo:
+    python actualizar_kpis.py            # bucle cada INTERVALO_DELTAS_SEG segundos
+    python actualizar_kpis.py --una-vez  # un solo ciclo (cron)
+"""
+
+import sys
+import os
+import time
+import logging
+from pathlib import Path
+from dotenv import load_dotenv
+
+import psycopg2
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from CONFIG.db import listar_avisos_vigentes
+from routes.decisiones import aplicar_cambios_clientes
+
+INTERVALO_DELTAS_SEG = float(os.getenv('INTERVALO_DELTAS_SEG', '30'))
+DIAS_GRACIA_AVISO = int(os.getenv('DIAS_GRACIA_AVISO', '2'))
+
+
+def ciclo():
+    """Un ciclo del feed: cambios de clientes -> deltas en avisos vigentes"""
+    avisos = listar_avisos_vigentes(DIAS_GRACIA_AVISO)
+    resultados = aplicar_cambios_clientes(avisos)
+    if resultados:
+        logger.info(f"✓ KPIs actualizados: {resultados}")
+    return resultados
+
+
+if __name__ == "__main__":
+    una_vez = "--una-vez" in sys.argv
+    while True:
+        try:
+            ciclo()
+        except psycopg2.Error as e:
+            logger.error(f"❌ Error de BD: {e}")
+            if una_vez:
+                sys.exit(1)
+        except Exception as e:
+            logger.error(f"❌ Error inesperado: {e}", exc_info=True)
+            if una_vez:
+                sys.exit(1)
+        
+        if una_vez:
+            sys.exit(0)
+        time.sleep(INTERVALO_DELTAS_SEG)
@@ -9,6 +9,7 @@ from pathlib import Path
 import sys
 import os
 import logging
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -47,7 +48,10 @@ except ImportError as e:
 # Inicializar Flask
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False
-app.config['DONT_RELOAD_REGEX'] = r'(\.git|__pycache__|\.pytest_cache|node_modules|TEMP|OUTPUT|\.egg-info)'
+# jsonify con orjson: Decimal, fechas, NumPy y pd.NA sin conversión previa
+from SERVICIOS.json_rapido import ProveedorJSON
+app.json = ProveedorJSON(app)
+app.config['DONT_RELOAD_REGEX'] = r'(\.git|__pycache__|\.pytest_cache|node_modules|TEMP|OUTPUT|HISTORIAL|\.egg-info)'
 
 # Rutas base
 BASE_DIR = Path(__file__).parent
@@ -67,6 +71,7 @@ from routes.utils import utils_bp
 from routes.decisiones import decisiones_bp
 from routes.mapas_shp import mapas_shp_bp
 from routes.areas import areas_bp
+from routes.historial import historial_bp
 
 # Registrar blueprints (cada blueprint contiene sus propias rutas)
 app.register_blueprint(avisos_bp)
@@ -75,6 +80,17 @@ app.register_blueprint(utils_bp)
 app.register_blueprint(decisiones_bp)
 app.register_blueprint(mapas_shp_bp)
 app.register_blueprint(areas_bp)
+app.register_blueprint(historial_bp)
+
+# Caché de respuestas por aviso (SQLite compartido entre workers, ETag/304)
+from SERVICIOS.cache_respuestas import registrar_cache_respuestas
+registrar_cache_respuestas(app)
+
+# Delimitaciones precompiladas (GeoJSON + gzip/brotli con hash): se generan en
+# segundo plano al arrancar si faltan o si cambió el SHP
+from SERVICIOS.delimitaciones import construir_delimitaciones
+if os.getenv('PRECOMPILAR_DELIMITACIONES', '1') not in ('0', 'false', 'no'):
+    threading.Thread(target=construir_delimitaciones, name='delimitaciones', daemon=True).start()
 
 # ============================================================================
 # ENDPOINT PRINCIPAL - PROCESAR AVISO (Integración con n8n)
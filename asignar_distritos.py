@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Script para asignar a cada cliente el distrito (UBIGEO) que lo contiene
+Cruza las coordenadas de clientes con DELIMITACIONES/DISTRITOS y guarda
+clientes.distrito_id (IDDIST como entero). Por defecto solo procesa clientes
+nuevos o actualizados desde la última asignación.
+
+Uso:
+    python asignar_distritos.py
+    python asignar_distritos.py --todos
+
+Ejemplo:
+    python asignar_distritos.py          # incremental (pendientes)
+    python asignar_distritos.py --todos  # reasignar toda la cartera
+"""
+
+import sys
+import os
+import logging
+from pathlib import Path
+from dotenv import load_dotenv
+
+import geopandas as gpd
+import psycopg2
+import psycopg2.extras
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Importar funciones de BD
+from CONFIG.db import get_connection, iterar_lotes_columnares
+
+BASE_DIR = Path(__file__).parent
+SHP_DISTRITOS = Path(os.getenv('SHP_BASE_DIR', str(BASE_DIR / 'DELIMITACIONES'))) / 'DISTRITOS' / 'DISTRITOS.shp'
+
+TAMANO_LOTE = int(os.getenv('TAMANO_LOTE_CLIENTES', '20000'))
+
+QUERY_PENDIENTES = """
+    SELECT id, latitud::float8, longitud::float8
+    FROM clientes
+    WHERE latitud IS NOT NULL AND longitud IS NOT NULL
+      AND (distrito_asignado_en IS NULL OR ultima_actualizacion > distrito_asignado_en)
+    ORDER BY id
+"""
+QUERY_TODOS = """
+    SELECT id, latitud::float8, longitud::float8
+    FROM clientes
+    WHERE latitud IS NOT NULL AND longitud IS NOT NULL
+    ORDER BY id
+"""
+
+
+def cargar_distritos():
+    """
+    Lee la capa de distritos en EPSG:4326 con su UBIGEO entero
+    
+    Returns:
+        GeoDataFrame [distrito_id, geometry]
+    """
+    gdf = gpd.read_file(str(SHP_DISTRITOS))
+    if gdf.crs and gdf.crs != 'EPSG:4326':
+        gdf = gdf.to_crs('EPSG:4326')
+    
+    gdf['distrito_id'] = gdf['IDDIST'].astype(int)
+    return gdf[['distrito_id', 'geometry']]
+
+
+def ubicar_en_distritos(longitudes, latitudes, distritos):
+    """
+    Retorna el UBIGEO que contiene cada punto (None si cae fuera de todos)
+    
+    Args:
+        longitudes, latitudes: Arrays de coordenadas EPSG:4326
+        distritos: GeoDataFrame de cargar_distritos() (su índice espacial se reutiliza)
+    
+    Returns:
+        Lista de int/None alineada con las coordenadas
+    """
+    puntos = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(longitudes, latitudes),
+        crs='EPSG:4326'
+    )
+    # 'intersects' asigna los puntos sobre un límite a uno de los distritos vecinos
+    union = gpd.sjoin(puntos, distritos, how='left', predicate='intersects')
+    union = union[~union.index.duplicated(keep='first')]
+    
+    return [None if d != d else int(d) for d in union['distrito_id'].reindex(puntos.index).tolist()]
+
+
+def guardar_asignaciones(conn, ids, distrito_ids):
+    """UPDATE masivo de distrito_id + marca de asignación"""
+    cursor = conn.cursor()
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        UPDATE clientes AS c
+        SET distrito_id = v.distrito_id, distrito_asignado_en = NOW()
+        FROM (VALUES %s) AS v(id, distrito_id)
+        WHERE c.id = v.id
+        """,
+        list(zip(ids, distrito_ids)),
+        template='(%s, %s::int)',
+        page_size=1000
+    )
+    conn.commit()
+    cursor.close()
+
+
+def asignar_distritos(todos=False, distritos=None):
+    """
+    Asigna distrito_id a clientes pendientes (o a todos)
+    
+    Args:
+        todos: Si True, reasigna toda la cartera
+        distritos: Capa ya cargada (opcional, para reutilizarla entre llamadas)
+    
+    Returns:
+        Dict {'procesados': int, 'sin_distrito': int}; si procesados > 0 quien
+        llama invalida la caché de respuestas (invalidar_clientes)
+        
+    Raises:
+        psycopg2.Error: Si falla la lectura o escritura en BD
+    """
+    if distritos is None:
+        distritos = cargar_distritos()
+    
+    query = QUERY_TODOS if todos else QUERY_PENDIENTES
+    columnas = [('id', 'i8'), ('latitud', 'f8'), ('longitud', 'f8')]
+    procesados = 0
+    sin_distrito = 0
+    
+    conn = get_connection()
+    try:
+        for lote in iterar_lotes_columnares(query, columnas, tamano_lote=TAMANO_LOTE):
+            distrito_ids = ubicar_en_distritos(lote['longitud'], lote['latitud'], distritos)
+            guardar_asignaciones(conn, lote['id'].tolist(), distrito_ids)
+            
+            procesados += len(distrito_ids)
+            sin_distrito += sum(1 for d in distrito_ids if d is None)
+            logger.info(f"  Lote asignado: {len(distrito_ids)} clientes (acumulado {procesados})")
+    finally:
+        conn.close()
+    
+    logger.info(f"✓ Distritos asignados: {procesados} clientes ({sin_distrito} fuera de todo distrito)")
+    return {'procesados': procesados, 'sin_distrito': sin_distrito}
+
+
+if __name__ == "__main__":
+    try:
+        from SERVICIOS.cache_respuestas import invalidar_clientes
+        if asignar_distritos(todos="--todos" in sys.argv)['procesados']:
+            invalidar_clientes()
+        sys.exit(0)
+    except psycopg2.Error as e:
+        logger.error(f"❌ Error de BD: {e}")
+        sys.exit(1)
+    except Exception as e:
+        logger.error(f"❌ Error inesperado: {e}", exc_info=True)
+        sys.exit(1)
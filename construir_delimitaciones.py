@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Script para precompilar las capas de delimitación (departamentos, provincias,
+distritos) como GeoJSON y TopoJSON + gzip/brotli con hash en el nombre
+(CACHE_DIR/delimitaciones, ver SERVICIOS/delimitaciones.py)
+
+La app también las genera al arrancar si faltan; este script sirve como paso
+de build o para regenerarlas tras reemplazar los SHP de DELIMITACIONES/.
+
+Uso:
+    python construir_delimitaciones.py [--forzar]
+
+Ejemplo:
+    python construir_delimitaciones.py            # solo capas nuevas o con SHP cambiado
+    python construir_delimitaciones.py --forzar   # todas
+"""
+
+import sys
+import logging
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from SERVICIOS.delimitaciones import CAPAS, construir_delimitaciones
+
+
+if __name__ == "__main__":
+    manifest = construir_delimitaciones(forzar="--forzar" in sys.argv[1:])
+    for capa in CAPAS:
+        entrada = manifest.get(capa)
+        if entrada:
+            logger.info(f"✓ {capa}: {entrada['archivo']} ({entrada['total']} features, {', '.join(entrada['codificaciones'])}), "
+                        f"TopoJSON {entrada['topojson']['bytes'] / entrada['bytes']:.0%} del GeoJSON")
+        else:
+            logger.warning(f"⚠️ {capa}: SHP no disponible")
+    
+    sys.exit(0 if manifest else 1)
@@ -31,6 +31,7 @@ logger = logging.getLogger(__name__)
 
 # Importar función de BD
 from CONFIG.db import guardar_aviso_json
+from SERVICIOS.cache_respuestas import invalidar_aviso
 
 
 def descargar_aviso(numero_aviso: int, procesar: bool = False) -> bool:
@@ -58,6 +59,9 @@ def descargar_aviso(numero_aviso: int, procesar: bool = False) -> bool:
             logger.error(f"❌ No se pudo descargar aviso {numero_aviso}")
             return False
         
+        # /api/avisos/<n>/... cacheadas leen el JSON recién escrito
+        invalidar_aviso(numero_aviso)
+        
         logger.info(f"✅ Aviso {numero_aviso} descargado exitosamente")
         logger.info(f"📄 Guardado: {json_dir}/aviso_{numero_aviso}.json")
         
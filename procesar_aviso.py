@@ -48,7 +48,14 @@ from LAYOUT.utils import (
 )
 
 # Importar funciones de BD
+import psycopg2
+
+from asignar_distritos import asignar_distritos
 from CONFIG.db import obtener_aviso_por_numero, guardar_aviso_json, limpiar_imagenes_aviso, guardar_imagen_aviso, guardar_csv_aviso
+from SERVICIOS.cache_respuestas import invalidar_aviso, invalidar_clientes
+from SERVICIOS.galeria_mapas import indexar_aviso
+from SERVICIOS.json_rapido import convertir_json
+from SERVICIOS.riesgo_disuelto import generar_capa_disuelta, rutas_disueltas
 
 def obtener_json_aviso(numero_aviso, desde_db=False):
     """
@@ -71,12 +78,14 @@ def obtener_json_aviso(numero_aviso, desde_db=False):
             aviso_dict = obtener_aviso_por_numero(numero_aviso)
             
             if aviso_dict:
-                # Guardar JSON para referencia
+                # Guardar JSON para referencia (fechas/decimales de la BD -> ISO/float)
+                texto = json.dumps(aviso_dict, ensure_ascii=False, indent=2, default=convertir_json)
                 os.makedirs(json_dir, exist_ok=True)
                 with open(ruta_json, 'w', encoding='utf-8') as f:
-                    json.dump(aviso_dict, f, ensure_ascii=False, indent=2)
+                    f.write(texto)
                 logger.info(f"✓ Aviso obtenido de BD y guardado en {ruta_json}")
-                return aviso_dict
+                # Mismos tipos que al leer el JSON local (los argumentos de MAPAS.py son texto)
+                return json.loads(texto)
             else:
                 logger.error(f"Aviso {numero_aviso} no encontrado en BD")
                 sys.exit(1)
@@ -198,6 +207,14 @@ def procesar_aviso(numero_aviso, desde_db=False):
     dia_critico, shp_critico = seleccionar_dia_critico(shp_paths)
     print(f"  ✅ Día seleccionado: {dia_critico}", flush=True)
     
+    # 5.1 Capa disuelta por nivel (una geometría por nivel, simplificada) para
+    # MAPAS.py y /shp-geojson; si falla se usa el SHP original
+    for dia, shp_path in shp_paths.items():
+        try:
+            generar_capa_disuelta(shp_path, dia)
+        except Exception as e:
+            logger.warning(f"⚠ No se pudo generar capa disuelta de {dia}: {e}")
+    
     # 6. Extraer departamentos afectados
     print(f"\n🗺️  Identificando zonas afectadas...", flush=True)
     deptos_afectados = extraer_departamentos_afectados(shp_critico)
@@ -227,6 +244,16 @@ def procesar_aviso(numero_aviso, desde_db=False):
         distritos.to_csv(f"{output_dir}/distritos_afectados.csv", index=False)
         guardar_csv_aviso(numero_aviso, 'distritos', f"/static/output/aviso_{numero_aviso}/distritos_afectados.csv")
     
+    # 7.4. Asignar distrito (UBIGEO) a clientes nuevos o actualizados
+    # Si falla, el aviso se procesa igual: los clientes sin asignar se cruzan por departamento
+    try:
+        asignacion = asignar_distritos()
+    except (psycopg2.Error, OSError, RuntimeError, ValueError, KeyError) as e:
+        logger.warning(f"No se pudo asignar distritos a clientes: {e}", exc_info=True)
+    else:
+        if asignacion['procesados']:
+            invalidar_clientes()
+    
     # 7.5. GENERAR CSV DE CLIENTES ANTES DE LOS MAPAS (para endpoints KPI)
     print(f"\n📊 Generando CSV de clientes clasificados...", flush=True)
     try:
@@ -249,6 +276,25 @@ def procesar_aviso(numero_aviso, desde_db=False):
         logger.warning(f"Error generando CSV: {e}")
         print(f"  ⚠️  {str(e)}", flush=True)
     
+    # 7.6. Materializar KPIs del Centro de Decisiones (OUTPUT/aviso_N/kpis.json)
+    try:
+        from routes.decisiones import materializar_kpis_aviso
+        ruta_kpis = materializar_kpis_aviso(numero_aviso)
+        logger.info(f"✓ KPIs materializados: {ruta_kpis}")
+    except Exception as e:
+        logger.warning(f"No se pudo materializar KPIs: {e}")
+    
+    # 7.6b. Historial entre avisos (HISTORIAL/exposiciones + HISTORIAL/kpis)
+    try:
+        from routes.decisiones import registrar_historial_aviso
+        registro = registrar_historial_aviso(numero_aviso, datos_aviso.get('fecha_emision'))
+        logger.info(f"✓ Historial actualizado: {registro}")
+    except Exception as e:
+        logger.warning(f"No se pudo registrar historial: {e}")
+    
+    # 7.7. Invalidar respuestas cacheadas del aviso (CSV y KPIs nuevos)
+    invalidar_aviso(numero_aviso)
+    
     # 8. Generar mapas para cada departamento
     print(f"\n⏱️  TIEMPO ESTIMADO: ~{len(deptos_afectados)} minutos", flush=True)
     print(f"💡 Recomendación: Sé paciente, esto puede tomar un tiempo...", flush=True)
@@ -274,6 +320,9 @@ def procesar_aviso(numero_aviso, desde_db=False):
         # Variables de entorno para MAPAS.py
         env = os.environ.copy()
         env['SHP_RIESGO_PATH'] = shp_critico
+        ruta_disuelta = rutas_disueltas(shp_critico)[0]
+        if ruta_disuelta.exists():
+            env['SHP_RIESGO_DISUELTO_PATH'] = str(ruta_disuelta)
         
         cmd = [sys.executable, 'LAYOUT/MAPAS.py'] + args_mapas
         result = subprocess.run(cmd, env=env, capture_output=True, text=True)
@@ -306,11 +355,15 @@ def procesar_aviso(numero_aviso, desde_db=False):
             # Guardar ruta en BD (formato PNG si PIL no está disponible)
             ruta_relativa = f"/static/output/aviso_{numero_aviso}/{depto}.png"
             guardar_imagen_aviso(numero_aviso, depto, ruta_relativa)
+        
+        # Galería: el mapa aparece en /mapas sin recorrer OUTPUT/
+        indexar_aviso(numero_aviso)
     
     print(f"\n✨ CREACIÓN FINALIZADA ✨\n", flush=True)
     print(f"👋 ¡Hasta pronto! Esta pestaña se cerrará en 5 segundos...\n", flush=True)
     logger.info(f"\n✅ Procesamiento del aviso {numero_aviso} completado")
     logger.info(f"📁 Mapas guardados en: {output_dir}")
+    invalidar_aviso(numero_aviso)
 
 
 if __name__ == "__main__":
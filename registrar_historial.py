@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Script para cargar avisos ya procesados en el historial entre avisos
+(HISTORIAL/, ver SERVICIOS/historial.py) sin volver a procesarlos
+
+Uso:
+    python registrar_historial.py <numero_aviso> [<numero_aviso> ...]
+    python registrar_historial.py --todos
+
+Ejemplo:
+    python registrar_historial.py 447 448
+    python registrar_historial.py --todos   # todos los OUTPUT/aviso_N
+"""
+
+import sys
+import logging
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from routes.decisiones import registrar_historial_aviso
+
+OUTPUT_DIR = Path(__file__).parent / 'OUTPUT'
+
+
+def avisos_procesados():
+    """Números de aviso con carpeta en OUTPUT"""
+    return sorted(int(d.name.split('_')[1]) for d in OUTPUT_DIR.glob('aviso_*')
+                  if d.is_dir() and d.name.split('_')[1].isdigit())
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args:
+        logger.error("❌ Error: Falta número de aviso o --todos")
+        sys.exit(1)
+    
+    numeros = avisos_procesados() if "--todos" in args else [int(a) for a in args if a.isdigit()]
+    errores = 0
+    for numero in numeros:
+        try:
+            registro = registrar_historial_aviso(numero)
+            logger.info(f"✓ Aviso {numero}: {registro}")
+        except Exception as e:
+            errores += 1
+            logger.error(f"❌ Aviso {numero}: {e}")
+    
+    sys.exit(1 if errores else 0)
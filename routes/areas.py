@@ -4,22 +4,388 @@ Realiza spatial join entre puntos GPS de clientes y polígonos de avisos
 Genera CSV con clasificación y estadísticas por nivel
 """
 import logging
+import multiprocessing
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 import psycopg2
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from flask import Blueprint, jsonify, send_file
-from CONFIG.db import get_connection
+from CONFIG.db import iterar_lotes_columnares
+from SERVICIOS.cache_respuestas import invalidar_aviso, respuesta_cacheable
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo): sin bloqueo entre procesos
+    fcntl = None
 
 BASE_DIR = Path(__file__).parent.parent
 OUTPUT_DIR = BASE_DIR / 'OUTPUT'
 TEMP_DIR = BASE_DIR / 'TEMP'
 
+# Filas de clientes por lote al clasificar (memoria pico constante)
+TAMANO_LOTE_CLIENTES = int(os.getenv('TAMANO_LOTE_CLIENTES', '20000'))
+
+# Clasificación paralela: cada lote se parte en teselas lon/lat y cada tesela
+# se cruza solo con los polígonos que la intersectan, en un pool de procesos
+WORKERS_CLASIFICACION = int(os.getenv('WORKERS_CLASIFICACION', str(os.cpu_count() or 1)))
+TAMANO_TESELA_GRADOS = float(os.getenv('TAMANO_TESELA_GRADOS', '2'))
+
+QUERY_CLIENTES_COORDS = """
+    SELECT id, CONCAT(nombre, ' ', apellido) as nombre_cliente,
+           latitud::float8, longitud::float8, hectareas::float8
+    FROM clientes 
+    WHERE latitud IS NOT NULL AND longitud IS NOT NULL
+    ORDER BY id
+"""
+COLUMNAS_CLIENTES_COORDS = [
+    ('id', 'i8'), ('nombre_cliente', 'O'), ('latitud', 'f8'), ('longitud', 'f8'), ('hectareas', 'f8')
+]
+
+# Mapear CORRECTAMENTE: Nivel 4=Rojo, Nivel 3=Naranja, Nivel 2=Amarillo, Nivel 1=Verde
+MAPEO_NIVEL_COLOR = {
+    'Nivel 4': 'Rojo', 'Nivel 3': 'Naranja', 'Nivel 2': 'Amarillo', 'Nivel 1': 'Verde',
+    4: 'Rojo', 3: 'Naranja', 2: 'Amarillo', 1: 'Verde',
+    'Rojo': 'Rojo', 'Naranja': 'Naranja', 'Amarillo': 'Amarillo', 'Verde': 'Verde'
+}
+
+# Cercanía a zonas de riesgo: distancias en UTM 18S (metros), bandas en km
+CRS_METRICO = 'EPSG:32718'
+NIVELES_CERCANIA = ['Rojo', 'Naranja', 'Amarillo']
+NIVELES_CRITICOS = ['Rojo', 'Naranja']
+BANDAS_CERCANIA_KM = sorted(float(b) for b in os.getenv('BANDAS_CERCANIA_KM', '5,20').split(',') if b.strip())
+ETIQUETAS_BANDAS = [
+    f"{inf:g}-{sup:g} km" for inf, sup in zip([0.0] + BANDAS_CERCANIA_KM[:-1], BANDAS_CERCANIA_KM)
+]
+
 logger = logging.getLogger(__name__)
 areas_bp = Blueprint('areas', __name__)
 
 
+def detectar_columna_nivel(gdf):
+    """Retorna el nombre de la columna de nivel/color del SHP o None"""
+    for col in ['nivel', 'color', 'NIVEL', 'COLOR', 'Nivel', 'Color']:
+        if col in gdf.columns:
+            return col
+    return None
+
+
+def construir_indices_cercania(shp_alerta, columna_color):
+    """
+    Construye un STRtree por nivel (Rojo/Naranja/Amarillo) en CRS métrico
+    
+    Returns:
+        Dict {color: STRtree}; solo niveles con polígonos
+    """
+    capa = shp_alerta[[columna_color, 'geometry']].to_crs(CRS_METRICO)
+    colores = capa[columna_color].map(MAPEO_NIVEL_COLOR)
+    
+    indices = {}
+    for color in NIVELES_CERCANIA:
+        geoms = capa.geometry[colores == color].values
+        if len(geoms):
+            indices[color] = shapely.STRtree(np.asarray(geoms))
+    return indices
+
+
+def calcular_cercania(puntos_metricos, indices_cercania, niveles):
+    """
+    Distancia de cada punto al polígono más cercano de cada nivel
+    
+    Usa STRtree.query_nearest acotado a la banda más amplia, así el costo es
+    ~O(n log m) y nunca se arma una matriz de distancias cliente x polígono.
+    
+    Args:
+        puntos_metricos: GeoSeries de puntos en CRS_METRICO
+        indices_cercania: Dict de construir_indices_cercania()
+        niveles: Serie con el nivel asignado a cada punto (mismo índice)
+    
+    Returns:
+        DataFrame (mismo índice) con dist_{color}_km (0 dentro, NaN más allá
+        de la última banda), nivel_cercano y banda_cercania para clientes que
+        no están en una zona crítica pero sí cerca de una
+    """
+    max_dist_m = BANDAS_CERCANIA_KM[-1] * 1000 if BANDAS_CERCANIA_KM else 0
+    geoms = np.asarray(puntos_metricos.values)
+    cercania = pd.DataFrame(index=puntos_metricos.index)
+    
+    for color in NIVELES_CERCANIA:
+        distancias = np.full(len(geoms), np.nan)
+        if color in indices_cercania and len(geoms):
+            (idx_puntos, _), dist_m = indices_cercania[color].query_nearest(
+                geoms, max_distance=max_dist_m, return_distance=True, all_matches=False
+            )
+            distancias[idx_puntos] = dist_m / 1000
+        cercania[f'dist_{color.lower()}_km'] = np.round(distancias, 3)
+    
+    # Nivel crítico más cercano para quienes quedaron fuera de él
+    nivel_cercano = pd.Series(None, index=cercania.index, dtype=object)
+    dist_cercana = pd.Series(np.inf, index=cercania.index)
+    for color in NIVELES_CRITICOS:
+        dist = cercania[f'dist_{color.lower()}_km']
+        candidato = (dist > 0) & (dist < dist_cercana) & ~niveles.isin(NIVELES_CRITICOS[:NIVELES_CRITICOS.index(color) + 1])
+        nivel_cercano[candidato] = color
+        dist_cercana[candidato] = dist[candidato]
+    
+    banda_idx = np.searchsorted(BANDAS_CERCANIA_KM, dist_cercana.to_numpy(), side='left')
+    banda = pd.Series(
+        [ETIQUETAS_BANDAS[i] if i < len(ETIQUETAS_BANDAS) else None for i in banda_idx],
+        index=cercania.index, dtype=object
+    )
+    cercania['nivel_cercano'] = nivel_cercano.where(banda.notna(), None)
+    cercania['banda_cercania'] = banda.where(nivel_cercano.notna(), None)
+    return cercania
+
+
+def clasificar_lote(lote, capa_alerta, columna_color, indices_cercania=None):
+    """
+    Clasifica un lote columnar de clientes contra la capa de alerta
+    
+    Args:
+        lote: Dict {columna: np.ndarray} con al menos latitud/longitud
+        capa_alerta: GeoDataFrame [columna_color, geometry] (reutilizar entre lotes
+                     para que su índice espacial se construya una sola vez)
+        columna_color: Columna de nivel en la capa
+        indices_cercania: Dict de construir_indices_cercania() (opcional); si se
+                          pasa, agrega las columnas de calcular_cercania()
+    
+    Returns:
+        DataFrame con las columnas del lote + 'nivel' (Rojo/Naranja/Amarillo/Verde)
+    """
+    clientes_geo = gpd.GeoDataFrame(
+        lote,
+        geometry=gpd.points_from_xy(lote['longitud'], lote['latitud']),
+        crs="EPSG:4326"
+    )
+    
+    if clientes_geo.crs != capa_alerta.crs:
+        clientes_geo = clientes_geo.to_crs(capa_alerta.crs)
+    
+    resultado = gpd.sjoin(clientes_geo, capa_alerta, how='left', predicate='within')
+    
+    resultado = pd.DataFrame(resultado.drop(columns=['geometry', 'index_right']))
+    resultado = resultado.rename(columns={columna_color: 'nivel'})
+    resultado['nivel'] = resultado['nivel'].map(MAPEO_NIVEL_COLOR).fillna('Verde')
+    
+    if indices_cercania is not None:
+        # Nivel más severo por punto (un punto puede caer en polígonos solapados)
+        severidad = resultado['nivel'].map({'Rojo': 0, 'Naranja': 1, 'Amarillo': 2}).fillna(3)
+        nivel_punto = resultado['nivel'].iloc[np.argsort(severidad.to_numpy(), kind='stable')]
+        nivel_punto = nivel_punto[~nivel_punto.index.duplicated()].reindex(clientes_geo.index)
+        puntos = clientes_geo.geometry.to_crs(CRS_METRICO)
+        cercania = calcular_cercania(puntos, indices_cercania, nivel_punto)
+        resultado = resultado.join(cercania)
+    
+    return resultado
+
+
+def agrupar_cercania(conteo):
+    """Convierte Counter {(nivel, banda): n} en {nivel: {banda: n}} con todas las bandas"""
+    return {
+        nivel: {banda: int(conteo.get((nivel, banda), 0)) for banda in ETIQUETAS_BANDAS}
+        for nivel in NIVELES_CRITICOS
+    }
+
+
+def resumir_cercania(df, columnas_suma=('hectareas',)):
+    """
+    Agrega un CSV de clasificación por nivel crítico cercano y banda
+    
+    Args:
+        df: DataFrame con nivel_cercano, banda_cercania e id
+        columnas_suma: Columnas numéricas a sumar por grupo
+    
+    Returns:
+        Dict {nivel: {banda: {'clientes': n, <columna>: suma}}} con todas las bandas
+    """
+    cercanos = df.drop_duplicates('id').dropna(subset=['nivel_cercano', 'banda_cercania'])
+    columnas_suma = [c for c in columnas_suma if c in cercanos.columns]
+    grupos = cercanos.groupby(['nivel_cercano', 'banda_cercania'])
+    conteo = grupos.size()
+    sumas = grupos[columnas_suma].sum() if columnas_suma else None
+    
+    resumen = {}
+    for nivel in NIVELES_CRITICOS:
+        resumen[nivel] = {}
+        for banda in ETIQUETAS_BANDAS:
+            clave = (nivel, banda)
+            fila = {'clientes': int(conteo.get(clave, 0))}
+            for columna in columnas_suma:
+                fila[columna] = round(float(sumas[columna].get(clave, 0.0)), 2)
+            resumen[nivel][banda] = fila
+    return resumen
+
+
+# ============= CLASIFICACIÓN POR TESELAS (POOL DE PROCESOS) =============
+# Estado por proceso worker: capa del aviso e índices de cercanía se cargan
+# una sola vez en el initializer, no se serializan con cada tarea
+_capa_worker = None
+_columna_worker = None
+_indices_worker = None
+
+
+def _iniciar_worker(capa_alerta, columna_color):
+    """Initializer del pool: guarda la capa y construye sus índices en el worker"""
+    global _capa_worker, _columna_worker, _indices_worker
+    _capa_worker = capa_alerta
+    _columna_worker = columna_color
+    _indices_worker = construir_indices_cercania(capa_alerta, columna_color)
+    _capa_worker.sindex  # construir el índice espacial antes de la primera tesela
+
+
+def _clasificar_tesela(lote, limites):
+    """
+    Clasifica los clientes de una tesela contra los polígonos que la intersectan
+    
+    Args:
+        lote: Dict de arrays (subconjunto del lote en la tesela)
+        limites: (minx, miny, maxx, maxy) de la tesela en EPSG:4326
+    """
+    tesela = gpd.GeoSeries([shapely.box(*limites)], crs='EPSG:4326')
+    if _capa_worker.crs is not None and tesela.crs != _capa_worker.crs:
+        tesela = tesela.to_crs(_capa_worker.crs)
+    # Margen: los bordes de la tesela se curvan al reproyectar
+    ventana = tesela.iloc[0].buffer(tesela.iloc[0].length * 0.01)
+    locales = _capa_worker.iloc[_capa_worker.sindex.query(ventana, predicate='intersects')]
+    return clasificar_lote(lote, locales, _columna_worker, _indices_worker)
+
+
+def particionar_en_teselas(lote, tamano_grados=None):
+    """
+    Agrupa las filas de un lote por tesela de la grilla lon/lat
+    
+    Returns:
+        Lista de (sub_lote, limites) con una entrada por tesela no vacía
+    """
+    tamano = tamano_grados or TAMANO_TESELA_GRADOS
+    tx = np.floor(lote['longitud'] / tamano).astype(np.int64)
+    ty = np.floor(lote['latitud'] / tamano).astype(np.int64)
+    claves, inverso = np.unique(np.stack([tx, ty], axis=1), axis=0, return_inverse=True)
+    inverso = inverso.ravel()
+    
+    teselas = []
+    for i, (cx, cy) in enumerate(claves):
+        filas = np.flatnonzero(inverso == i)
+        sub_lote = {col: valores[filas] for col, valores in lote.items()}
+        limites = (cx * tamano, cy * tamano, (cx + 1) * tamano, (cy + 1) * tamano)
+        teselas.append((sub_lote, limites))
+    return teselas
+
+
+def _clasificar_en_pool(pool, lote):
+    """Reparte las teselas del lote en el pool y une los resultados en orden de id"""
+    teselas = particionar_en_teselas(lote)
+    futuros = [pool.submit(_clasificar_tesela, sub_lote, limites) for sub_lote, limites in teselas]
+    resultado = pd.concat([f.result() for f in futuros])
+    return resultado.sort_values('id', kind='stable')
+
+
+@contextmanager
+def bloqueo_csv(csv_path):
+    """
+    Bloqueo exclusivo entre procesos sobre un CSV de clasificación (<csv>.lock)
+    
+    Lo toman el reemplazo de clasificar_clientes_a_csv y la lectura-parcheo-
+    reemplazo de decisiones.actualizar_kpis_con_cambios (actualizar_kpis.py).
+    """
+    csv_path = Path(csv_path)
+    with open(csv_path.with_name(csv_path.name + '.lock'), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def clasificar_clientes_a_csv(shp_alerta, columna_color, csv_path, tamano_lote=None, workers=None):
+    """
+    Clasifica todos los clientes con coordenadas por lotes y escribe el CSV
+    incrementalmente. La memoria pico depende del tamaño de lote, no de la cartera.
+    
+    El CSV se escribe en un archivo temporal propio del proceso y se reemplaza
+    al final bajo bloqueo_csv, así los endpoints que lo leen nunca ven un
+    archivo a medio escribir y no se pisa con el parcheo de actualizar_kpis.
+    
+    Si la cartera no cabe en un solo lote y hay más de un worker, cada lote se
+    reparte por teselas en un pool de procesos (ver particionar_en_teselas).
+    
+    Args:
+        shp_alerta: GeoDataFrame del aviso
+        columna_color: Columna de nivel en el SHP
+        csv_path: Ruta destino del CSV clientes_por_nivel_dia{N}.csv
+        tamano_lote: Filas por lote (default: TAMANO_LOTE_CLIENTES)
+        workers: Procesos del pool (default: WORKERS_CLASIFICACION; 1 = secuencial)
+    
+    Returns:
+        Dict con total_clientes, clasificacion_por_nivel, hectareas_por_nivel y
+        cercania_por_banda ({nivel_cercano: {banda: clientes}})
+        (total_clientes = 0 si no hay clientes con coordenadas)
+        
+    Raises:
+        psycopg2.Error: Si falla la consulta de clientes
+    """
+    tamano_lote = tamano_lote or TAMANO_LOTE_CLIENTES
+    workers = workers or WORKERS_CLASIFICACION
+    csv_path = Path(csv_path)
+    tmp_path = csv_path.with_name(f'{csv_path.name}.{os.getpid()}.tmp')
+    
+    capa_alerta = shp_alerta[[columna_color, 'geometry']]
+    indices_cercania = construir_indices_cercania(shp_alerta, columna_color)
+    conteo_nivel = Counter()
+    conteo_cercania = Counter()
+    hectareas_nivel = defaultdict(float)
+    total = 0
+    pool = None
+    
+    try:
+        lotes = iterar_lotes_columnares(QUERY_CLIENTES_COORDS, COLUMNAS_CLIENTES_COORDS,
+                                        tamano_lote=tamano_lote)
+        for lote in lotes:
+            # Un primer lote incompleto es toda la cartera: no compensa levantar el pool
+            if pool is None and workers > 1 and len(lote['id']) >= tamano_lote:
+                # spawn: los workers no heredan la conexión abierta del cursor con nombre
+                pool = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_iniciar_worker, initargs=(capa_alerta, columna_color)
+                )
+                logger.info("Clasificación paralela: %d workers, teselas de %g°", workers, TAMANO_TESELA_GRADOS)
+            
+            if pool is not None:
+                resultado = _clasificar_en_pool(pool, lote)
+            else:
+                resultado = clasificar_lote(lote, capa_alerta, columna_color, indices_cercania)
+            resultado.to_csv(tmp_path, mode='w' if total == 0 else 'a', header=(total == 0),
+                             index=False, encoding='utf-8')
+            
+            total += len(resultado)
+            conteo_nivel.update(resultado['nivel'].value_counts().to_dict())
+            for nivel, ha in resultado.groupby('nivel')['hectareas'].sum().items():
+                hectareas_nivel[nivel] += float(ha)
+            cercanos = resultado.drop_duplicates('id').dropna(subset=['nivel_cercano', 'banda_cercania'])
+            conteo_cercania.update(zip(cercanos['nivel_cercano'], cercanos['banda_cercania']))
+            logger.debug("Lote clasificado: %d clientes (acumulado %d)", len(resultado), total)
+        
+        if total:
+            with bloqueo_csv(csv_path):
+                os.replace(tmp_path, csv_path)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if tmp_path.exists():
+            tmp_path.unlink()
+    
+    return {
+        'total_clientes': total,
+        'clasificacion_por_nivel': dict(conteo_nivel),
+        'hectareas_por_nivel': dict(hectareas_nivel),
+        'cercania_por_banda': agrupar_cercania(conteo_cercania)
+    }
+
+
 def calcular_area_riesgo_alto(shp_path):
     """Calcula el área total de riesgo alto (ROJO Nivel 4 + NARANJA Nivel 3)"""
     if not Path(shp_path).exists():
@@ -28,11 +394,7 @@ def calcular_area_riesgo_alto(shp_path):
     
     try:
         gdf = gpd.read_file(shp_path)
-        columna_color = None
-        for col in ['nivel', 'color', 'NIVEL', 'COLOR', 'Nivel', 'Color']:
-            if col in gdf.columns:
-                columna_color = col
-                break
+        columna_color = detectar_columna_nivel(gdf)
         
         if not columna_color:
             logger.warning("No se encontró columna de nivel/color en %s", shp_path)
@@ -73,6 +435,7 @@ def encontrar_dia_critico(numero):
 
 
 @areas_bp.route('/api/avisos/<int:numero>/dia-critico', methods=['GET'])
+@respuesta_cacheable
 def obtener_dia_critico(numero):
     """Retorna el día con mayor área de riesgo alto"""
     try:
@@ -115,77 +478,29 @@ def calcular_areas_por_nivel(numero, dia):
         logger.info("Shapefile cargado")
         logger.info("Columnas: %s", list(shp_alerta.columns))
         
-        columna_color = None
-        for col in ['nivel', 'color', 'NIVEL', 'COLOR', 'Nivel', 'Color']:
-            if col in shp_alerta.columns:
-                columna_color = col
-                break
+        columna_color = detectar_columna_nivel(shp_alerta)
         
         if not columna_color:
             return jsonify({'success': False, 'error': f'No encontró columna de nivel/color. Disponibles: {list(shp_alerta.columns)}'}), 400
         
         logger.info("Columna de nivel identificada: %s", columna_color)
         
+        csv_path = aviso_output / f'clientes_por_nivel_dia{dia}.csv'
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, CONCAT(nombre, ' ', apellido) as nombre_cliente, latitud, longitud, hectareas
-                FROM clientes 
-                WHERE latitud IS NOT NULL AND longitud IS NOT NULL
-                ORDER BY id
-            """)
-            clientes_data = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            logger.info("Clientes cargados: %d", len(clientes_data))
+            resumen_clasificacion = clasificar_clientes_a_csv(shp_alerta, columna_color, csv_path)
         except psycopg2.Error as e:
             logger.error("Error BD: %s", e)
             return jsonify({'success': False, 'error': f'Error BD: {str(e)}'}), 500
         
-        if not clientes_data:
+        if not resumen_clasificacion['total_clientes']:
             return jsonify({'success': False, 'error': 'No hay clientes con coordenadas'}), 400
         
-        clientes_df = pd.DataFrame(clientes_data, columns=['id', 'nombre_cliente', 'latitud', 'longitud', 'hectareas'])
-        clientes_geo = gpd.GeoDataFrame(clientes_df, geometry=gpd.points_from_xy(clientes_df['longitud'], clientes_df['latitud']), crs="EPSG:4326")
-        logger.info("GeoDataFrame creado (CRS: %s)", clientes_geo.crs)
-        
-        if clientes_geo.crs != shp_alerta.crs:
-            clientes_geo = clientes_geo.to_crs(shp_alerta.crs)
-            logger.info("CRS igualado a: %s", shp_alerta.crs)
-        
-        resultado = gpd.sjoin(clientes_geo, shp_alerta[[columna_color, 'geometry']], how='left', predicate='within')
-        logger.info("Spatial join completado")
-        
-        resultado_csv = resultado.drop(columns=['geometry', 'index_right']).copy()
-        resultado_csv = resultado_csv.rename(columns={columna_color: 'nivel'})
-        
-        # Mapear CORRECTAMENTE: Nivel 4=Rojo, Nivel 3=Naranja, Nivel 2=Amarillo, Nivel 1=Verde
-        mapeo_nivel_color = {
-            'Nivel 4': 'Rojo',
-            'Nivel 3': 'Naranja',
-            'Nivel 2': 'Amarillo',
-            'Nivel 1': 'Verde',
-            4: 'Rojo',
-            3: 'Naranja',
-            2: 'Amarillo',
-            1: 'Verde',
-            'Rojo': 'Rojo',
-            'Naranja': 'Naranja',
-            'Amarillo': 'Amarillo',
-            'Verde': 'Verde'
-        }
-        resultado_csv['nivel'] = resultado_csv['nivel'].map(mapeo_nivel_color).fillna('Verde')
-        
-        csv_path = aviso_output / f'clientes_por_nivel_dia{dia}.csv'
-        resultado_csv.to_csv(str(csv_path), index=False, encoding='utf-8')
         logger.info("CSV guardado: %s", csv_path)
+        invalidar_aviso(numero)
         
         resumen = {
             'dia': dia,
-            'total_clientes': len(resultado_csv),
-            'clasificacion_por_nivel': resultado_csv['nivel'].value_counts().to_dict(),
-            'hectareas_por_nivel': resultado_csv.groupby('nivel')['hectareas'].sum().to_dict(),
+            **resumen_clasificacion,
             'csv_guardado': str(csv_path)
         }
         
@@ -197,6 +512,7 @@ def calcular_areas_por_nivel(numero, dia):
 
 
 @areas_bp.route('/api/avisos/<int:numero>/clientes-nivel/<int:dia>', methods=['GET'])
+@respuesta_cacheable
 def obtener_clientes_por_nivel(numero, dia):
     """Retorna el CSV de clientes clasificados por nivel y día"""
     try:
@@ -207,6 +523,7 @@ def obtener_clientes_por_nivel(numero, dia):
             return jsonify({'success': False, 'error': f'CSV no encontrado'}), 404
         
         df = pd.read_csv(str(csv_path))
+        df = df.astype(object).where(df.notna(), None)
         return jsonify({'success': True, 'total': len(df), 'dia': dia, 'clientes': df.to_dict('records')}), 200
     except (IOError, ValueError) as e:
         logger.error("Error: %s", str(e))
@@ -214,6 +531,7 @@ def obtener_clientes_por_nivel(numero, dia):
 
 
 @areas_bp.route('/api/avisos/<int:numero>/resumen-areas/<int:dia>', methods=['GET'])
+@respuesta_cacheable
 def resumen_areas(numero, dia):
     """Retorna resumen estadístico de áreas y clasificación por día"""
     try:
@@ -231,6 +549,10 @@ def resumen_areas(numero, dia):
                     subset = df[df['nivel'] == nivel]
                     resumen['por_nivel'][str(nivel)] = {'clientes': len(subset), 'hectareas': float(subset['hectareas'].sum()), 'porcentaje': round(100 * len(subset) / len(df), 2)}
         
+        if 'banda_cercania' in df.columns:
+            resumen['bandas_cercania_km'] = BANDAS_CERCANIA_KM
+            resumen['cercania'] = resumir_cercania(df)
+        
         return jsonify({'success': True, 'resumen': resumen}), 200
     except (IOError, ValueError) as e:
         logger.error("Error: %s", str(e))
@@ -283,73 +605,25 @@ def generar_csv_clientes_por_nivel(numero, dia, shp_path=None):
         shp_alerta = gpd.read_file(str(shp_path))
         
         # Encontrar columna de nivel
-        columna_color = None
-        for col in ['nivel', 'color', 'NIVEL', 'COLOR', 'Nivel', 'Color']:
-            if col in shp_alerta.columns:
-                columna_color = col
-                break
+        columna_color = detectar_columna_nivel(shp_alerta)
         
         if not columna_color:
             logger.error(f"No se encontró columna de nivel. Disponibles: {list(shp_alerta.columns)}")
             return None
         
-        # Obtener clientes de BD
+        # Clasificar clientes por lotes (cursor de servidor → CSV incremental)
+        csv_path = aviso_output / f'clientes_por_nivel_dia{dia}.csv'
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, CONCAT(nombre, ' ', apellido) as nombre_cliente, latitud, longitud, hectareas
-                FROM clientes 
-                WHERE latitud IS NOT NULL AND longitud IS NOT NULL
-                ORDER BY id
-            """)
-            clientes_data = cursor.fetchall()
-            cursor.close()
-            conn.close()
+            resumen = clasificar_clientes_a_csv(shp_alerta, columna_color, csv_path)
         except psycopg2.Error as e:
             logger.error(f"Error consultando BD: {e}")
             return None
         
-        if not clientes_data:
+        cantidad = resumen['total_clientes']
+        if not cantidad:
             logger.warning("No hay clientes con coordenadas")
             return None
         
-        # Crear GeoDataFrame
-        clientes_df = pd.DataFrame(clientes_data, columns=['id', 'nombre_cliente', 'latitud', 'longitud', 'hectareas'])
-        clientes_geo = gpd.GeoDataFrame(
-            clientes_df,
-            geometry=gpd.points_from_xy(clientes_df['longitud'], clientes_df['latitud']),
-            crs="EPSG:4326"
-        )
-        
-        # Igualar CRS
-        if clientes_geo.crs != shp_alerta.crs:
-            clientes_geo = clientes_geo.to_crs(shp_alerta.crs)
-        
-        # Spatial join
-        resultado = gpd.sjoin(
-            clientes_geo,
-            shp_alerta[[columna_color, 'geometry']],
-            how='left',
-            predicate='within'
-        )
-        
-        resultado_csv = resultado.drop(columns=['geometry', 'index_right']).copy()
-        resultado_csv = resultado_csv.rename(columns={columna_color: 'nivel'})
-        
-        # Mapear niveles
-        mapeo_nivel_color = {
-            'Nivel 4': 'Rojo', 'Nivel 3': 'Naranja', 'Nivel 2': 'Amarillo', 'Nivel 1': 'Verde',
-            4: 'Rojo', 3: 'Naranja', 2: 'Amarillo', 1: 'Verde',
-            'Rojo': 'Rojo', 'Naranja': 'Naranja', 'Amarillo': 'Amarillo', 'Verde': 'Verde'
-        }
-        resultado_csv['nivel'] = resultado_csv['nivel'].map(mapeo_nivel_color).fillna('Verde')
-        
-        # Guardar CSV
-        csv_path = aviso_output / f'clientes_por_nivel_dia{dia}.csv'
-        resultado_csv.to_csv(csv_path, index=False, encoding='utf-8')
-        
-        cantidad = len(resultado_csv)
         logger.info(f"✓ CSV guardado: {csv_path} ({cantidad} registros)")
         return cantidad
         
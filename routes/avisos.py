@@ -5,6 +5,7 @@ import csv
 import json
 import logging
 import os
+import sqlite3
 import subprocess
 import sys
 from datetime import datetime, timedelta
@@ -13,6 +14,11 @@ from pathlib import Path
 from flask import (Blueprint, Response, jsonify, render_template, request,
                    stream_with_context)
 
+from SERVICIOS.cache_respuestas import respuesta_cacheable
+from SERVICIOS.catalogo_avisos import (COLORES_CATALOGO, INCLUDES,
+                                       invalidar_catalogo, listar_avisos)
+from SERVICIOS.galeria_mapas import consultar_mapas
+
 BASE_DIR = Path(__file__).parent.parent
 OUTPUT_DIR = BASE_DIR / 'OUTPUT'
 logger = logging.getLogger(__name__)
@@ -24,100 +30,23 @@ avisos_bp = Blueprint('avisos', __name__, url_prefix='')
 @avisos_bp.route('/avisos', methods=['GET'])
 def avisos():
     """Página de gestión de avisos - Conectado a BD o archivos locales"""
-    avisos_lista = []
     aviso_param = request.args.get('aviso')
     filtro_numero = int(aviso_param) if aviso_param else None
 
+    avisos_lista = []
     try:
-        import psycopg2
-        import psycopg2.extras
-
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            port=int(os.getenv("DB_PORT", "5432")),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD")
-        )
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        query = (
-            "SELECT DISTINCT numero_aviso, fecha_emision, titulo, nivel, "
-            "color FROM avisos_completos WHERE color IN ('rojo', 'naranja') "
-            "ORDER BY numero_aviso DESC"
-        )
-        cursor.execute(query)
-        avisos_bd = cursor.fetchall()
-        cursor.close()
-        conn.close()
-
-        for aviso in avisos_bd:
-            numero = aviso['numero_aviso']
-            if filtro_numero and numero != filtro_numero:
+        for aviso in listar_avisos(aviso=filtro_numero):
+            # La página lista avisos de BD o descargados (no solo carpetas OUTPUT/)
+            if (aviso['fuente'] == 'output' or
+                    str(aviso['color']).lower() not in COLORES_CATALOGO):
                 continue
-
-            json_path = BASE_DIR / 'JSON' / 'aviso_{}.json'.format(numero)
-            output_path = OUTPUT_DIR / 'aviso_{}'.format(numero)
-
-            estado_descargado = json_path.exists()
-            mapas_creados = (output_path.exists() and
-                           (any(output_path.glob('*.webp')) or
-                            any(output_path.glob('*.png'))))
-
+            mapas_creados = aviso['mapa_creado'] == '✅'
+            estado_descargado = aviso['descargado'] == '✅'
             css_class = ('table-success' if mapas_creados else
                         ('table-warning' if estado_descargado else ''))
-            avisos_lista.append({
-                'numero': numero,
-                'titulo': aviso['titulo'],
-                'nivel': aviso['nivel'],
-                'color': aviso['color'],
-                'fecha_emision': str(aviso['fecha_emision']),
-                'descargado': '✅' if estado_descargado else '⏳',
-                'mapa_creado': '✅' if mapas_creados else '⏳',
-                'estado_css': css_class
-            })
-    except (psycopg2.Error, ImportError):
-        logger.warning("BD no disponible, usando JSON locales")
-        json_dir = BASE_DIR / 'JSON'
-        if json_dir.exists():
-            for json_file in sorted(json_dir.glob('aviso_*.json'),
-                                   reverse=True):
-                try:
-                    with open(json_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        numero_str = data.get('numero_aviso',
-                                            json_file.stem.replace('aviso_',
-                                                                  ''))
-                        numero = int(numero_str)
-
-                        if filtro_numero and numero != filtro_numero:
-                            continue
-
-                        color = data.get('color', 'plomo').lower()
-                        if color not in ['rojo', 'naranja']:
-                            continue
-
-                        output_path = OUTPUT_DIR / 'aviso_{}'.format(numero)
-                        mapas_creados = (output_path.exists() and
-                                       (any(output_path.glob('*.webp')) or
-                                        any(output_path.glob('*.png'))))
-
-                        avisos_lista.append({
-                            'numero': numero,
-                            'titulo': data.get('titulo', 'Aviso {}'.format(
-                                numero)),
-                            'nivel': data.get('nivel', 'AMARILLO').upper(),
-                            'color': color,
-                            'fecha_emision': data.get('fecha_emision',
-                                                     '2026-02-01'),
-                            'descargado': '✅',
-                            'mapa_creado': '✅' if mapas_creados else '⏳',
-                            'estado_css': ('table-success' if mapas_creados
-                                         else 'table-warning')
-                        })
-                except (ValueError, KeyError, json.JSONDecodeError,
-                       OSError):
-                    pass
+            avisos_lista.append(dict(aviso, estado_css=css_class))
+    except (OSError, sqlite3.Error) as e:
+        logger.error("Error listando avisos: %s", str(e))
 
     return render_template('avisos.html', avisos=avisos_lista)
 
@@ -146,6 +75,7 @@ def api_descargar_aviso(numero):
 
         if result.returncode == 0:
             if json_path.exists():
+                invalidar_catalogo()
                 return jsonify({
                     'success': True,
                     'message': 'Aviso {} descargado correctamente'.format(
@@ -475,19 +405,13 @@ def api_exportar_excel(numero):
 def api_mapas_por_aviso(numero):
     """API para obtener lista de mapas de un aviso"""
     try:
-        output_path = OUTPUT_DIR / 'aviso_{}'.format(numero)
-        mapas = []
-
-        if output_path.exists():
-            for img_file in output_path.glob('*.*'):
-                if img_file.suffix.lower() in ['.webp', '.png']:
-                    mapas.append({
-                        'nombre': img_file.stem,
-                        'archivo': img_file.name,
-                        'url': '/mapas/imagen/{}/{}'.format(
-                            numero, img_file.name),
-                        'ruta': str(img_file)
-                    })
+        # Índice de la galería (SERVICIOS/galeria_mapas.py), sin recorrer OUTPUT/
+        mapas = [{
+            'nombre': mapa['departamento'],
+            'archivo': mapa['nombre'],
+            'url': mapa['url'],
+            'ruta': str(OUTPUT_DIR / 'aviso_{}'.format(numero) / mapa['nombre'])
+        } for mapa in consultar_mapas(aviso=numero, por_pagina=None)[0]]
 
         return jsonify({
             'success': True,
@@ -496,7 +420,7 @@ def api_mapas_por_aviso(numero):
             'cantidad': len(mapas)
         }), 200
 
-    except OSError as e:
+    except (OSError, sqlite3.Error) as e:
         logger.error("Error obteniendo mapas de aviso %d: %s", numero,
                     str(e))
         return jsonify({
@@ -506,6 +430,7 @@ def api_mapas_por_aviso(numero):
 
 
 @avisos_bp.route('/api/avisos/<int:numero>/info', methods=['GET'])
+@respuesta_cacheable
 def api_info_aviso(numero):
     """API para obtener info del aviso (nivel, departamentos afectados)"""
     try:
@@ -593,6 +518,7 @@ def api_info_aviso(numero):
 
 @avisos_bp.route('/api/avisos/<int:numero>/departamentos',
                   methods=['GET'])
+@respuesta_cacheable
 def api_departamentos_aviso(numero):
     """API para obtener departamentos afectados del CSV"""
     try:
@@ -641,117 +567,35 @@ def api_departamentos_aviso(numero):
 
 @avisos_bp.route('/api/avisos', methods=['GET'])
 def api_avisos():
-    """API para obtener lista de avisos desde BD y OUTPUT/"""
-    try:
-        import psycopg2
-        import psycopg2.extras
-
-        avisos_dict = {}
-
-        try:
-            conn = psycopg2.connect(
-                host=os.getenv("DB_HOST", "localhost"),
-                port=int(os.getenv("DB_PORT", "5432")),
-                database=os.getenv("DB_NAME"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD")
-            )
-            cursor = conn.cursor(
-                cursor_factory=psycopg2.extras.RealDictCursor)
-
-            query = (
-                "SELECT DISTINCT numero_aviso, titulo, nivel, color, "
-                "fecha_emision FROM avisos_completos WHERE color IN "
-                "('rojo', 'naranja') ORDER BY numero_aviso DESC"
-            )
-            cursor.execute(query)
-            avisos_bd = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            for aviso in avisos_bd:
-                numero = aviso['numero_aviso']
-                avisos_dict[numero] = {
-                    'numero': numero,
-                    'titulo': aviso['titulo'],
-                    'nivel': aviso['nivel'],
-                    'color': aviso.get('color', 'plomo'),
-                    'fecha_emision': str(aviso.get('fecha_emision', '')),
-                    'descargado': '✅',
-                    'mapa_creado': '⏳',
-                    'fuente': 'bd'
-                }
-        except (psycopg2.Error, ImportError):
-            pass
-
-        if (BASE_DIR / 'JSON').exists():
-            for json_file in sorted((BASE_DIR / 'JSON').glob('aviso_*.json'),
-                                   reverse=True):
-                try:
-                    numero_str = json_file.stem.split('_')[1]
-                    numero = int(numero_str)
-
-                    if numero not in avisos_dict:
-                        with open(json_file, 'r', encoding='utf-8') as f:
-                            datos = json.load(f)
-
-                        color = datos.get('color', 'plomo')
-                        if color.lower() not in ['rojo', 'naranja']:
-                            continue
-
-                        output_path = OUTPUT_DIR / 'aviso_{}'.format(numero)
-                        mapas_creados = (output_path.exists() and
-                                       (any(output_path.glob('*.webp')) or
-                                        any(output_path.glob('*.png'))))
-
-                        avisos_dict[numero] = {
-                            'numero': numero,
-                            'titulo': datos.get('titulo',
-                                              'Aviso {}'.format(numero)),
-                            'nivel': datos.get('nivel', 'AMARILLO'),
-                            'color': color,
-                            'fecha_emision': datos.get('fecha_emision',
-                                                      '2026-02-01'),
-                            'descargado': '✅',
-                            'mapa_creado': '✅' if mapas_creados else '⏳',
-                            'fuente': 'json'
-                        }
-                except (ValueError, KeyError, json.JSONDecodeError,
-                       OSError):
-                    pass
-
-        if OUTPUT_DIR.exists():
-            for carpeta in OUTPUT_DIR.iterdir():
-                if carpeta.is_dir() and carpeta.name.startswith('aviso_'):
-                    try:
-                        numero_str = carpeta.name.split('_')[1]
-                        numero = int(numero_str)
-                        if numero not in avisos_dict:
-                            has_maps = (any(carpeta.glob('*.webp')) or
-                                       any(carpeta.glob('*.png')))
-                            avisos_dict[numero] = {
-                                'numero': numero,
-                                'titulo': 'Aviso {}'.format(numero),
-                                'nivel': 'N/A',
-                                'color': 'plomo',
-                                'fecha_emision': '2026-02-01',
-                                'descargado': '⏳',
-                                'mapa_creado': '✅' if has_maps else '⏳',
-                                'fuente': 'output'
-                            }
-                    except (ValueError, OSError):
-                        pass
-
-        avisos_sorted = sorted(avisos_dict.values(),
-                       key=lambda x: x['numero'],
-                       reverse=True)
+    """
+    API para obtener lista de avisos (catálogo en memoria, ver
+    SERVICIOS/catalogo_avisos.py)
+
+    Query:
+        aviso: Solo ese número (sin filtro de color)
+        include: info,departamentos,mapas - anexa en cada aviso lo que
+                 devuelven /info, /departamentos y /api/mapas/aviso/<n>,
+                 para cargar la página de mapas en una sola petición
+    """
+    include = [i.strip() for i in request.args.get('include', '').split(',')
+               if i.strip()]
+    invalidos = [i for i in include if i not in INCLUDES]
+    if invalidos:
+        return jsonify({
+            'success': False,
+            'error': 'include no soportado: {} (use {})'.format(
+                ', '.join(invalidos), ','.join(INCLUDES))
+        }), 400
 
+    try:
+        avisos_lista = listar_avisos(
+            aviso=request.args.get('aviso', type=int), include=include)
         return jsonify({
             'success': True,
-            'avisos': avisos_sorted
+            'avisos': avisos_lista
         }), 200
 
-    except OSError as e:
+    except (OSError, sqlite3.Error) as e:
         logger.error("Error obteniendo avisos: %s", str(e))
         return jsonify({
             'success': False,
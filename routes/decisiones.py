@@ -3,19 +3,22 @@ Rutas de Decisiones - API endpoints para toma de decisiones
 Integra datos de clientes BD con CSV avisos y calcula estadísticas
 """
 import csv
+import itertools
 import json
 import logging
 import os
 import sys
+import threading
+from datetime import datetime
 from pathlib import Path
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import psycopg2
 import psycopg2.extras
-from flask import Blueprint, jsonify, render_template, request
-from shapely.geometry import Point
+from flask import Blueprint, Response, jsonify, render_template, request
 
 # Definir BASE_DIR y OUTPUT_DIR
 BASE_DIR = Path(__file__).parent.parent
@@ -26,10 +29,28 @@ sys.path.insert(0, str(BASE_DIR / 'LAYOUT'))
 
 # Importar funciones locales
 try:
-    from CONFIG.db import get_connection
+    from CONFIG.db import get_connection, iterar_filas, iterar_lotes_columnares, listar_avisos_vigentes
 except ImportError:
     # Fallback: usar conexión directa
     get_connection = None
+    iterar_filas = None
+    iterar_lotes_columnares = None
+    listar_avisos_vigentes = None
+
+from SERVICIOS.snapshot_clientes import (
+    actualizar_snapshot_incremental, obtener_clientes_activos, obtener_version_snapshot
+)
+from SERVICIOS.cache_respuestas import invalidar_aviso, respuesta_cacheable
+from SERVICIOS.historial import guardar_historial_aviso
+from SERVICIOS.clusters_clientes import (ZOOM_MAXIMO, construir_indice_clusters, consultar_clusters,
+                                         parsear_bbox)
+from SERVICIOS.geojson import generar_coleccion, lotes_features, respuesta_streaming
+from SERVICIOS.json_rapido import dumps
+from routes.mapas_shp import geojson_shp_aviso
+from routes.areas import (
+    BANDAS_CERCANIA_KM, MAPEO_NIVEL_COLOR, TAMANO_LOTE_CLIENTES, bloqueo_csv, clasificar_lote,
+    construir_indices_cercania, detectar_columna_nivel, encontrar_dia_critico, resumir_cercania
+)
 
 try:
     from utils import seleccionar_dia_critico, calcular_area_riesgo_alto
@@ -43,168 +64,19 @@ decisiones_bp = Blueprint('decisiones', __name__, url_prefix='')
 # Definir TEMP_DIR para SHP
 TEMP_DIR = BASE_DIR / 'TEMP'
 
+# Listados de clientes: tope de ?limit= y filas por viaje en streaming NDJSON
+MAX_LIMITE_PAGINA = int(os.getenv('MAX_LIMITE_PAGINA', '5000'))
+TAMANO_LOTE_STREAM = int(os.getenv('TAMANO_LOTE_STREAM', '2000'))
+COLUMNAS_GEOJSON_CLIENTES = (
+    "id, nombre, apellido, dni_ruc, cultivo_id, hectareas, monto_asegurado, "
+    "distrito, provincia, departamento, latitud, longitud"
+)
+
 
 # ============================================================================
 # FUNCIONES AUXILIARES
 # ============================================================================
 
-def get_clientes_por_color(numero_aviso):
-    """
-    Realiza spatial join: determina qué COLOR de SHP contiene cada cliente
-    
-    Returns:
-        {
-            'clientes_por_color': {
-                'roja': [id_cliente1, id_cliente2, ...],
-                'naranja': [...],
-                'amarilla': [...],
-                'sin_zona': [...]  # Clientes fuera del SHP
-            },
-            'mapa_cliente_color': {cliente_id: 'roja'}
-        }
-    """
-    try:
-        # 1. Obtener SHP del aviso (día crítico)
-        temp_base = TEMP_DIR / f'aviso_{numero_aviso}'
-        if not temp_base.exists():
-            logger.warning("No SHP para aviso %d", numero_aviso)
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        dict_shps = {}
-        for dia in range(1, 4):
-            dia_dir = temp_base / f'dia{dia}'
-            shp_path = dia_dir / 'view_aviso.shp'
-            if shp_path.exists():
-                dict_shps[f'dia{dia}'] = str(shp_path)
-        
-        if not dict_shps:
-            logger.warning("No hay SHP para aviso %d", numero_aviso)
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        # Seleccionar día crítico
-        dia_critico = 'dia1'
-        shp_critico = None
-        try:
-            if seleccionar_dia_critico:
-                dia_critico, shp_critico = seleccionar_dia_critico(dict_shps)
-            else:
-                shp_critico = dict_shps.get('dia1')
-        except (ValueError, AttributeError):
-            shp_critico = dict_shps.get('dia1')
-        
-        if not shp_critico:
-            logger.warning("No se pudo seleccionar SHP crítico para aviso %d", numero_aviso)
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        # 2. Leer SHP y convertir CRS si es necesario
-        try:
-            gdf_shp = gpd.read_file(shp_critico)
-            if gdf_shp.crs and gdf_shp.crs != 'EPSG:4326':
-                gdf_shp = gdf_shp.to_crs('EPSG:4326')
-        except (OSError, ValueError) as e:
-            logger.error("Error leyendo SHP: %s", str(e))
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        # 3. Mapear nivel a color
-        nivel_color = {
-            'Nivel 4': 'rojo',
-            'Nivel 3': 'naranja',
-            'Nivel 2': 'amarillo',
-            'Nivel 1': 'amarillo'  # Nivel 1 tratado como amarillo
-        }
-        gdf_shp['color_zona'] = gdf_shp['nivel'].map(nivel_color).fillna('sin_zona')
-        
-        # 4. Obtener clientes de la BD
-        conn = get_db_connection()
-        if not conn:
-            logger.error("No connection to DB")
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        try:
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("""
-                SELECT id, latitud, longitud, departamento, provincia, distrito
-                FROM clientes
-                WHERE estado = 'activo'
-                ORDER BY id
-            """)
-            clientes_db = cursor.fetchall()
-            cursor.close()
-            conn.close()
-        except psycopg2.Error as e:
-            logger.error("Error consultando clientes: %s", str(e))
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        # 5. Convertir clientes a GeoDataFrame
-        if not clientes_db:
-            logger.warning("No clientes en BD")
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        clientes_geom = []
-        for c in clientes_db:
-            if c['latitud'] and c['longitud']:
-                clientes_geom.append({
-                    'id': c['id'],
-                    'geometry': Point(float(c['longitud']), float(c['latitud'])),
-                    'departamento': c.get('departamento', ''),
-                    'provincia': c.get('provincia', ''),
-                    'distrito': c.get('distrito', '')
-                })
-        
-        if not clientes_geom:
-            logger.warning("No clients con geometría")
-            return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        gdf_clientes = gpd.GeoDataFrame(clientes_geom, crs='EPSG:4326')
-        
-        # 6. Spatial join: determinar qué cliente está en qué polígono SHP
-        # Usar sjoin para encontrar qué cliente está dentro de qué polígono
-        try:
-            sjoin_result = gpd.sjoin(gdf_clientes, gdf_shp[['geometry', 'color_zona']], 
-                                     how='left', predicate='within')
-        except Exception as e:
-            logger.error("Error en spatial join: %s", str(e))
-            # Fallback: usar contains en lugar de within
-            try:
-                sjoin_result = gpd.sjoin(gdf_clientes, gdf_shp[['geometry', 'color_zona']], 
-                                         how='left', predicate='contains')
-            except Exception as e2:
-                logger.error("Fallback spatial join también falló: %s", str(e2))
-                return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-        
-        # 7. Agrupar clientes por color
-        clientes_por_color = defaultdict(list)
-        mapa_cliente_color = {}
-        
-        for _, row in sjoin_result.iterrows():
-            cliente_id = row['id']
-            # IMPORTANTE: color_zona puede estar en la columna o como index
-            # Siempre convertir a string
-            if 'color_zona' in row.index:
-                color = str(row['color_zona']) if pd.notna(row['color_zona']) else 'sin_zona'
-            else:
-                color = 'sin_zona'
-            
-            # Si aún así es NaN o None, usar sin_zona
-            if pd.isna(color) or color == 'None' or not color:
-                color = 'sin_zona'
-            
-            clientes_por_color[color].append(cliente_id)
-            mapa_cliente_color[cliente_id] = color
-        
-        logger.info("Spatial join completado para aviso %d: %d clientes asignados",
-                    numero_aviso, len(mapa_cliente_color))
-        
-        return {
-            'clientes_por_color': dict(clientes_por_color),
-            'mapa_cliente_color': mapa_cliente_color
-        }
-    
-    except Exception as e:
-        logger.error("Error en get_clientes_por_color: %s", str(e))
-        return {'clientes_por_color': {}, 'mapa_cliente_color': {}}
-
-
 def get_db_connection():
     """
     Obtener conexión a PostgreSQL
@@ -220,7 +92,8 @@ def get_db_connection():
 def parse_csv_avisos(numero_aviso):
     """
     Lee CSV de avisos afectados (distritos_afectados.csv)
-    Retorna lista de dicts: {departamento, provincia, distrito}
+    Retorna lista de dicts: {departamento, provincia, distrito, ubigeo}
+    (ubigeo vacío en CSVs generados antes de incluir IDDIST)
     """
     csv_path = OUTPUT_DIR / f'aviso_{numero_aviso}' / 'distritos_afectados.csv'
 
@@ -237,7 +110,8 @@ def parse_csv_avisos(numero_aviso):
                     distritos.append({
                         'departamento': row.get('DEPARTAMEN', '').strip().upper(),
                         'provincia': row.get('PROVINCIA', '').strip().upper(),
-                        'distrito': row.get('DISTRITO', '').strip().upper()
+                        'distrito': row.get('DISTRITO', '').strip().upper(),
+                        'ubigeo': (row.get('IDDIST') or '').strip()
                     })
         logger.info("CSV parseado: %d distritos para aviso %d", len(distritos), numero_aviso)
         return distritos
@@ -246,15 +120,276 @@ def parse_csv_avisos(numero_aviso):
         return []
 
 
-def get_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=None):
+def obtener_ubigeos_afectados(zonas_afectadas):
+    """UBIGEOs (enteros) de las zonas afectadas, ordenados"""
+    ubigeos = set()
+    for zona in zonas_afectadas:
+        if zona.get('ubigeo', '').isdigit():
+            ubigeos.add(int(zona['ubigeo']))
+    return sorted(ubigeos)
+
+
+def filtro_sql_afectados(zonas_afectadas, alias=''):
+    """
+    Condición SQL para clientes dentro de las zonas afectadas del aviso
+    
+    Los clientes con distrito asignado (asignar_distritos.py) se cruzan por
+    distrito_id contra los UBIGEO del CSV; los que aún no tienen asignación
+    (o CSVs sin IDDIST) se cruzan por departamento como antes.
+    
+    Returns:
+        Tupla (sql, params); ('1=0', []) si no hay zonas
+    """
+    pre = f'{alias}.' if alias else ''
+    ubigeos = obtener_ubigeos_afectados(zonas_afectadas)
+    deptos = sorted(set(zona['departamento'].upper().strip() for zona in zonas_afectadas))
+    
+    if not deptos:
+        return '1=0', []
+    
+    if not ubigeos:
+        return f"UPPER(TRIM({pre}departamento)) = ANY(%s)", [deptos]
+    
+    sql = (f"({pre}distrito_id = ANY(%s) OR "
+           f"({pre}distrito_asignado_en IS NULL AND UPPER(TRIM({pre}departamento)) = ANY(%s)))")
+    return sql, [ubigeos, deptos]
+
+
+def mascara_afectados(df, zonas_afectadas):
+    """
+    Equivalente de filtro_sql_afectados sobre el snapshot de clientes
+    
+    Returns:
+        Serie booleana alineada con df
+    """
+    ubigeos = obtener_ubigeos_afectados(zonas_afectadas)
+    deptos = set(zona['departamento'].upper().strip() for zona in zonas_afectadas)
+    en_depto = df['departamento_norm'].isin(deptos)
+    
+    if not ubigeos:
+        return en_depto
+    
+    asignado = df['distrito_asignado'].fillna(False).astype(bool)
+    return df['distrito_id'].isin(ubigeos).fillna(False).astype(bool) | (~asignado & en_depto)
+
+
+RESUMEN_AFECTADOS_VACIO = {
+    'total_agricultores': 0,
+    'cultivos': {},
+    'total_hectareas': 0,
+    'total_monto_asegurado': 0,
+    'financieras': {}
+}
+
+
+def where_clientes_afectados(zonas_afectadas, depto=None, provincia=None, distrito=None):
+    """
+    WHERE de clientes en zonas afectadas + filtros opcionales por ubicación
+    
+    Filtra por distritos afectados (UBIGEO precomputado por cliente); clientes
+    aún sin distrito asignado se cruzan por departamento
+    
+    Returns:
+        Tupla (where_clause, params)
+    """
+    sql_afectados, params = filtro_sql_afectados(zonas_afectadas)
+    where_parts = [sql_afectados]
+    
+    # Agregar filtros opcionales con AND
+    if depto:
+        where_parts.append("UPPER(TRIM(departamento)) = %s")
+        params.append(depto.upper().strip())
+    if provincia:
+        where_parts.append("UPPER(TRIM(provincia)) = %s")
+        params.append(provincia.upper().strip())
+    if distrito:
+        where_parts.append("UPPER(TRIM(distrito)) = %s")
+        params.append(distrito.upper().strip())
+    
+    return " AND ".join(where_parts), params
+
+
+def query_clientes_afectados(zonas_afectadas, depto=None, provincia=None, distrito=None,
+                             columnas='*', con_coordenadas=False, after_id=None, limit=None):
+    """
+    SELECT de clientes afectados ordenado por id (paginación keyset)
+    
+    Args:
+        columnas: Lista SQL de columnas del SELECT
+        con_coordenadas: Solo clientes con latitud y longitud
+        after_id: Devolver clientes con id mayor a este
+        limit: Máximo de filas
+    
+    Returns:
+        Tupla (query, params)
+    """
+    where_clause, params = where_clientes_afectados(zonas_afectadas, depto, provincia, distrito)
+    if con_coordenadas:
+        where_clause += " AND latitud IS NOT NULL AND longitud IS NOT NULL"
+    if after_id is not None:
+        where_clause += " AND id > %s"
+        params.append(after_id)
+    
+    query = f"SELECT {columnas} FROM clientes WHERE {where_clause} ORDER BY id"
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def lotes_features_clientes(filas, estado, tamano_lote=TAMANO_LOTE_STREAM):
+    """
+    Features de clientes serializados por lotes (bytes separados por coma)
+    
+    Args:
+        estado: Dict que se actualiza con 'total' y 'ultimo_id' al recorrer
+    """
+    lote = []
+    for fila in filas:
+        lote.append(feature_cliente(fila))
+        if len(lote) >= tamano_lote:
+            estado['total'] += len(lote)
+            estado['ultimo_id'] = lote[-1]['properties']['id']
+            yield dumps(lote)[1:-1]
+            lote = []
+    if lote:
+        estado['total'] += len(lote)
+        estado['ultimo_id'] = lote[-1]['properties']['id']
+        yield dumps(lote)[1:-1]
+
+
+def feature_cliente(agr):
+    """Fila de clientes -> Feature GeoJSON Point para el mapa"""
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [float(agr['longitud']), float(agr['latitud'])]
+        },
+        'properties': {
+            'id': agr.get('id'),
+            'nombre': f"{agr.get('nombre', '')} {agr.get('apellido', '')}",
+            'dni_ruc': agr.get('dni_ruc', ''),
+            'cultivo_id': agr.get('cultivo_id'),
+            'hectareas': float(agr['hectareas']) if agr.get('hectareas') is not None else None,
+            'monto_asegurado': float(agr['monto_asegurado']) if agr.get('monto_asegurado') is not None else None,
+            'distrito': agr.get('distrito', ''),
+            'provincia': agr.get('provincia', ''),
+            'departamento': agr.get('departamento', '')
+        }
+    }
+
+
+def parametros_paginacion():
+    """
+    Lee ?after_id=&limit= del request
+    
+    Returns:
+        Tupla (after_id, limit); limit se acota a MAX_LIMITE_PAGINA
+        
+    Raises:
+        ValueError: Si los parámetros no son enteros válidos
+    """
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if 'after_id' in request.args and after_id is None:
+        raise ValueError('after_id debe ser entero')
+    if 'limit' in request.args and (limit is None or limit <= 0):
+        raise ValueError('limit debe ser un entero positivo')
+    if limit:
+        limit = min(limit, MAX_LIMITE_PAGINA)
+    return after_id, limit
+
+
+def pide_ndjson():
+    """True si el cliente pidió streaming NDJSON (?format=ndjson o Accept)"""
+    if request.args.get('format', '').lower() == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def respuesta_ndjson(query, params, transformar=None):
+    """
+    Respuesta application/x-ndjson (una línea JSON por fila) leída con un
+    cursor de servidor: la memoria no depende del total de filas
+    
+    Args:
+        transformar: Función fila -> dict; None = la fila tal cual
+    """
+    def generar():
+        for fila in iterar_filas(query, params, tamano_lote=TAMANO_LOTE_STREAM):
+            yield dumps(transformar(fila) if transformar else fila) + b'\n'
+    
+    return respuesta_streaming(generar(), mimetype='application/x-ndjson')
+
+
+def resumir_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=None):
+    """
+    Totales de clientes afectados calculados en PostgreSQL (modo resumen)
+    
+    Una sola consulta con GROUPING SETS: fila total + conteo por cultivo.
+    No transfiere filas de clientes.
+    
+    Returns:
+        Mismo formato que get_clientes_afectados sin la lista 'agricultores'
+        ({} si falla la conexión o la consulta)
+    """
+    zonas_afectadas = parse_csv_avisos(numero_aviso)
+    if not zonas_afectadas:
+        return dict(RESUMEN_AFECTADOS_VACIO)
+    
+    conn = get_db_connection()
+    if not conn:
+        return {}
+    
+    try:
+        where_clause, params = where_clientes_afectados(zonas_afectadas, depto, provincia, distrito)
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(f"""
+            SELECT GROUPING(cultivo_id) = 1 AS es_total, cultivo_id,
+                   COUNT(*) AS agricultores,
+                   COALESCE(SUM(hectareas), 0) AS hectareas,
+                   COALESCE(SUM(monto_asegurado), 0) AS monto
+            FROM clientes
+            WHERE {where_clause}
+            GROUP BY GROUPING SETS ((), (cultivo_id))
+        """, params)
+        filas = cursor.fetchall()
+        cursor.close()
+        
+        resumen = dict(RESUMEN_AFECTADOS_VACIO, cultivos={})
+        for fila in filas:
+            if fila['es_total']:
+                resumen['total_agricultores'] = fila['agricultores']
+                resumen['total_hectareas'] = round(float(fila['hectareas']), 2)
+                resumen['total_monto_asegurado'] = round(float(fila['monto']), 2)
+            elif fila['cultivo_id']:
+                resumen['cultivos'][str(fila['cultivo_id'])] = fila['agricultores']
+        
+        logger.info("Resumen de afectados para aviso %d: %d clientes",
+                    numero_aviso, resumen['total_agricultores'])
+        return resumen
+    
+    except psycopg2.Error as e:
+        logger.error("Error resumiendo clientes afectados: %s", str(e))
+        return {}
+    finally:
+        conn.close()
+
+
+def get_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=None,
+                           after_id=None, limit=None):
     """
-    Consulta BD clientes y filtra por zona afectada del aviso
+    Consulta BD clientes y filtra por zona afectada del aviso (modo filas)
+    Para solo totales usar resumir_clientes_afectados (no transfiere filas)
 
     Args:
         numero_aviso: Número del aviso
         depto: Filtro opcional por departamento
         provincia: Filtro opcional por provincia
         distrito: Filtro opcional por distrito
+        after_id: Paginación keyset: clientes con id mayor a este
+        limit: Paginación keyset: tamaño de página (los totales son de la página)
 
     Returns:
         {
@@ -263,7 +398,8 @@ def get_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=No
             'cultivos': {cultivo: count},
             'total_hectareas': float,
             'total_monto_asegurado': float,
-            'financieras': {financiera: count}
+            'financieras': {financiera: count},
+            'siguiente_after_id': int | None  # solo con limit
         }
     """
     conn = get_db_connection()
@@ -274,65 +410,20 @@ def get_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=No
         # Leer CSV de avisos para obtener zonas afectadas
         zonas_afectadas = parse_csv_avisos(numero_aviso)
         if not zonas_afectadas:
-            return {
-                'total_agricultores': 0,
-                'agricultores': [],
-                'cultivos': {},
-                'total_hectareas': 0,
-                'total_monto_asegurado': 0,
-                'financieras': {}
-            }
+            return {**RESUMEN_AFECTADOS_VACIO, 'agricultores': []}
 
-        # Normalizar CSV data
-        zonas_normalizadas = set()
-        for zona in zonas_afectadas:
-            zonas_normalizadas.add((
-                zona['departamento'].upper().strip(),
-                zona['provincia'].upper().strip(),
-                zona['distrito'].upper().strip()
-            ))
-
-        # Construir query OPTIMIZADA - filtrar por departamentos afectados
-        # NOTA: La BD tiene datos de prueba con provincias/distritos genéricos,
-        # por lo que el cruce se hace solo por DEPARTAMENTO
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        # Extraer departamentos únicos de las zonas afectadas
-        deptos_unicos = set([zona[0] for zona in zonas_normalizadas])
-        
-        # Construir query simple con IN por departamentos
-        where_parts = []
-        all_params = []
-        
-        # Filtro por departamentos afectados
-        if deptos_unicos:
-            placeholders = ', '.join(['%s'] * len(deptos_unicos))
-            where_parts.append(f"UPPER(TRIM(departamento)) IN ({placeholders})")
-            all_params.extend(list(deptos_unicos))
-        
-        # Agregar filtros opcionales con AND
-        if depto:
-            where_parts.append("UPPER(TRIM(departamento)) = %s")
-            all_params.append(depto.upper().strip())
-        if provincia:
-            where_parts.append("UPPER(TRIM(provincia)) = %s")
-            all_params.append(provincia.upper().strip())
-        if distrito:
-            where_parts.append("UPPER(TRIM(distrito)) = %s")
-            all_params.append(distrito.upper().strip())
-
-        # Construir query final
-        where_clause = " AND ".join(where_parts) if where_parts else "1=1"
-        query = f"SELECT * FROM clientes WHERE {where_clause}"
+        query, all_params = query_clientes_afectados(zonas_afectadas, depto, provincia, distrito,
+                                                     after_id=after_id, limit=limit)
+        deptos_unicos = set(zona['departamento'] for zona in zonas_afectadas)
 
         cursor.execute(query, all_params)
         
-        # Obtener clientes de departamentos afectados
-        # (El cruce exacto por prov/dist se omite porque la BD tiene datos de prueba)
+        # Obtener clientes de zonas afectadas
         agricultores = cursor.fetchall()
 
         # Log de consulta
-        logger.info("Clientes en departamentos afectados: %d (deptos: %s)",
+        logger.info("Clientes en zonas afectadas: %d (deptos: %s)",
                     len(agricultores), list(deptos_unicos)[:5])
 
         # Procesar datos
@@ -355,17 +446,8 @@ def get_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=No
         cursor.close()
         conn.close()
 
-        # Convertir agricultores a list de dicts JSON-serializable
-        agricultores_list = []
-        for agr in agricultores:
-            agr_dict = dict(agr)
-            # Convertir tipos especiales
-            for key, value in agr_dict.items():
-                if hasattr(value, 'isoformat'):
-                    agr_dict[key] = value.isoformat()
-                elif isinstance(value, float):
-                    agr_dict[key] = round(value, 2)
-            agricultores_list.append(agr_dict)
+        # Filas tal cual: el proveedor JSON convierte Decimal y fechas
+        agricultores_list = agricultores
 
         result = {
             'total_agricultores': len(agricultores_list),
@@ -375,6 +457,8 @@ def get_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=No
             'total_monto_asegurado': round(total_monto, 2),
             'financieras': dict(financieras_counter)
         }
+        if limit:
+            result['siguiente_after_id'] = agricultores_list[-1]['id'] if len(agricultores_list) == limit else None
 
         logger.info("Clientes obtenidos para aviso %d: %d registros",
                     numero_aviso, len(agricultores_list))
@@ -388,10 +472,15 @@ def get_clientes_afectados(numero_aviso, depto=None, provincia=None, distrito=No
             conn.close()
 
 
-def get_estadisticas_aviso(numero_aviso):
+def get_estadisticas_aviso(numero_aviso, clientes_data=None):
     """
     Calcula estadísticas del aviso: Crítico, Alto Riesgo, etc.
 
+    Args:
+        numero_aviso: Número del aviso
+        clientes_data: Resultado de resumir_clientes_afectados ya calculado
+                       (opcional, evita repetir la consulta)
+
     Returns:
         {
             'critico': {...},
@@ -419,31 +508,1012 @@ def get_estadisticas_aviso(numero_aviso):
         if not aviso:
             return {}
 
-        color = aviso['color'].lower()
+        color = aviso['color'].lower()
+
+        # Totales de clientes (agregados en BD, sin filas)
+        if clientes_data is None:
+            clientes_data = resumir_clientes_afectados(numero_aviso)
+
+        stats = {
+            'color': color,
+            'critico': {
+                'nivel': 'CRÍTICO' if color == 'rojo' else '',
+                'count': clientes_data.get('total_agricultores', 0) if color == 'rojo' else 0
+            },
+            'alto_riesgo': {
+                'nivel': 'ALTO RIESGO' if color == 'naranja' else '',
+                'count': clientes_data.get('total_agricultores', 0) if color == 'naranja' else 0
+            },
+            'agricultores_total': clientes_data.get('total_agricultores', 0),
+            'poliza_total': clientes_data.get('total_monto_asegurado', 0),
+            'hectareas_total': clientes_data.get('total_hectareas', 0)
+        }
+
+        return stats
+
+    except psycopg2.Error as e:
+        logger.error("Error calculando estadísticas: %s", str(e))
+        return {}
+
+
+# ============================================================================
+# MOTOR DE KPIs
+# Un solo frame por aviso (clasificación + clientes + entidades + cultivos)
+# y todas las agregaciones con groupby; las rutas proyectan el resultado
+# ============================================================================
+
+NIVELES_AFECTACION = ['Rojo', 'Naranja', 'Amarillo']
+COLORES_KPI = ['Rojo', 'Naranja', 'Amarillo', 'Verde']
+SEVERIDAD_NIVEL = {'Rojo': 0, 'Naranja': 1, 'Amarillo': 2, 'Verde': 3}
+COLUMNAS_CERCANIA = ['nivel_cercano', 'banda_cercania']
+
+# Avisos con KPIs en memoria por proceso (LRU)
+MAX_AVISOS_KPI_CACHE = int(os.getenv('MAX_AVISOS_KPI_CACHE', '8'))
+
+# KPIs materializados por aviso (OUTPUT/aviso_N/kpis.json), compartidos entre workers
+KPIS_JSON = 'kpis.json'
+VERSION_FORMATO_KPIS = 1
+
+# _kpis_lock protege solo el LRU y el dict de locks; el cálculo y la
+# escritura de kpis.json/CSV se serializan por aviso (_lock_kpis_aviso)
+_kpis_lock = threading.Lock()
+_kpis_cache = OrderedDict()  # numero -> (firma, resultado)
+_kpis_locks_aviso = {}  # numero -> RLock
+
+# Índices de clusters del mapa por aviso (LRU, misma firma que los KPIs);
+# _clusters_lock protege el LRU y los locks, la construcción va por aviso
+_clusters_lock = threading.Lock()
+_clusters_cache = OrderedDict()  # numero -> (firma, indice)
+_clusters_locks_aviso = {}  # numero -> Lock
+
+
+def buscar_csv_clasificacion(numero_aviso):
+    """
+    CSV de clientes clasificados del aviso (preferencia: día 3, 2, 1)
+    
+    Returns:
+        Tupla (dia, csv_path) o (None, None) si no hay CSV
+    """
+    for dia in [3, 2, 1]:
+        csv_path = OUTPUT_DIR / f'aviso_{numero_aviso}' / f'clientes_por_nivel_dia{dia}.csv'
+        if csv_path.exists():
+            return dia, csv_path
+    return None, None
+
+
+def clasificar_en_vivo(numero_aviso, activos):
+    """
+    Clasifica los clientes activos contra el SHP del día crítico cuando aún no
+    existe el CSV de clasificación (mismo criterio que areas.clasificar_lote)
+    
+    Returns:
+        Tupla (DataFrame [id, nivel], dia) o (None, None) si no hay SHP
+    """
+    dia, _ = encontrar_dia_critico(numero_aviso)
+    if dia is None:
+        return None, None
+    
+    shp_alerta = gpd.read_file(TEMP_DIR / f'aviso_{numero_aviso}' / f'dia{dia}' / 'view_aviso.shp')
+    columna_color = detectar_columna_nivel(shp_alerta)
+    if not columna_color:
+        logger.warning("SHP del aviso %d sin columna de nivel", numero_aviso)
+        return None, None
+    
+    con_coords = activos.dropna(subset=['latitud', 'longitud'])
+    lote = {col: con_coords[col].to_numpy() for col in ['id', 'latitud', 'longitud']}
+    clasificacion = clasificar_lote(lote, shp_alerta[[columna_color, 'geometry']], columna_color)
+    return clasificacion[['id', 'nivel']], dia
+
+
+def _firma_kpis(numero_aviso):
+    """
+    Clave de validez del caché: versión de clientes + mtimes de los archivos
+    de entrada (solo tipos JSON, se guarda tal cual en kpis.json)
+    """
+    _, csv_path = buscar_csv_clasificacion(numero_aviso)
+    if csv_path:
+        archivos = [csv_path]
+    else:
+        archivos = [TEMP_DIR / f'aviso_{numero_aviso}' / f'dia{dia}' / 'view_aviso.shp' for dia in [1, 2, 3]]
+    archivos.append(OUTPUT_DIR / f'aviso_{numero_aviso}' / 'distritos_afectados.csv')
+    
+    mtimes = [[f'{p.parent.name}/{p.name}', p.stat().st_mtime_ns] for p in archivos if p.exists()]
+    return {'clientes': obtener_version_snapshot(), 'archivos': mtimes}
+
+
+def construir_frame_clientes(activos, zonas_afectadas, clasificacion):
+    """
+    Une clientes activos con su clasificación: una fila por cliente con nivel
+    (más severo si cae en polígonos solapados), en_zona (distrito afectado) y
+    afectado. Cada fila depende solo de su cliente, por eso sirve tanto para
+    la cartera completa como para el subconjunto de un delta.
+    
+    Args:
+        activos: Filas del snapshot (estado 'activo')
+        zonas_afectadas: Zonas del aviso (parse_csv_avisos)
+        clasificacion: DataFrame con id, nivel (y cercanía) o None (todos Verde)
+    """
+    frame = activos[[
+        'id', 'departamento_norm', 'provincia_norm', 'distrito_norm',
+        'hectareas', 'monto_asegurado', 'entidad_id', 'entidad_nombre',
+        'cultivo_id', 'cultivo_nombre', 'latitud', 'longitud'
+    ]].reset_index(drop=True)
+    frame = frame.fillna({'hectareas': 0.0, 'monto_asegurado': 0.0})
+    frame['en_zona'] = mascara_afectados(activos, zonas_afectadas).to_numpy() if zonas_afectadas else False
+    
+    if clasificacion is None:
+        frame['nivel'] = 'Verde'
+    else:
+        columnas = ['id', 'nivel'] + [c for c in COLUMNAS_CERCANIA if c in clasificacion.columns]
+        clasificacion = clasificacion[columnas].assign(nivel=clasificacion['nivel'].str.strip())
+        clasificacion = (clasificacion
+                         .assign(_severidad=clasificacion['nivel'].map(SEVERIDAD_NIVEL).fillna(len(SEVERIDAD_NIVEL)))
+                         .sort_values('_severidad', kind='stable')
+                         .drop_duplicates('id')
+                         .drop(columns='_severidad'))
+        frame = frame.merge(clasificacion, on='id', how='left')
+    
+    frame['afectado'] = frame['nivel'].isin(NIVELES_AFECTACION) & frame['en_zona']
+    return frame
+
+
+def construir_frame_aviso(numero_aviso):
+    """
+    Frame unido del aviso para toda la cartera activa (ver construir_frame_clientes)
+    
+    Returns:
+        Tupla (frame, dia, fuente, zonas_afectadas); fuente es 'csv', 'shp' o
+        None (sin clasificación: todos Verde)
+    """
+    activos = obtener_clientes_activos()
+    zonas_afectadas = parse_csv_avisos(numero_aviso)
+    
+    dia, csv_path = buscar_csv_clasificacion(numero_aviso)
+    if csv_path:
+        clasificacion, fuente = pd.read_csv(csv_path), 'csv'
+    else:
+        clasificacion, dia = clasificar_en_vivo(numero_aviso, activos)
+        fuente = 'shp' if clasificacion is not None else None
+    
+    if clasificacion is None:
+        logger.warning("Sin clasificación para aviso %d: todos los clientes como Verde", numero_aviso)
+    
+    frame = construir_frame_clientes(activos, zonas_afectadas, clasificacion)
+    return frame, dia, fuente, zonas_afectadas
+
+
+def _totales(df):
+    """{agricultores, hectareas, poliza} de un subconjunto del frame"""
+    return {
+        'agricultores': int(len(df)),
+        'hectareas': round(float(df['hectareas'].sum()), 2),
+        'poliza': round(float(df['monto_asegurado'].sum()), 2)
+    }
+
+
+def _agrupar(df, claves):
+    """groupby con conteo, hectáreas y monto (incluye claves nulas)"""
+    return (df.groupby(claves, dropna=False, sort=False)
+              .agg(agricultores=('id', 'size'), hectareas=('hectareas', 'sum'), monto=('monto_asegurado', 'sum'))
+              .reset_index())
+
+
+def _registros(df):
+    """DataFrame -> lista de dicts JSON-serializables (None en lugar de NaN/NA)"""
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict('records')
+
+
+def _agregaciones_geograficas(df):
+    """Árbol depto -> provincias -> distritos con total, hectareas y monto"""
+    df = df.fillna({'departamento_norm': 'SIN DATOS'})
+    niveles = [['departamento_norm'], ['departamento_norm', 'provincia_norm'],
+               ['departamento_norm', 'provincia_norm', 'distrito_norm']]
+    
+    arbol = {}
+    for claves in niveles:
+        for fila in _agrupar(df, claves).itertuples(index=False):
+            datos = {'total': int(fila.agricultores), 'hectareas': round(float(fila.hectareas), 2),
+                     'monto': round(float(fila.monto), 2)}
+            if len(claves) == 1:
+                arbol[fila.departamento_norm] = {**datos, 'provincias': {}}
+            elif len(claves) == 2:
+                arbol[fila.departamento_norm]['provincias'][fila.provincia_norm] = {**datos, 'distritos': {}}
+            else:
+                arbol[fila.departamento_norm]['provincias'][fila.provincia_norm]['distritos'][fila.distrito_norm] = datos
+    return arbol
+
+
+def agregar_kpis(frame):
+    """
+    Agregaciones aditivas de un frame (cartera completa o subconjunto de un
+    delta): sumar/restar las de dos subconjuntos equivale a recalcular
+    
+    Returns:
+        Dict con totales, afectados, por_color, zonas_por_color, entidades,
+        cultivos, ubicaciones, agregaciones y cercania (JSON-serializable)
+    """
+    clasificados = frame[frame['nivel'].notna()]
+    afectados = frame[frame['afectado']]
+    
+    # Por color (clasificados) y por color dentro de zonas afectadas
+    por_color = {color: _totales(clasificados[clasificados['nivel'] == color]) for color in COLORES_KPI}
+    en_zona = clasificados[clasificados['en_zona']]
+    zonas_por_color = {color: _totales(en_zona[en_zona['nivel'] == color]) for color in NIVELES_AFECTACION}
+    
+    # Entidades financieras (solo afectados)
+    entidades = _agrupar(afectados, ['entidad_id', 'entidad_nombre'])
+    entidades['entidad_nombre'] = entidades['entidad_nombre'].fillna('SIN ENTIDAD')
+    entidades['pct_damage'] = (100 * entidades['agricultores'] / max(len(afectados), 1)).round(1)
+    entidades = entidades.sort_values('agricultores', ascending=False, kind='stable')
+    
+    # Cultivo x departamento (solo afectados)
+    cultivos = _agrupar(afectados, ['cultivo_id', 'cultivo_nombre', 'departamento_norm'])
+    cultivos['cultivo_nombre'] = cultivos['cultivo_nombre'].fillna('Cultivo ' + cultivos['cultivo_id'].astype(str))
+    cultivos = cultivos.sort_values('agricultores', ascending=False, kind='stable')
+    
+    # Departamento x provincia (todos los activos vs en zona afectada)
+    ubicaciones = _agrupar(frame, ['departamento_norm', 'provincia_norm']).rename(
+        columns={'agricultores': 'agr_totales'})[['departamento_norm', 'provincia_norm', 'agr_totales']]
+    ubicaciones_zona = _agrupar(frame[frame['en_zona']], ['departamento_norm', 'provincia_norm']).rename(
+        columns={'agricultores': 'agr_afectados', 'hectareas': 'ha_afectadas', 'monto': 'monto_afectado'})
+    ubicaciones = ubicaciones.merge(ubicaciones_zona, on=['departamento_norm', 'provincia_norm'], how='left')
+    ubicaciones = ubicaciones.fillna({'agr_afectados': 0, 'ha_afectadas': 0.0, 'monto_afectado': 0.0})
+    ubicaciones = ubicaciones.sort_values(['departamento_norm', 'provincia_norm'], kind='stable')
+    
+    # Cercanía a zonas críticas (solo si el CSV trae las columnas)
+    cercania = None
+    if all(c in frame.columns for c in COLUMNAS_CERCANIA):
+        cercania = resumir_cercania(
+            clasificados.rename(columns={'monto_asegurado': 'poliza'}), columnas_suma=('hectareas', 'poliza'))
+    
+    for df in (entidades, cultivos, ubicaciones):
+        for col in ('hectareas', 'monto', 'ha_afectadas', 'monto_afectado'):
+            if col in df.columns:
+                df[col] = df[col].astype(float).round(2)
+    
+    return {
+        'totales': _totales(clasificados),
+        'afectados': _totales(afectados),
+        'por_color': por_color,
+        'zonas_por_color': zonas_por_color,
+        'entidades': _registros(entidades.rename(columns={'entidad_nombre': 'nombre'})),
+        'cultivos': _registros(cultivos.rename(columns={'departamento_norm': 'departamento'})),
+        'ubicaciones': _registros(ubicaciones.astype({'agr_afectados': int})),
+        'agregaciones': _agregaciones_geograficas(frame[frame['en_zona']]),
+        'cercania': cercania
+    }
+
+
+def calcular_kpis_aviso(numero_aviso):
+    """
+    Calcula todas las agregaciones del Centro de Decisiones para un aviso
+    
+    Returns:
+        Dict con numero_aviso, dia, fuente, zonas_afectadas, bandas_cercania_km
+        y las agregaciones de agregar_kpis (JSON-serializable)
+        
+    Raises:
+        psycopg2.Error: Si falla la lectura del snapshot de clientes
+    """
+    frame, dia, fuente, zonas_afectadas = construir_frame_aviso(numero_aviso)
+    return {
+        'numero_aviso': numero_aviso,
+        'dia': dia,
+        'fuente': fuente,
+        'zonas_afectadas': len(zonas_afectadas),
+        'bandas_cercania_km': BANDAS_CERCANIA_KM,
+        **agregar_kpis(frame)
+    }
+
+
+def _ruta_kpis_json(numero_aviso):
+    return OUTPUT_DIR / f'aviso_{numero_aviso}' / KPIS_JSON
+
+
+def leer_kpis_materializados(numero_aviso, firma):
+    """
+    KPIs de kpis.json si fue generado con la misma firma de entradas
+    
+    Returns:
+        Dict de KPIs o None si no existe, es de otro formato o está obsoleto
+    """
+    ruta = _ruta_kpis_json(numero_aviso)
+    if not ruta.exists():
+        return None
+    
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            contenido = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("kpis.json ilegible para aviso %d: %s", numero_aviso, e)
+        return None
+    
+    if contenido.get('formato') != VERSION_FORMATO_KPIS or contenido.get('firma') != firma:
+        logger.info("kpis.json del aviso %d obsoleto, se recalcula", numero_aviso)
+        return None
+    return contenido['kpis']
+
+
+def escribir_kpis_materializados(numero_aviso, firma, kpis):
+    """Escribe kpis.json de forma atómica (tmp + replace)"""
+    ruta = _ruta_kpis_json(numero_aviso)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    tmp = ruta.with_name(f'{ruta.name}.{os.getpid()}.tmp')
+    
+    contenido = {
+        'formato': VERSION_FORMATO_KPIS,
+        'generado_en': datetime.now().isoformat(timespec='seconds'),
+        'firma': firma,
+        'kpis': kpis
+    }
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(contenido, f, ensure_ascii=False, default=str)
+    os.replace(tmp, ruta)
+    return ruta
+
+
+def materializar_kpis_aviso(numero_aviso):
+    """
+    Calcula y guarda OUTPUT/aviso_N/kpis.json (llamada desde procesar_aviso.py)
+    
+    Returns:
+        Ruta del kpis.json escrito
+        
+    Raises:
+        psycopg2.Error: Si falla la lectura del snapshot de clientes
+    """
+    with _lock_kpis_aviso(numero_aviso):
+        firma = _firma_kpis(numero_aviso)
+        kpis = calcular_kpis_aviso(numero_aviso)
+        _guardar_kpis_en_cache(numero_aviso, firma, kpis)
+        return escribir_kpis_materializados(numero_aviso, firma, kpis)
+
+
+def fecha_emision_aviso(numero_aviso):
+    """fecha_emision de JSON/aviso_N.json (None si no está descargado)"""
+    json_path = BASE_DIR / 'JSON' / f'aviso_{numero_aviso}.json'
+    if not json_path.exists():
+        return None
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('fecha_emision')
+    except (OSError, ValueError):
+        return None
+
+
+def registrar_historial_aviso(numero_aviso, fecha=None):
+    """
+    Agrega el aviso al historial entre avisos (llamada desde procesar_aviso.py
+    y registrar_historial.py)
+    
+    Args:
+        fecha: fecha_emision del aviso (default: la del JSON del aviso)
+    
+    Raises:
+        psycopg2.Error: Si falla la lectura del snapshot de clientes
+        RuntimeError: Si pyarrow no está instalado
+    """
+    frame, _, _, _ = construir_frame_aviso(numero_aviso)
+    return guardar_historial_aviso(numero_aviso, fecha or fecha_emision_aviso(numero_aviso),
+                                   frame, obtener_kpis_aviso(numero_aviso))
+
+
+def obtener_kpis_aviso(numero_aviso):
+    """
+    KPIs del aviso: caché del proceso -> kpis.json materializado -> cálculo
+    en vivo. Solo se recalcula si cambió la versión de clientes o algún archivo
+    de entrada (clasificación, SHP, distritos); el recálculo vuelve a escribir
+    kpis.json para los demás workers.
+    
+    El resultado es compartido: los llamadores no deben modificarlo.
+    
+    Raises:
+        psycopg2.Error: Si falla la lectura del snapshot de clientes
+    """
+    firma = _firma_kpis(numero_aviso)
+    en_cache = _kpis_en_cache(numero_aviso, firma)
+    if en_cache is not None:
+        return en_cache
+    
+    # Un aviso lento no bloquea los KPIs de los demás
+    with _lock_kpis_aviso(numero_aviso):
+        en_cache = _kpis_en_cache(numero_aviso, firma)
+        if en_cache is not None:
+            return en_cache
+        
+        resultado = leer_kpis_materializados(numero_aviso, firma)
+        if resultado is None:
+            resultado = calcular_kpis_aviso(numero_aviso)
+            try:
+                escribir_kpis_materializados(numero_aviso, firma, resultado)
+            except OSError as e:
+                logger.warning("No se pudo escribir kpis.json del aviso %d: %s", numero_aviso, e)
+            logger.info("KPIs de aviso %d calculados (fuente: %s, día %s)", numero_aviso, resultado['fuente'], resultado['dia'])
+        
+        _guardar_kpis_en_cache(numero_aviso, firma, resultado)
+        return resultado
+
+
+def _lock_kpis_aviso(numero_aviso):
+    """RLock del aviso (cálculo, kpis.json y CSV de clasificación)"""
+    with _kpis_lock:
+        return _kpis_locks_aviso.setdefault(numero_aviso, threading.RLock())
+
+
+def _kpis_en_cache(numero_aviso, firma):
+    """KPIs del LRU si la firma coincide, si no None"""
+    with _kpis_lock:
+        en_cache = _kpis_cache.get(numero_aviso)
+        if en_cache and en_cache[0] == firma:
+            _kpis_cache.move_to_end(numero_aviso)
+            return en_cache[1]
+    return None
+
+
+def _guardar_kpis_en_cache(numero_aviso, firma, kpis):
+    with _kpis_lock:
+        _kpis_cache[numero_aviso] = (firma, kpis)
+        _kpis_cache.move_to_end(numero_aviso)
+        while len(_kpis_cache) > MAX_AVISOS_KPI_CACHE:
+            _kpis_cache.popitem(last=False)
+
+
+def _lock_clusters_aviso(numero_aviso):
+    """Lock del aviso para construir su índice de clusters"""
+    with _clusters_lock:
+        return _clusters_locks_aviso.setdefault(numero_aviso, threading.Lock())
+
+
+def _clusters_en_cache(numero_aviso, firma):
+    """Índice del LRU si la firma coincide, si no None"""
+    with _clusters_lock:
+        en_cache = _clusters_cache.get(numero_aviso)
+        if en_cache and en_cache[0] == firma:
+            _clusters_cache.move_to_end(numero_aviso)
+            return en_cache[1]
+    return None
+
+
+def obtener_indice_clusters(numero_aviso):
+    """
+    Clusters jerárquicos de los clientes clasificados en zonas afectadas
+    (mismo universo que clientes-geojson), precalculados para todos los zooms
+    
+    Raises:
+        psycopg2.Error: Si falla la lectura del snapshot de clientes
+    """
+    firma = _firma_kpis(numero_aviso)
+    indice = _clusters_en_cache(numero_aviso, firma)
+    if indice is not None:
+        return indice
+    
+    with _lock_clusters_aviso(numero_aviso):
+        # Otro hilo pudo construirlo mientras se esperaba el lock
+        indice = _clusters_en_cache(numero_aviso, firma)
+        if indice is not None:
+            return indice
+        
+        frame, _, _, _ = construir_frame_aviso(numero_aviso)
+        puntos = frame.loc[frame['en_zona'] & frame['nivel'].notna(),
+                           ['id', 'longitud', 'latitud', 'nivel', 'hectareas', 'monto_asegurado']]
+        indice = construir_indice_clusters(puntos, COLORES_KPI)
+        logger.info("Clusters de aviso %d precalculados (%d clientes)", numero_aviso, len(indice['puntos']))
+        
+        with _clusters_lock:
+            _clusters_cache[numero_aviso] = (firma, indice)
+            _clusters_cache.move_to_end(numero_aviso)
+            while len(_clusters_cache) > MAX_AVISOS_KPI_CACHE:
+                _clusters_cache.popitem(last=False)
+        return indice
+
+
+# ============================================================================
+# AVISOS CONCURRENTES
+# Las capas del día crítico de todos los avisos vigentes se unen en una sola
+# capa (un solo índice espacial) y cada cliente se cruza una vez contra ella:
+# el costo crece con polígonos + clientes, no con avisos x clientes
+# ============================================================================
+
+# Días que un aviso sigue contando como vigente tras su fecha_fin
+DIAS_GRACIA_AVISO = int(os.getenv('DIAS_GRACIA_AVISO', '2'))
+# Combinaciones de avisos (clientes en más de uno) que se reportan
+MAX_COMBINACIONES_CONCURRENTES = 10
+
+# _concurrentes_lock protege el LRU y los locks; el cálculo va por combinación
+_concurrentes_lock = threading.Lock()
+_concurrentes_cache = OrderedDict()  # tupla de avisos -> (firma, analisis)
+_concurrentes_locks = {}  # tupla de avisos -> Lock
+
+
+def _firma_concurrentes(numeros_aviso):
+    """Versión de clientes + mtimes de los SHP diarios de cada aviso"""
+    archivos = [
+        TEMP_DIR / f'aviso_{numero}' / f'dia{dia}' / 'view_aviso.shp'
+        for numero in numeros_aviso for dia in [1, 2, 3]
+    ]
+    mtimes = [[f'{p.parent.parent.name}/{p.parent.name}', p.stat().st_mtime_ns] for p in archivos if p.exists()]
+    return {'clientes': obtener_version_snapshot(), 'archivos': mtimes}
+
+
+def capa_riesgo_combinada(numeros_aviso):
+    """
+    Une los polígonos Rojo/Naranja/Amarillo del día crítico de cada aviso
+    
+    Returns:
+        Tupla (GeoDataFrame [nivel, numero_aviso, geometry] en EPSG:4326 o None
+        si ningún aviso tiene capa, lista de {numero_aviso, dia, poligonos})
+    """
+    capas = []
+    incluidos = []
+    for numero in numeros_aviso:
+        dia, _ = encontrar_dia_critico(numero)
+        if dia is None:
+            continue
+        
+        shp_alerta = gpd.read_file(TEMP_DIR / f'aviso_{numero}' / f'dia{dia}' / 'view_aviso.shp')
+        columna_color = detectar_columna_nivel(shp_alerta)
+        if not columna_color:
+            logger.warning("SHP del aviso %d sin columna de nivel", numero)
+            continue
+        
+        capa = gpd.GeoDataFrame(
+            {'nivel': shp_alerta[columna_color].map(MAPEO_NIVEL_COLOR), 'numero_aviso': numero},
+            geometry=shp_alerta.geometry, crs=shp_alerta.crs
+        )
+        capa = capa[capa['nivel'].isin(NIVELES_AFECTACION)]
+        if capa.crs is not None and capa.crs != 'EPSG:4326':
+            capa = capa.to_crs('EPSG:4326')
+        
+        capas.append(capa)
+        incluidos.append({'numero_aviso': numero, 'dia': dia, 'poligonos': len(capa)})
+    
+    if not capas:
+        return None, incluidos
+    combinada = gpd.GeoDataFrame(pd.concat(capas, ignore_index=True), crs='EPSG:4326')
+    return combinada, incluidos
+
+
+def clasificar_clientes_concurrentes(activos, capa):
+    """
+    Cruza cada cliente una sola vez contra la capa combinada, por lotes
+    
+    Returns:
+        DataFrame [id, numero_aviso, nivel]: nivel más severo de cada cliente
+        dentro de cada aviso (solo clientes que caen en alguna zona)
+    """
+    con_coords = activos.dropna(subset=['latitud', 'longitud'])
+    partes = []
+    for inicio in range(0, len(con_coords), TAMANO_LOTE_CLIENTES):
+        bloque = con_coords.iloc[inicio:inicio + TAMANO_LOTE_CLIENTES]
+        lote = {col: bloque[col].to_numpy() for col in ['id', 'latitud', 'longitud']}
+        cruce = clasificar_lote(lote, capa, 'nivel')
+        partes.append(cruce.loc[cruce['numero_aviso'].notna(), ['id', 'numero_aviso', 'nivel']])
+    
+    if not partes:
+        return pd.DataFrame(columns=['id', 'numero_aviso', 'nivel'])
+    
+    cruce = pd.concat(partes, ignore_index=True)
+    cruce['numero_aviso'] = cruce['numero_aviso'].astype('int64')
+    cruce['_severidad'] = cruce['nivel'].map(SEVERIDAD_NIVEL)
+    cruce = cruce.sort_values(['id', 'numero_aviso', '_severidad'], kind='stable')
+    return cruce.drop_duplicates(['id', 'numero_aviso']).drop(columns='_severidad').reset_index(drop=True)
+
+
+def resumir_concurrentes(frame, incluidos):
+    """Totales por peor nivel, por aviso y por combinación de avisos"""
+    por_nivel = frame.groupby('nivel').agg(
+        clientes=('id', 'size'), hectareas=('hectareas', 'sum'), monto_asegurado=('monto_asegurado', 'sum')
+    )
+    multiples = frame[frame['n_avisos'] > 1]
+    
+    pertenencia = frame[['avisos', 'n_avisos']].explode('avisos')
+    conteo = (pertenencia.assign(compartido=pertenencia['n_avisos'] > 1)
+                         .groupby('avisos')['compartido'].agg(['size', 'sum'])
+                         .reindex([a['numero_aviso'] for a in incluidos], fill_value=0))
+    por_aviso = {
+        str(numero): {'clientes': int(fila.size), 'compartidos': int(fila.sum)}
+        for numero, fila in zip(conteo.index, conteo.itertuples(index=False))
+    }
+    
+    combinaciones = (multiples.assign(_clave=multiples['avisos'].map(tuple))
+                              .groupby('_clave')
+                              .agg(clientes=('id', 'size'), hectareas=('hectareas', 'sum'))
+                              .sort_values('clientes', ascending=False, kind='stable')
+                              .head(MAX_COMBINACIONES_CONCURRENTES))
+    
+    return {
+        'total_clientes': len(frame),
+        'clientes_multiples': len(multiples),
+        'hectareas_multiples': round(float(multiples['hectareas'].sum()), 2),
+        'por_nivel': {
+            color: {
+                'clientes': int(por_nivel.at[color, 'clientes']),
+                'hectareas': round(float(por_nivel.at[color, 'hectareas']), 2),
+                'monto_asegurado': round(float(por_nivel.at[color, 'monto_asegurado']), 2)
+            }
+            for color in NIVELES_AFECTACION if color in por_nivel.index
+        },
+        'por_aviso': por_aviso,
+        'combinaciones': [
+            {'avisos': list(clave), 'clientes': int(fila.clientes), 'hectareas': round(float(fila.hectareas), 2)}
+            for clave, fila in zip(combinaciones.index, combinaciones.itertuples(index=False))
+        ]
+    }
+
+
+def _lock_concurrentes(numeros):
+    """
+    Lock de una combinación de avisos; los de combinaciones fuera del LRU y
+    libres se descartan para que el dict no crezca con cada combinación pedida
+    """
+    with _concurrentes_lock:
+        if len(_concurrentes_locks) > 4 * MAX_AVISOS_KPI_CACHE:
+            for clave, lock in list(_concurrentes_locks.items()):
+                if clave not in _concurrentes_cache and not lock.locked():
+                    del _concurrentes_locks[clave]
+        return _concurrentes_locks.setdefault(numeros, threading.Lock())
+
+
+def _concurrentes_en_cache(numeros, firma):
+    """Análisis del LRU si la firma coincide, si no None"""
+    with _concurrentes_lock:
+        en_cache = _concurrentes_cache.get(numeros)
+        if en_cache and en_cache[0] == firma:
+            _concurrentes_cache.move_to_end(numeros)
+            return en_cache[1]
+    return None
+
+
+def _calcular_concurrentes(numeros):
+    """Cruce de clientes activos con la capa combinada (sin caché ni locks)"""
+    capa, incluidos = capa_riesgo_combinada(numeros)
+    activos = obtener_clientes_activos()
+    if capa is None or capa.empty:
+        cruce = pd.DataFrame(columns=['id', 'numero_aviso', 'nivel'])
+    else:
+        cruce = clasificar_clientes_concurrentes(activos, capa)
+    
+    # cruce viene ordenado por id: cada cliente es un tramo contiguo
+    ids, inicios, conteos = np.unique(cruce['id'].to_numpy(), return_index=True, return_counts=True)
+    avisos, niveles, severidad = [], [], []
+    if len(ids):
+        avisos = [a.tolist() for a in np.split(cruce['numero_aviso'].to_numpy(), inicios[1:])]
+        niveles = np.split(cruce['nivel'].to_numpy(dtype=object), inicios[1:])
+        severidad = np.minimum.reduceat(cruce['nivel'].map(SEVERIDAD_NIVEL).to_numpy(), inicios)
+    resumen_clientes = pd.DataFrame({
+        'id': ids,
+        'nivel': pd.Series(severidad, dtype='int64').map({v: k for k, v in SEVERIDAD_NIVEL.items()}),
+        'n_avisos': conteos,
+        'avisos': avisos,
+        'niveles_por_aviso': [dict(zip(map(str, a), n)) for a, n in zip(avisos, niveles)]
+    })
+    
+    datos = activos[['id', 'nombre', 'apellido', 'dni_ruc', 'departamento', 'provincia', 'distrito',
+                     'latitud', 'longitud', 'hectareas', 'monto_asegurado']]
+    frame = resumen_clientes.merge(datos, on='id', how='left')
+    frame[['hectareas', 'monto_asegurado']] = frame[['hectareas', 'monto_asegurado']].fillna(0.0)
+    
+    analisis = {
+        'avisos': incluidos,
+        'resumen': resumir_concurrentes(frame, incluidos),
+        'clientes': frame.sort_values('id', kind='stable').reset_index(drop=True)
+    }
+    logger.info("Avisos concurrentes %s: %d polígonos, %d clientes en zona (%d en más de un aviso)",
+                list(numeros), 0 if capa is None else len(capa),
+                analisis['resumen']['total_clientes'], analisis['resumen']['clientes_multiples'])
+    return analisis
+
+
+def analizar_avisos_concurrentes(numeros_aviso):
+    """
+    Peor nivel y lista de avisos de cada cliente activo frente a varios avisos
+    
+    Args:
+        numeros_aviso: Avisos a combinar (se ordenan y deduplican)
+    
+    Returns:
+        Dict {'avisos': [...], 'resumen': {...}, 'clientes': DataFrame ordenado
+        por id con nivel (peor), n_avisos, avisos y niveles_por_aviso}
+        
+    Raises:
+        psycopg2.Error: Si falla la lectura del snapshot de clientes
+    """
+    numeros = tuple(sorted(set(numeros_aviso)))
+    firma = _firma_concurrentes(numeros)
+    analisis = _concurrentes_en_cache(numeros, firma)
+    if analisis is not None:
+        return analisis
+    
+    with _lock_concurrentes(numeros):
+        # Otro hilo pudo calcularlo mientras se esperaba el lock
+        analisis = _concurrentes_en_cache(numeros, firma)
+        if analisis is not None:
+            return analisis
+        
+        analisis = _calcular_concurrentes(numeros)
+        with _concurrentes_lock:
+            _concurrentes_cache[numeros] = (firma, analisis)
+            _concurrentes_cache.move_to_end(numeros)
+            while len(_concurrentes_cache) > MAX_AVISOS_KPI_CACHE:
+                _concurrentes_cache.popitem(last=False)
+        return analisis
+
+
+def serializar_cliente_concurrente(fila):
+    """Fila de analizar_avisos_concurrentes()['clientes'] -> dict JSON"""
+    return {
+        'id': int(fila['id']),
+        'nombre': f"{fila['nombre'] or ''} {fila['apellido'] or ''}".strip(),
+        'dni_ruc': fila['dni_ruc'],
+        'departamento': fila['departamento'],
+        'provincia': fila['provincia'],
+        'distrito': fila['distrito'],
+        'latitud': None if pd.isna(fila['latitud']) else float(fila['latitud']),
+        'longitud': None if pd.isna(fila['longitud']) else float(fila['longitud']),
+        'hectareas': round(float(fila['hectareas']), 2),
+        'monto_asegurado': round(float(fila['monto_asegurado']), 2),
+        'nivel': fila['nivel'],
+        'n_avisos': int(fila['n_avisos']),
+        'avisos': [int(a) for a in fila['avisos']],
+        'niveles_por_aviso': fila['niveles_por_aviso']
+    }
+
+# ============================================================================
+# ACTUALIZACIÓN INCREMENTAL DE KPIs
+# Los cambios de clientes (feed de snapshot_clientes) se reclasifican solos
+# contra la capa del aviso y se suman/restan a kpis.json, sin recalcular la
+# cartera completa
+# ============================================================================
+
+# Listas de registros de agregar_kpis: (claves de grupo, campo de conteo)
+REGISTROS_KPI = {
+    'entidades': (('entidad_id', 'nombre'), 'agricultores'),
+    'cultivos': (('cultivo_id', 'cultivo_nombre', 'departamento'), 'agricultores'),
+    'ubicaciones': (('departamento_norm', 'provincia_norm'), 'agr_totales'),
+}
+CAMPOS_DERIVADOS_KPI = {'pct_damage'}
+
+
+def _sumar_valores(base, delta, signo):
+    """Suma recursiva de dicts/números (clave ausente = 0, ambos None = None)"""
+    if base is None and delta is None:
+        return None
+    if isinstance(base, dict) or isinstance(delta, dict):
+        base, delta = base or {}, delta or {}
+        return {clave: _sumar_valores(base.get(clave), delta.get(clave), signo) for clave in {**base, **delta}}
+    total = (base or 0) + signo * (delta or 0)
+    return total if isinstance(total, int) else round(total, 2)
+
+
+def _sumar_registros(base, delta, signo, claves):
+    """Suma listas de registros agrupados por `claves` (campos numéricos)"""
+    por_clave = {tuple(r.get(c) for c in claves): dict(r) for r in base}
+    for registro in delta:
+        actual = por_clave.setdefault(tuple(registro.get(c) for c in claves), {c: registro.get(c) for c in claves})
+        for campo, valor in registro.items():
+            if campo in claves or campo in CAMPOS_DERIVADOS_KPI or not isinstance(valor, (int, float)):
+                continue
+            actual[campo] = _sumar_valores(actual.get(campo), valor, signo)
+    return list(por_clave.values())
+
+
+def _podar_arbol(nodos, hijos=('provincias', 'distritos')):
+    """Quita del árbol de agregaciones los nodos que quedaron sin clientes"""
+    podado = {}
+    for nombre, nodo in nodos.items():
+        if nodo.get('total', 0) <= 0:
+            continue
+        nodo = dict(nodo)
+        for hijo in hijos:
+            if hijo in nodo:
+                nodo[hijo] = _podar_arbol(nodo[hijo], hijos)
+        podado[nombre] = nodo
+    return podado
+
+
+def aplicar_deltas_kpis(kpis, mas, menos):
+    """
+    kpis + agregar_kpis(filas nuevas) - agregar_kpis(filas anteriores)
+    
+    Returns:
+        Nuevo dict de KPIs (no modifica `kpis`)
+    """
+    resultado = dict(kpis)
+    for clave in ('totales', 'afectados', 'por_color', 'zonas_por_color', 'cercania', 'agregaciones'):
+        resultado[clave] = _sumar_valores(_sumar_valores(kpis.get(clave), mas.get(clave), 1), menos.get(clave), -1)
+    resultado['agregaciones'] = _podar_arbol(resultado['agregaciones'] or {})
+    
+    for clave, (claves, conteo) in REGISTROS_KPI.items():
+        registros = _sumar_registros(_sumar_registros(kpis.get(clave, []), mas[clave], 1, claves),
+                                     menos[clave], -1, claves)
+        resultado[clave] = [r for r in registros if r.get(conteo, 0) > 0]
+    
+    # Derivados y orden igual que agregar_kpis
+    total_afectados = max(resultado['afectados']['agricultores'], 1)
+    for entidad in resultado['entidades']:
+        entidad['pct_damage'] = round(100 * entidad['agricultores'] / total_afectados, 1)
+    resultado['entidades'].sort(key=lambda r: -r['agricultores'])
+    resultado['cultivos'].sort(key=lambda r: -r['agricultores'])
+    resultado['ubicaciones'].sort(key=lambda r: (r['departamento_norm'] or '', r['provincia_norm'] or ''))
+    return resultado
+
+
+def reclasificar_clientes(clientes, shp_path, columnas):
+    """
+    Clasifica solo `clientes` contra la capa del aviso, con las mismas
+    columnas que el CSV de clasificación (areas.clasificar_clientes_a_csv)
+    """
+    con_coords = clientes.dropna(subset=['latitud', 'longitud'])
+    if con_coords.empty:
+        return pd.DataFrame(columns=columnas)
+    
+    shp_alerta = gpd.read_file(shp_path)
+    columna_color = detectar_columna_nivel(shp_alerta)
+    indices = construir_indices_cercania(shp_alerta, columna_color) if 'nivel_cercano' in columnas else None
+    lote = {
+        'id': con_coords['id'].to_numpy(),
+        'nombre_cliente': (con_coords['nombre'].fillna('') + ' ' + con_coords['apellido'].fillna('')).to_numpy(),
+        'latitud': con_coords['latitud'].to_numpy(),
+        'longitud': con_coords['longitud'].to_numpy(),
+        'hectareas': con_coords['hectareas'].to_numpy()
+    }
+    resultado = clasificar_lote(lote, shp_alerta[[columna_color, 'geometry']], columna_color, indices)
+    return resultado.reindex(columns=columnas)
+
+
+def actualizar_kpis_con_cambios(numero_aviso, cambios):
+    """
+    Lleva kpis.json y el CSV de clasificación del aviso a la versión de
+    clientes de `cambios` (resultado de actualizar_snapshot_incremental)
+    
+    Returns:
+        'delta' si se aplicaron deltas, 'recalculado' si la base no coincidía
+        (o hubo recarga completa) y se recalculó, None si el aviso no tiene
+        kpis.json o CSV de clasificación (se calcula bajo demanda)
+    """
+    with _lock_kpis_aviso(numero_aviso):
+        _, csv_path = buscar_csv_clasificacion(numero_aviso)
+        if csv_path is None:
+            return None
+        # actualizar_kpis.py y los workers son procesos distintos: el RLock
+        # no los serializa, el bloqueo de archivo sí
+        with bloqueo_csv(csv_path):
+            return _aplicar_cambios_aviso(numero_aviso, cambios)
+
+
+def _aplicar_cambios_aviso(numero_aviso, cambios):
+    """Cuerpo de actualizar_kpis_con_cambios (con el lock del aviso y del CSV tomados)"""
+    ruta = _ruta_kpis_json(numero_aviso)
+    dia, csv_path = buscar_csv_clasificacion(numero_aviso)
+    if not ruta.exists() or csv_path is None:
+        return None
+    shp_path = TEMP_DIR / f'aviso_{numero_aviso}' / f'dia{dia}' / 'view_aviso.shp'
+    
+    with open(ruta, 'r', encoding='utf-8') as f:
+        contenido = json.load(f)
+    
+    # Los deltas solo valen sobre KPIs calculados con la versión anterior de clientes
+    firma_base = {**_firma_kpis(numero_aviso), 'clientes': cambios['version_anterior']}
+    if (cambios['completo'] or not shp_path.exists() or contenido.get('formato') != VERSION_FORMATO_KPIS
+            or contenido.get('firma') != firma_base):
+        materializar_kpis_aviso(numero_aviso)
+        invalidar_aviso(numero_aviso)
+        return 'recalculado'
+    
+    anteriores, nuevas = cambios['anteriores'], cambios['nuevas']
+    zonas_afectadas = parse_csv_avisos(numero_aviso)
+    clasificacion = pd.read_csv(csv_path)
+    en_delta = clasificacion['id'].isin(nuevas['id'])
+    reclasificadas = reclasificar_clientes(nuevas, shp_path, clasificacion.columns)
+    
+    menos = agregar_kpis(construir_frame_clientes(
+        anteriores[anteriores['estado'] == 'activo'], zonas_afectadas, clasificacion[en_delta]))
+    mas = agregar_kpis(construir_frame_clientes(
+        nuevas[nuevas['estado'] == 'activo'], zonas_afectadas, reclasificadas))
+    kpis = aplicar_deltas_kpis(contenido['kpis'], mas, menos)
+    
+    # CSV parcheado (tmp + replace, como clasificar_clientes_a_csv)
+    tmp_path = csv_path.with_name(f'{csv_path.name}.{os.getpid()}.tmp')
+    try:
+        (pd.concat([clasificacion[~en_delta], reclasificadas], ignore_index=True)
+           .sort_values('id', kind='stable')
+           .to_csv(tmp_path, index=False, encoding='utf-8'))
+        os.replace(tmp_path, csv_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    
+    firma = _firma_kpis(numero_aviso)
+    _guardar_kpis_en_cache(numero_aviso, firma, kpis)
+    escribir_kpis_materializados(numero_aviso, firma, kpis)
+    invalidar_aviso(numero_aviso)
+    logger.info("KPIs de aviso %d actualizados con %d clientes cambiados", numero_aviso, len(nuevas))
+    return 'delta'
+
 
-        # Obtener clientes
-        clientes_data = get_clientes_afectados(numero_aviso)
+def aplicar_cambios_clientes(numeros_aviso):
+    """
+    Un ciclo del feed de cambios: actualiza el snapshot y los KPIs de los avisos
+    
+    Returns:
+        Dict {numero_aviso: resultado de actualizar_kpis_con_cambios}
+        (vacío si no hubo cambios)
+        
+    Raises:
+        psycopg2.Error: Si falla la lectura de cambios
+    """
+    cambios = actualizar_snapshot_incremental()
+    if not cambios['completo'] and cambios['nuevas'].empty:
+        return {}
+    
+    resultados = {}
+    for numero in numeros_aviso:
+        try:
+            resultados[numero] = actualizar_kpis_con_cambios(numero, cambios)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("No se pudo actualizar KPIs del aviso %d: %s", numero, e)
+            resultados[numero] = 'error'
+    return resultados
 
-        stats = {
-            'color': color,
-            'critico': {
-                'nivel': 'CRÍTICO' if color == 'rojo' else '',
-                'count': clientes_data.get('total_agricultores', 0) if color == 'rojo' else 0
-            },
-            'alto_riesgo': {
-                'nivel': 'ALTO RIESGO' if color == 'naranja' else '',
-                'count': clientes_data.get('total_agricultores', 0) if color == 'naranja' else 0
-            },
-            'agricultores_total': clientes_data.get('total_agricultores', 0),
-            'poliza_total': clientes_data.get('total_monto_asegurado', 0),
-            'hectareas_total': clientes_data.get('total_hectareas', 0)
-        }
 
-        return stats
+# ============================================================================
+# PROYECCIONES DEL MOTOR (cuerpo, código) - compartidas por rutas y bundle
+# ============================================================================
 
-    except psycopg2.Error as e:
-        logger.error("Error calculando estadísticas: %s", str(e))
-        return {}
+def payload_kpis(numero):
+    """Cuerpo de /kpis"""
+    kpis = obtener_kpis_aviso(numero)
+    totales = kpis['totales']
+    afectados = kpis['afectados']
+    
+    porcentaje_afectacion = (
+        (afectados['agricultores'] / totales['agricultores'] * 100)
+        if totales['agricultores'] > 0 else 0
+    )
+    
+    return {
+        'agricultores_totales': totales['agricultores'],
+        'agricultores_afectados': afectados['agricultores'],
+        'porcentaje_afectacion': round(porcentaje_afectacion, 1),
+        'hectareas_totales': totales['hectareas'],
+        'hectareas_afectadas': afectados['hectareas'],
+        'poliza_total': totales['poliza'],
+        'poliza_afectados': afectados['poliza'],
+        'zonas_por_color': kpis['por_color'],
+        'bandas_cercania_km': kpis['bandas_cercania_km'],
+        'cercania': kpis['cercania']
+    }, 200
+
+
+def payload_kpis_entidades(numero):
+    """Cuerpo de /kpis-entidades"""
+    kpis = obtener_kpis_aviso(numero)
+    if kpis['fuente'] is None:
+        return {'error': f'No hay CSV para aviso {numero}'}, 404
+    return {'numero_aviso': numero, 'entidades': kpis['entidades']}, 200
+
+
+def payload_kpis_cultivos(numero):
+    """Cuerpo de /kpis-cultivos (TOP 5)"""
+    kpis = obtener_kpis_aviso(numero)
+    if kpis['fuente'] is None:
+        return {'error': f'No hay CSV para aviso {numero}'}, 404
+    return {'numero_aviso': numero, 'cultivos': kpis['cultivos'][:5]}, 200
+
+
+def payload_agregaciones(numero):
+    """Cuerpo de /agregaciones"""
+    return {'agregaciones': obtener_kpis_aviso(numero)['agregaciones']}, 200
+
+
+PAYLOADS_KPI = {
+    'agregaciones': payload_agregaciones,
+    'kpis': payload_kpis,
+    'entidades': payload_kpis_entidades,
+    'cultivos': payload_kpis_cultivos,
+}
+PARTES_BUNDLE = ['resumen', 'estadisticas', 'agregaciones', 'kpis', 'entidades', 'cultivos', 'shp']
 
 
 # ============================================================================
@@ -451,94 +1521,156 @@ def get_estadisticas_aviso(numero_aviso):
 # ============================================================================
 
 @decisiones_bp.route('/api/avisos/<int:numero>/clientes-geojson', methods=['GET'])
+@respuesta_cacheable
 def api_clientes_geojson(numero):
     """
     Retorna clientes como GeoJSON points para renderizar en mapa
+    (en streaming por lotes, gzip al vuelo si el cliente lo acepta)
+    
+    Query params (opcionales):
+        ?after_id=&limit= - paginación keyset (responde siguiente_after_id)
+        ?format=ndjson    - streaming, un Feature por línea
     """
     try:
-        clientes_data = get_clientes_afectados(numero)
-        agricultores = clientes_data.get('agricultores', [])
+        after_id, limit = parametros_paginacion()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        zonas_afectadas = parse_csv_avisos(numero)
+        if not zonas_afectadas:
+            if pide_ndjson():
+                return Response('', mimetype='application/x-ndjson')
+            return jsonify({'type': 'FeatureCollection', 'features': [], 'total': 0})
         
-        features = []
-        for agr in agricultores:
-            if agr.get('latitud') and agr.get('longitud'):
-                feature = {
-                    'type': 'Feature',
-                    'geometry': {
-                        'type': 'Point',
-                        'coordinates': [float(agr['longitud']), float(agr['latitud'])]
-                    },
-                    'properties': {
-                        'nombre': f"{agr.get('nombre', '')} {agr.get('apellido', '')}",
-                        'dni_ruc': agr.get('dni_ruc', ''),
-                        'cultivo_id': agr.get('cultivo_id'),
-                        'hectareas': agr.get('hectareas'),
-                        'monto_asegurado': agr.get('monto_asegurado'),
-                        'distrito': agr.get('distrito', ''),
-                        'provincia': agr.get('provincia', ''),
-                        'departamento': agr.get('departamento', '')
-                    }
-                }
-                features.append(feature)
+        query, params = query_clientes_afectados(
+            zonas_afectadas, columnas=COLUMNAS_GEOJSON_CLIENTES, con_coordenadas=True,
+            after_id=after_id, limit=limit
+        )
         
-        return jsonify({
-            'type': 'FeatureCollection',
-            'features': features,
-            'total': len(features)
-        })
+        if pide_ndjson():
+            return respuesta_ndjson(query, params, feature_cliente)
+        
+        # FeatureCollection en streaming: la primera fila se lee aquí para que un
+        # error de BD responda 500 y no un JSON cortado
+        filas = iterar_filas(query, params, tamano_lote=TAMANO_LOTE_STREAM)
+        primera = next(filas, None)
+        if primera is not None:
+            filas = itertools.chain([primera], filas)
+        estado = {'total': 0, 'ultimo_id': None}
+        
+        def cola():
+            extra = {'total': estado['total']}
+            if limit:
+                extra['siguiente_after_id'] = estado['ultimo_id'] if estado['total'] == limit else None
+            return extra
+        
+        return respuesta_streaming(generar_coleccion(lotes_features_clientes(filas, estado), cola))
     
     except Exception as e:
         logger.error("Error en clientes-geojson: %s", str(e))
         return jsonify({'error': str(e)}), 500
 
 
-@decisiones_bp.route('/api/avisos/<int:numero>/agregaciones', methods=['GET'])
-def api_agregaciones(numero):
+@decisiones_bp.route('/api/avisos/<int:numero>/clientes-clusters', methods=['GET'])
+@respuesta_cacheable
+def api_clientes_clusters(numero):
     """
-    Retorna agregaciones de clientes por depto/provincia/distrito
+    Clientes agrupados para el mapa según zoom y área visible
+    
+    Query params:
+        ?zoom=     - zoom de Leaflet (se trunca a entero y se acota a 0..ZOOM_MAXIMO,
+                     por defecto 0)
+        ?bbox=     - oeste,sur,este,norte (por defecto todo el mundo)
+    
+    Hasta ZOOM_MAX_CLUSTERS responde clusters con total y, por color,
+    clientes/hectareas/monto; por encima, puntos sueltos.
+    """
+    try:
+        zoom = max(0, min(int(float(request.args.get('zoom', 0))), ZOOM_MAXIMO))
+        bbox = parsear_bbox(request.args.get('bbox'))
+    except (ValueError, OverflowError) as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+    
+    try:
+        return jsonify(consultar_clusters(obtener_indice_clusters(numero), zoom, bbox))
+    except Exception as e:
+        logger.error("Error en clientes-clusters: %s", str(e))
+        return jsonify({'error': str(e)}), 500
+
+
+@decisiones_bp.route('/api/avisos/concurrentes', methods=['GET'])
+def api_avisos_concurrentes():
+    """
+    Clientes frente a varios avisos a la vez: peor nivel y avisos de cada uno
+    
+    Query params (opcionales):
+        ?avisos=447,448 - avisos a combinar (default: vigentes, DIAS_GRACIA_AVISO)
+        ?nivel=Rojo,Naranja - filtrar por peor nivel
+        ?min_avisos=2 - solo clientes en al menos N avisos
+        ?summary=1 - solo totales (sin lista de clientes)
+        ?after_id=&limit= - paginación keyset (responde siguiente_after_id)
     """
     try:
-        clientes_data = get_clientes_afectados(numero)
-        agricultores = clientes_data.get('agricultores', [])
+        after_id, limit = parametros_paginacion()
+        min_avisos = request.args.get('min_avisos', 1, type=int)
+        niveles = [n.strip().capitalize() for n in request.args.get('nivel', '').split(',') if n.strip()]
+        if 'avisos' in request.args:
+            numeros = [int(n) for n in request.args['avisos'].split(',') if n.strip()]
+        elif listar_avisos_vigentes is not None:
+            numeros = listar_avisos_vigentes(DIAS_GRACIA_AVISO)
+        else:
+            numeros = []
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+    
+    desconocidos = [n for n in niveles if n not in NIVELES_AFECTACION]
+    if desconocidos:
+        return jsonify({'error': f'Niveles desconocidos: {desconocidos}', 'disponibles': NIVELES_AFECTACION}), 400
+    if not numeros:
+        return jsonify({'error': 'No hay avisos para combinar'}), 404
+    
+    try:
+        analisis = analizar_avisos_concurrentes(numeros)
+        response = {
+            'avisos': analisis['avisos'],
+            'resumen': analisis['resumen']
+        }
         
-        deptos = {}
-        for agr in agricultores:
-            depto = agr.get('departamento', 'Sin datos').upper()
-            if depto not in deptos:
-                deptos[depto] = {
-                    'total': 0,
-                    'hectareas': 0,
-                    'monto': 0,
-                    'provincias': {}
-                }
-            deptos[depto]['total'] += 1
-            deptos[depto]['hectareas'] += float(agr.get('hectareas', 0))
-            deptos[depto]['monto'] += float(agr.get('monto_asegurado', 0))
-            
-            provincia = agr.get('provincia', 'Sin datos').upper()
-            if provincia not in deptos[depto]['provincias']:
-                deptos[depto]['provincias'][provincia] = {
-                    'total': 0,
-                    'hectareas': 0,
-                    'monto': 0,
-                    'distritos': {}
-                }
-            deptos[depto]['provincias'][provincia]['total'] += 1
-            deptos[depto]['provincias'][provincia]['hectareas'] += float(agr.get('hectareas', 0))
-            deptos[depto]['provincias'][provincia]['monto'] += float(agr.get('monto_asegurado', 0))
+        if request.args.get('summary', '').lower() not in ('1', 'true', 'si'):
+            clientes = analisis['clientes']
+            mascara = clientes['n_avisos'] >= min_avisos
+            if niveles:
+                mascara &= clientes['nivel'].isin(niveles)
+            seleccion = clientes[mascara]
+            if after_id is not None:
+                seleccion = seleccion[seleccion['id'] > after_id]
+            pagina = seleccion.head(limit) if limit else seleccion
             
-            distrito = agr.get('distrito', 'Sin datos').upper()
-            if distrito not in deptos[depto]['provincias'][provincia]['distritos']:
-                deptos[depto]['provincias'][provincia]['distritos'][distrito] = {
-                    'total': 0,
-                    'hectareas': 0,
-                    'monto': 0
-                }
-            deptos[depto]['provincias'][provincia]['distritos'][distrito]['total'] += 1
-            deptos[depto]['provincias'][provincia]['distritos'][distrito]['hectareas'] += float(agr.get('hectareas', 0))
-            deptos[depto]['provincias'][provincia]['distritos'][distrito]['monto'] += float(agr.get('monto_asegurado', 0))
+            response['total'] = int(mascara.sum())
+            response['clientes'] = [serializar_cliente_concurrente(fila) for fila in pagina.to_dict('records')]
+            if limit:
+                response['siguiente_after_id'] = int(pagina['id'].iloc[-1]) if len(pagina) == limit else None
         
-        return jsonify({'agregaciones': deptos})
+        return jsonify(response)
+        
+    except Exception as e:
+        logger.error("Error en avisos concurrentes: %s", str(e))
+        return jsonify({'error': str(e)}), 500
+
+@decisiones_bp.route('/api/avisos/<int:numero>/agregaciones', methods=['GET'])
+@respuesta_cacheable
+def api_agregaciones(numero):
+    """
+    Retorna agregaciones de clientes por depto/provincia/distrito
+
+    Cuenta clientes con estado 'activo' en la zona afectada (frame de KPIs
+    del aviso: distritos afectados, o el departamento si el cliente no tiene
+    distrito asignado).
+    """
+    try:
+        cuerpo, codigo = payload_agregaciones(numero)
+        return jsonify(cuerpo), codigo
     
     except Exception as e:
         logger.error("Error en agregaciones: %s", str(e))
@@ -546,6 +1678,7 @@ def api_agregaciones(numero):
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/resumen-zonas', methods=['GET'])
+@respuesta_cacheable
 def api_resumen_zonas(numero):
     """
     Endpoint: Resumen por ZONAS de color (Roja/Naranja/Amarilla)
@@ -554,7 +1687,7 @@ def api_resumen_zonas(numero):
     Returns:
         {
             'numero_aviso': numero,
-            'roja': {
+            'rojo': {
                 'agr_totales': 100,
                 'agr_afectados': 45,
                 'ha_totales': 500.0,
@@ -563,121 +1696,27 @@ def api_resumen_zonas(numero):
                 'monto_afectado': 1500000.00
             },
             'naranja': {...},
-            'amarilla': {...}
+            'amarillo': {...}
         }
     """
     try:
-        # Obtener spatial join: cliente -> color
-        spatial_data = get_clientes_por_color(numero)
-        mapa_cliente_color = spatial_data.get('mapa_cliente_color', {})
-        
-        # Obtener TODOS los clientes
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Conexión BD fallida'}), 500
-        
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Query: TODOS los clientes con sus datos
-        cursor.execute("""
-            SELECT id, hectareas, monto_asegurado
-            FROM clientes
-            WHERE estado = 'activo'
-        """)
-        todos_clientes = cursor.fetchall()
-        
-        # Query: SOLO clientes afectados (en zonas del aviso)
-        zonas_afectadas = parse_csv_avisos(numero)
-        if not zonas_afectadas:
-            cursor.close()
-            conn.close()
+        kpis = obtener_kpis_aviso(numero)
+        if not kpis['zonas_afectadas']:
             return jsonify({'error': 'No hay zonas afectadas para este aviso'}), 404
         
-        zonas_normalizadas = set()
-        for zona in zonas_afectadas:
-            zonas_normalizadas.add((
-                zona['departamento'].upper().strip(),
-                zona['provincia'].upper().strip(),
-                zona['distrito'].upper().strip()
-            ))
-        
-        deptos_unicos = list(set([zona[0] for zona in zonas_normalizadas]))
-        
-        # Query: TODOS los clientes
-        cursor.execute("""
-            SELECT id, hectareas, monto_asegurado
-            FROM clientes
-            WHERE estado = 'activo'
-        """)
-        todos_clientes = [dict(row) for row in cursor.fetchall()]
-        
-        # Query: SOLO clientes afectados (en deptos del aviso)
-        if deptos_unicos:
-            placeholders = ','.join(['%s'] * len(deptos_unicos))
-            query = f"""
-                SELECT id, hectareas, monto_asegurado
-                FROM clientes
-                WHERE estado = 'activo' AND UPPER(TRIM(departamento)) IN ({placeholders})
-            """
-            cursor.execute(query, deptos_unicos)
-        else:
-            cursor.execute("SELECT id, hectareas, monto_asegurado FROM clientes WHERE 1=0")
-        
-        clientes_afectados = [dict(row) for row in cursor.fetchall()]
-        
-        # COPIAR DATOS ANTES DE CERRAR CONEXIÓN (importante con RealDictRow)
-        todos_clientes_copy = [dict(row) for row in todos_clientes]
-        clientes_afectados_copy = [dict(row) for row in clientes_afectados]
-        
-        cursor.close()
-        conn.close()
-        
-        # Usar las copias
-        todos_clientes = todos_clientes_copy
-        clientes_afectados = clientes_afectados_copy
-        
-        # Procesar datos
-        resultado = {
-            'numero_aviso': numero,
-            'rojo': {'agr_totales': 0, 'agr_afectados': 0, 'ha_totales': 0, 'ha_afectadas': 0, 'monto_total': 0, 'monto_afectado': 0},
-            'naranja': {'agr_totales': 0, 'agr_afectados': 0, 'ha_totales': 0, 'ha_afectadas': 0, 'monto_total': 0, 'monto_afectado': 0},
-            'amarillo': {'agr_totales': 0, 'agr_afectados': 0, 'ha_totales': 0, 'ha_afectadas': 0, 'monto_total': 0, 'monto_afectado': 0}
-        }
-        
-        # Obtener IDs de clientes AFECTADOS (que están en deptos del aviso)
-        clientes_afectados_ids = set([c['id'] for c in clientes_afectados])
-        
-        # Contar TODOS los clientes por color
-        # Cruzar con spatial join para asignar color
-        for cliente in todos_clientes:
-            cliente_id = cliente['id']
-            ha = float(cliente['hectareas'] or 0)
-            monto = float(cliente['monto_asegurado'] or 0)
-            
-            # Asignar a zona según spatial join (qué cliente está en qué polígono SHP)
-            color = mapa_cliente_color.get(cliente_id, 'sin_zona')
-            logger.info("DEBUG - cliente_id: %s (type: %s), color: %s (type: %s)", 
-                       cliente_id, type(cliente_id), color, type(color))
-            
-            if color in resultado:
-                resultado[color]['agr_totales'] += 1
-                resultado[color]['ha_totales'] += ha
-                resultado[color]['monto_total'] += monto
-                
-                # Si además está en los afectados (por depto), contar en afectados
-                if cliente_id in clientes_afectados_ids:
-                    resultado[color]['agr_afectados'] += 1
-                    resultado[color]['ha_afectadas'] += ha
-                    resultado[color]['monto_afectado'] += monto
-        
-        # Redondear valores
-        for color in resultado:
-            resultado[color]['ha_totales'] = round(resultado[color]['ha_totales'], 2)
-            resultado[color]['ha_afectadas'] = round(resultado[color]['ha_afectadas'], 2)
-            resultado[color]['monto_total'] = round(resultado[color]['monto_total'], 2)
-            resultado[color]['monto_afectado'] = round(resultado[color]['monto_afectado'], 2)
+        resultado = {'numero_aviso': numero}
+        for color in NIVELES_AFECTACION:
+            total = kpis['por_color'][color]
+            afectado = kpis['zonas_por_color'][color]
+            resultado[color.lower()] = {
+                'agr_totales': total['agricultores'],
+                'agr_afectados': afectado['agricultores'],
+                'ha_totales': total['hectareas'],
+                'ha_afectadas': afectado['hectareas'],
+                'monto_total': total['poliza'],
+                'monto_afectado': afectado['poliza']
+            }
         
-        logger.info("Resumen zonas para aviso %d calculado", numero)
         return jsonify(resultado)
     
     except Exception as e:
@@ -686,6 +1725,7 @@ def api_resumen_zonas(numero):
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/resumen-entidades', methods=['GET'])
+@respuesta_cacheable
 def api_resumen_entidades(numero):
     """
     Endpoint: Resumen por ENTIDADES (Depto/Provincia)
@@ -708,97 +1748,24 @@ def api_resumen_entidades(numero):
         }
     """
     try:
-        # Obtener TODOS los clientes y AFECTADOS
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Conexión BD fallida'}), 500
-        
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Query: TODOS
-        cursor.execute("""
-            SELECT UPPER(TRIM(departamento)) as departamento, UPPER(TRIM(COALESCE(provincia, 'SIN PROVINCIA'))) as provincia, 
-                   COUNT(*) as agr_total, 
-                   SUM(COALESCE(hectareas, 0)) as ha_total,
-                   SUM(COALESCE(monto_asegurado, 0)) as monto_total
-            FROM clientes
-            WHERE estado = 'activo'
-            GROUP BY UPPER(TRIM(departamento)), UPPER(TRIM(COALESCE(provincia, 'SIN PROVINCIA')))
-            ORDER BY departamento, provincia
-        """)
-        todos_depto = cursor.fetchall()
-        
-        # Query: AFECTADOS (por zonas del aviso)
-        zonas_afectadas = parse_csv_avisos(numero)
-        deptos_unicos = list(set([zona['departamento'].upper().strip() for zona in zonas_afectadas]))
+        kpis = obtener_kpis_aviso(numero)
         
-        if deptos_unicos:
-            placeholders = ','.join(['%s'] * len(deptos_unicos))
-            query = f"""
-                SELECT UPPER(TRIM(departamento)) as departamento, UPPER(TRIM(COALESCE(provincia, 'SIN PROVINCIA'))) as provincia,
-                       COUNT(*) as agr_afectados, 
-                       SUM(COALESCE(hectareas, 0)) as ha_afectadas,
-                       SUM(COALESCE(monto_asegurado, 0)) as monto_afectado
-                FROM clientes
-                WHERE estado = 'activo' AND UPPER(TRIM(departamento)) IN ({placeholders})
-                GROUP BY UPPER(TRIM(departamento)), UPPER(TRIM(COALESCE(provincia, 'SIN PROVINCIA')))
-                ORDER BY departamento, provincia
-            """
-            cursor.execute(query, deptos_unicos)
-        else:
-            cursor.execute("SELECT NULL LIMIT 0")
-        
-        afectados_depto = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        # Construir resultado: MERGE todos + afectados
-        resultado_deptos = {}
-        
-        # Agregar TODOS
-        for row in todos_depto:
-            depto = row['departamento']  # Ya viene en mayúsculas de la query
-            provincia = row['provincia']  # Ya viene en mayúsculas de la query
-            
-            key = (depto, provincia)
-            resultado_deptos[key] = {
-                'nombre_depto': depto,
-                'nombre_provincia': provincia,
-                'agr_totales': row['agr_total'],
-                'agr_afectados': 0,
-                'ha_afectadas': 0,
-                'monto_afectado': 0
-            }
-        
-        # Actualizar AFECTADOS
-        for row in afectados_depto:
-            depto = row['departamento']  # Ya viene en mayúsculas de la query
-            provincia = row['provincia']  # Ya viene en mayúsculas de la query
-            
-            key = (depto, provincia)
-            if key in resultado_deptos:
-                resultado_deptos[key]['agr_afectados'] = row['agr_afectados']
-                resultado_deptos[key]['ha_afectadas'] = float(row.get('ha_afectadas', 0))
-                resultado_deptos[key]['monto_afectado'] = float(row.get('monto_afectado', 0))
-        
-        # Calcular % damage
         departamentos = []
-        for (depto, prov), data in resultado_deptos.items():
+        for fila in kpis['ubicaciones']:
             pct = 0
-            if data['agr_totales'] > 0:
-                pct = round((data['agr_afectados'] / data['agr_totales']) * 100, 1)
+            if fila['agr_totales'] > 0:
+                pct = round((fila['agr_afectados'] / fila['agr_totales']) * 100, 1)
             
             departamentos.append({
-                'nombre': depto,
-                'provincia': prov,
-                'agr_totales': data['agr_totales'],
-                'agr_afectados': data['agr_afectados'],
-                'ha_afectadas': round(data['ha_afectadas'], 2),
-                'monto_afectado': round(data['monto_afectado'], 2),
+                'nombre': fila['departamento_norm'],
+                'provincia': fila['provincia_norm'],
+                'agr_totales': fila['agr_totales'],
+                'agr_afectados': fila['agr_afectados'],
+                'ha_afectadas': fila['ha_afectadas'],
+                'monto_afectado': fila['monto_afectado'],
                 'pct_damage': f"{pct}%"
             })
         
-        logger.info("Resumen entidades para aviso %d calculado: %d deptos", numero, len(departamentos))
         return jsonify({
             'numero_aviso': numero,
             'departamentos': departamentos
@@ -816,19 +1783,40 @@ def decisiones():
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/clientes-afectados', methods=['GET'])
+@respuesta_cacheable
 def api_clientes_afectados(numero):
     """
     API endpoint: Obtiene clientes afectados por aviso con estadísticas
     
     Query params (opcionales):
         ?depto=TACNA&provincia=TACNA&distrito=TACNA - filtro específico
+        ?summary=1 - solo totales (sin lista de agricultores)
+        ?after_id=&limit= - paginación keyset (responde siguiente_after_id)
+        ?format=ndjson - streaming, un cliente por línea (sin estadísticas)
     """
+    try:
+        after_id, limit = parametros_paginacion()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     try:
         depto = request.args.get('depto')
         provincia = request.args.get('provincia')
         distrito = request.args.get('distrito')
-        
-        clientes = get_clientes_afectados(numero, depto, provincia, distrito)
+        solo_resumen = request.args.get('summary', '').lower() in ('1', 'true', 'si')
+        
+        if pide_ndjson() and not solo_resumen:
+            zonas_afectadas = parse_csv_avisos(numero)
+            if not zonas_afectadas:
+                return Response('', mimetype='application/x-ndjson')
+            query, params = query_clientes_afectados(zonas_afectadas, depto, provincia, distrito,
+                                                     after_id=after_id, limit=limit)
+            return respuesta_ndjson(query, params)
+        
+        if solo_resumen:
+            clientes = resumir_clientes_afectados(numero, depto, provincia, distrito)
+        else:
+            clientes = get_clientes_afectados(numero, depto, provincia, distrito, after_id, limit)
         stats = get_estadisticas_aviso(numero)
         
         response = {
@@ -845,6 +1833,7 @@ def api_clientes_afectados(numero):
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/estadisticas', methods=['GET'])
+@respuesta_cacheable
 def api_estadisticas(numero):
     """
     API endpoint: Estadísticas agregadas del aviso
@@ -858,6 +1847,7 @@ def api_estadisticas(numero):
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/zonas', methods=['GET'])
+@respuesta_cacheable
 def api_zonas_afectadas(numero):
     """
     API endpoint: Zonas (depto/provincia/distrito) afectadas por aviso
@@ -938,29 +1928,22 @@ def generar_shp_consolidado(numero):
             'Nivel 2': '#FFFF00',  # Amarillo - MEDIO
         }
         
-        # Agregar columna de color
-        gdf['fill_color'] = gdf['nivel'].map(nivel_color).fillna('#E8E8E8')
-        
-        # Retornar features con propiedades para Leaflet
-        features = []
-        for idx, row in gdf.iterrows():
-            feature = {
-                'type': 'Feature',
-                'geometry': row.geometry.__geo_interface__,
-                'properties': {
-                    'nivel': row.get('nivel', ''),
-                    'color': row['fill_color'],
-                    'name': row.get('DISTRITO', row.get('PROVINCIA', 'Sin nombre'))
-                }
-            }
-            features.append(feature)
-        
-        return jsonify({
-            'type': 'FeatureCollection',
-            'features': features,
+        # Propiedades para Leaflet (columnas completas, sin iterar filas)
+        nombre = gdf['DISTRITO'] if 'DISTRITO' in gdf.columns else (
+            gdf['PROVINCIA'] if 'PROVINCIA' in gdf.columns else pd.Series('Sin nombre', index=gdf.index)
+        )
+        propiedades = pd.DataFrame({
+            'nivel': gdf['nivel'],
+            'color': gdf['nivel'].map(nivel_color).fillna('#E8E8E8'),
+            'name': nombre
+        }, index=gdf.index)
+        if gdf.crs and gdf.crs != 'EPSG:4326':
+            gdf = gdf.to_crs('EPSG:4326')
+        
+        return respuesta_streaming(generar_coleccion(lotes_features(gdf.geometry, propiedades), {
             'dia_critico': dia_critico,
-            'total': len(features)
-        })
+            'total': len(gdf)
+        }))
         
     except (OSError, ValueError, KeyError, AttributeError) as e:
         logger.error("Error en SHP: %s", str(e))
@@ -971,20 +1954,34 @@ def generar_shp_consolidado(numero):
 # ============================================================================
 
 @decisiones_bp.route('/api/avisos/<int:numero>/kpis-entidades-sql', methods=['GET'])
+@respuesta_cacheable
 def get_kpis_entidades_sql(numero):
-    """Query SQL directa: solo afectados (Rojo/Naranja/Amarillo) por entidad"""
+    """
+    Query SQL directa: solo afectados (Rojo/Naranja/Amarillo) por entidad
+    
+    clientes no guarda el nivel: se toma del CSV de clasificación (como
+    construir_frame_aviso) y se filtra por id en la consulta
+    """
     try:
         zonas_afectadas = parse_csv_avisos(numero)
-        deptos_afectados = list(set([zona['departamento'].upper().strip() for zona in zonas_afectadas]))
         
-        if not deptos_afectados:
+        if not zonas_afectadas:
             return jsonify({'entidades': []}), 200
         
+        _, csv_path = buscar_csv_clasificacion(numero)
+        if not csv_path:
+            return jsonify({'error': f'No hay CSV de clasificación para aviso {numero}'}), 404
+        clasificacion = pd.read_csv(csv_path, usecols=['id', 'nivel'])
+        ids_nivel = sorted(set(
+            clasificacion.loc[clasificacion['nivel'].isin(NIVELES_AFECTACION), 'id'].astype(int).tolist()
+        ))
+        
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'BD error'}), 500
         
-        placeholders = ','.join(['%s'] * len(deptos_afectados))
+        sql_afectados, params = filtro_sql_afectados(zonas_afectadas, alias='c')
+        params = params + [ids_nivel]
         query = f"""
             SELECT 
                 e.id, e.nombre,
@@ -994,14 +1991,14 @@ def get_kpis_entidades_sql(numero):
             FROM clientes c
             LEFT JOIN entidades e ON c.entidad_id = e.id
             WHERE c.estado = 'activo'
-              AND UPPER(TRIM(c.departamento)) IN ({placeholders})
-              AND c.nivel IN ('Rojo', 'Naranja', 'Amarillo')
+              AND {sql_afectados}
+              AND c.id = ANY(%s)
             GROUP BY e.id, e.nombre
             ORDER BY agricultores DESC
         """
         
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(query, deptos_afectados)
+        cursor.execute(query, params)
         entidades = cursor.fetchall()
         cursor.close()
         conn.close()
@@ -1027,112 +2024,14 @@ def get_kpis_entidades_sql(numero):
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/kpis-entidades', methods=['GET'])
+@respuesta_cacheable
 def get_kpis_entidades(numero):
     """Calcula estadísticas POR ENTIDAD (Cajas/Financieras)
     Retorna: Agricultores afectados, hectáreas, monto por entidad
     """
     try:
-        # 1. Encontrar día crítico
-        dia_critico = None
-        for dia in [3, 2, 1]:
-            csv_path = OUTPUT_DIR / f'aviso_{numero}' / f'clientes_por_nivel_dia{dia}.csv'
-            if csv_path.exists():
-                dia_critico = dia
-                break
-        
-        if dia_critico is None:
-            return jsonify({'error': f'No hay CSV para aviso {numero}'}), 404
-        
-        # 2. Leer CSV de clientes
-        csv_path = OUTPUT_DIR / f'aviso_{numero}' / f'clientes_por_nivel_dia{dia_critico}.csv'
-        df_clientes = pd.read_csv(csv_path)
-        
-        # 3. Obtener deptos afectados
-        zonas_afectadas = parse_csv_avisos(numero)
-        deptos_afectados = list(set([zona['departamento'].upper().strip() for zona in zonas_afectadas]))
-        
-        # 4. Conectar BD para obtener entidad_id, monto_asegurado, departamento
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'No connection to DB'}), 500
-        
-        try:
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("""
-                SELECT c.id, c.monto_asegurado, c.departamento, c.entidad_id, e.nombre as entidad_nombre
-                FROM clientes c
-                LEFT JOIN entidades e ON c.entidad_id = e.id
-                WHERE c.estado = 'activo'
-            """)
-            clientes_bd = {row['id']: row for row in cursor.fetchall()}
-            cursor.close()
-            conn.close()
-        except psycopg2.Error as e:
-            logger.error("Error consultando BD: %s", str(e))
-            return jsonify({'error': str(e)}), 500
-        
-        # 5. Procesar: iterar CSV y agrupar por entidad
-        estadisticas_entidad = {}
-        
-        for _, row in df_clientes.iterrows():
-            cliente_id = row['id']
-            ha = float(row['hectareas'] or 0)
-            nivel = row['nivel'].strip()
-            
-            # Solo AFECTADOS: (Rojo + Naranja + Amarillo) Y (en depto afectado)
-            if nivel not in ['Rojo', 'Naranja', 'Amarillo']:
-                continue  # Omitir Verde
-            
-            if cliente_id not in clientes_bd:
-                continue
-            
-            cliente_info = clientes_bd[cliente_id]
-            depto = (cliente_info.get('departamento') or '').upper().strip()
-            
-            # Verificar que esté en departamento afectado
-            if depto not in deptos_afectados:
-                continue
-            
-            monto = float(cliente_info.get('monto_asegurado', 0) or 0)
-            entidad_id = cliente_info.get('entidad_id')
-            entidad_nombre = cliente_info.get('entidad_nombre', 'SIN ENTIDAD')
-            
-            if entidad_id not in estadisticas_entidad:
-                estadisticas_entidad[entidad_id] = {
-                    'nombre': entidad_nombre,
-                    'agricultores': 0,
-                    'hectareas': 0.0,
-                    'monto': 0.0
-                }
-            
-            estadisticas_entidad[entidad_id]['agricultores'] += 1
-            estadisticas_entidad[entidad_id]['hectareas'] += ha
-            estadisticas_entidad[entidad_id]['monto'] += monto
-        
-        # 6. Calcular % daño y formatear respuesta
-        entidades_list = []
-        total_agricultores_afectados = sum([e['agricultores'] for e in estadisticas_entidad.values()])
-        
-        for entidad_id, stats in estadisticas_entidad.items():
-            pct = (stats['agricultores'] / total_agricultores_afectados * 100) if total_agricultores_afectados > 0 else 0
-            
-            entidades_list.append({
-                'entidad_id': entidad_id,
-                'nombre': stats['nombre'],
-                'agricultores': stats['agricultores'],
-                'hectareas': round(stats['hectareas'], 2),
-                'monto': round(stats['monto'], 2),
-                'pct_damage': round(pct, 1)
-            })
-        
-        # Ordenar por agricultores afectados (descendente)
-        entidades_list.sort(key=lambda x: x['agricultores'], reverse=True)
-        
-        logger.info("Estadísticas entidades para aviso %d calculadas: %d entidades", numero, len(entidades_list))
-        return jsonify({
-            'numero_aviso': numero,
-            'entidades': entidades_list
-        })
+        cuerpo, codigo = payload_kpis_entidades(numero)
+        return jsonify(cuerpo), codigo
         
     except Exception as e:
         logger.error("Error calculando KPIs entidades: %s", str(e))
@@ -1140,107 +2039,14 @@ def get_kpis_entidades(numero):
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/kpis-cultivos', methods=['GET'])
+@respuesta_cacheable
 def get_kpis_cultivos(numero):
     """Retorna TOP 5 cultivos más afectados (Rojo/Naranja/Amarillo en deptos afectados)
     Incluye: cultivo, departamento, agricultores, hectáreas, monto
     """
     try:
-        # 1. Encontrar día crítico
-        dia_critico = None
-        for dia in [3, 2, 1]:
-            csv_path = OUTPUT_DIR / f'aviso_{numero}' / f'clientes_por_nivel_dia{dia}.csv'
-            if csv_path.exists():
-                dia_critico = dia
-                break
-        
-        if dia_critico is None:
-            return jsonify({'error': f'No hay CSV para aviso {numero}'}), 404
-        
-        # 2. Leer CSV de clientes
-        csv_path = OUTPUT_DIR / f'aviso_{numero}' / f'clientes_por_nivel_dia{dia_critico}.csv'
-        df_clientes = pd.read_csv(csv_path)
-        
-        # 3. Obtener deptos afectados
-        zonas_afectadas = parse_csv_avisos(numero)
-        deptos_afectados = list(set([zona['departamento'].upper().strip() for zona in zonas_afectadas]))
-        
-        # 4. Conectar BD para obtener cultivo_id, monto_asegurado, departamento
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'No connection to DB'}), 500
-        
-        try:
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("""
-                SELECT c.id, c.monto_asegurado, c.departamento, c.cultivo_id, tc.nombre as cultivo_nombre
-                FROM clientes c
-                LEFT JOIN tabla_cultivos tc ON c.cultivo_id = tc.id
-                WHERE c.estado = 'activo'
-            """)
-            clientes_bd = {row['id']: row for row in cursor.fetchall()}
-            cursor.close()
-            conn.close()
-        except psycopg2.Error as e:
-            logger.error("Error consultando BD: %s", str(e))
-            return jsonify({'error': str(e)}), 500
-        
-        # 5. Procesar: iterar CSV y agrupar por (cultivo_id, departamento)
-        estadisticas_cultivo = {}
-        
-        for _, row in df_clientes.iterrows():
-            cliente_id = row['id']
-            ha = float(row['hectareas'] or 0)
-            nivel = row['nivel'].strip()
-            
-            # Solo AFECTADOS: (Rojo + Naranja + Amarillo) Y (en depto afectado)
-            if nivel not in ['Rojo', 'Naranja', 'Amarillo']:
-                continue
-            
-            if cliente_id not in clientes_bd:
-                continue
-            
-            cliente_info = clientes_bd[cliente_id]
-            depto = (cliente_info.get('departamento') or '').upper().strip()
-            
-            # Verificar que esté en departamento afectado
-            if depto not in deptos_afectados:
-                continue
-            
-            monto = float(cliente_info.get('monto_asegurado', 0) or 0)
-            cultivo_id = cliente_info.get('cultivo_id')
-            cultivo_nombre = cliente_info.get('cultivo_nombre', f'Cultivo {cultivo_id}')
-            
-            key = (cultivo_id, depto)
-            
-            if key not in estadisticas_cultivo:
-                estadisticas_cultivo[key] = {
-                    'cultivo_id': cultivo_id,
-                    'cultivo_nombre': cultivo_nombre,
-                    'departamento': depto,
-                    'agricultores': 0,
-                    'hectareas': 0.0,
-                    'monto': 0.0
-                }
-            
-            estadisticas_cultivo[key]['agricultores'] += 1
-            estadisticas_cultivo[key]['hectareas'] += ha
-            estadisticas_cultivo[key]['monto'] += monto
-        
-        # 6. Convertir a lista y ordenar por agricultores DESC, tomar TOP 5
-        cultivos_list = list(estadisticas_cultivo.values())
-        cultivos_list.sort(key=lambda x: x['agricultores'], reverse=True)
-        cultivos_top5 = cultivos_list[:5]
-        
-        # 7. Formatear respuesta
-        for cultivo in cultivos_top5:
-            cultivo['hectareas'] = round(cultivo['hectareas'], 2)
-            cultivo['monto'] = round(cultivo['monto'], 2)
-        
-        logger.info("Cultivos TOP 5 para aviso %d calculados: %d cultivos", numero, len(cultivos_top5))
-        return jsonify({
-            'numero_aviso': numero,
-            'cultivos': cultivos_top5
-        })
+        cuerpo, codigo = payload_kpis_cultivos(numero)
+        return jsonify(cuerpo), codigo
         
     except Exception as e:
         logger.error("Error calculando KPIs cultivos: %s", str(e))
@@ -1248,139 +2054,64 @@ def get_kpis_cultivos(numero):
 
 
 @decisiones_bp.route('/api/avisos/<int:numero>/kpis', methods=['GET'])
+@respuesta_cacheable
 def get_kpis(numero):
     """Calcula y retorna los KPIs principales para el Centro de Decisiones
-    Lee del CSV si existe, sino calcula desde BD + datos de avisos CSV
+    Lee del CSV si existe, sino clasifica en vivo contra el SHP del día crítico
     """
     try:
-        # 1. Intentar leer CSV de clientes clasificados (generado por areas.py)
-        df_clientes = None
-        dia_critico = None
-        
-        for dia in [3, 2, 1]:  # Preferencia: 3, 2, 1
-            csv_path = OUTPUT_DIR / f'aviso_{numero}' / f'clientes_por_nivel_dia{dia}.csv'
-            if csv_path.exists():
-                df_clientes = pd.read_csv(csv_path)
-                dia_critico = dia
-                logger.info(f"CSV de clientes encontrado para aviso {numero}, día {dia}")
-                break
-        
-        # 2. Si no hay CSV, calcular desde BD (fallback)
-        if df_clientes is None:
-            logger.warning(f"No hay CSV para aviso {numero}. Usando datos de BD.")
-            conn = get_db_connection()
-            if not conn:
-                return jsonify({'error': 'No connection to DB'}), 500
-            
-            try:
-                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                cursor.execute("""
-                    SELECT id, CONCAT(nombre, ' ', apellido) as nombre, 
-                           hectareas, monto_asegurado, departamento, cultivo_id
-                    FROM clientes
-                    WHERE estado = 'activo'
-                    ORDER BY id
-                """)
-                rows = cursor.fetchall()
-                df_clientes = pd.DataFrame(rows)
-                df_clientes['nivel'] = 'Verde'  # Sin CSV, asumir todos Verde
-                cursor.close()
-                conn.close()
-                logger.info(f"Datos de clientes cargados desde BD: {len(df_clientes)} registros")
-            except psycopg2.Error as e:
-                logger.error("Error consultando BD: %s", str(e))
-                return jsonify({'error': str(e)}), 500
-        
-        # 3. Obtener BD para monto_asegurado (si vino del CSV, complementar)
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'No connection to DB'}), 500
-        
-        try:
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("""
-                SELECT id, monto_asegurado, departamento
-                FROM clientes
-                WHERE estado = 'activo'
-            """)
-            clientes_bd = {row['id']: row for row in cursor.fetchall()}
-            cursor.close()
-            conn.close()
-        except psycopg2.Error as e:
-            logger.error("Error consultando BD: %s", str(e))
-            return jsonify({'error': str(e)}), 500
-        
-        # 4. Obtener deptos afectados
-        zonas_afectadas = parse_csv_avisos(numero)
-        deptos_afectados = list(set([zona['departamento'].upper().strip() for zona in zonas_afectadas]))
-        
-        # 5. Procesar datos del CSV
-        agricultores_totales = len(df_clientes)
-        hectareas_totales = 0
-        poliza_total = 0
-        
-        agricultores_afectados = 0
-        hectareas_afectadas = 0
-        poliza_afectados = 0
-        
-        estadisticas_color = {
-            'Rojo': {'agricultores': 0, 'hectareas': 0.0, 'poliza': 0.0},
-            'Naranja': {'agricultores': 0, 'hectareas': 0.0, 'poliza': 0.0},
-            'Amarillo': {'agricultores': 0, 'hectareas': 0.0, 'poliza': 0.0},
-            'Verde': {'agricultores': 0, 'hectareas': 0.0, 'poliza': 0.0}
-        }
-        
-        # Iterar sobre CSV
-        for _, row in df_clientes.iterrows():
-            cliente_id = row['id']
-            ha = float(row['hectareas'] or 0)
-            nivel = row['nivel'].strip()
-            
-            # Obtener monto de BD
-            monto = 0.0
-            depto = ''
-            if cliente_id in clientes_bd:
-                monto = float(clientes_bd[cliente_id].get('monto_asegurado', 0) or 0)
-                depto = (clientes_bd[cliente_id].get('departamento') or '').upper().strip()
-            
-            # Contar TOTALES
-            hectareas_totales += ha
-            poliza_total += monto
-            
-            # Contar por color
-            if nivel in estadisticas_color:
-                estadisticas_color[nivel]['agricultores'] += 1
-                estadisticas_color[nivel]['hectareas'] += ha
-                estadisticas_color[nivel]['poliza'] += monto
-            
-            # AFECTADOS = (ROJO + NARANJA + AMARILLO) AND (está en depto afectado)
-            if nivel in ['Rojo', 'Naranja', 'Amarillo'] and depto in deptos_afectados:
-                agricultores_afectados += 1
-                hectareas_afectadas += ha
-                poliza_afectados += monto
-        
-        # 6. Redondear valores
-        for color in estadisticas_color:
-            estadisticas_color[color]['hectareas'] = round(estadisticas_color[color]['hectareas'], 2)
-            estadisticas_color[color]['poliza'] = round(estadisticas_color[color]['poliza'], 2)
-        
-        porcentaje_afectacion = (
-            (agricultores_afectados / agricultores_totales * 100) 
-            if agricultores_totales > 0 else 0
-        )
-        
-        # 7. Retornar KPIs
-        return jsonify({
-            'agricultores_totales': agricultores_totales,
-            'agricultores_afectados': agricultores_afectados,
-            'porcentaje_afectacion': round(porcentaje_afectacion, 1),
-            'hectareas_totales': round(hectareas_totales, 2),
-            'hectareas_afectadas': round(hectareas_afectadas, 2),
-            'poliza_total': round(poliza_total, 2),
-            'poliza_afectados': round(poliza_afectados, 2),
-            'zonas_por_color': estadisticas_color
-        })
+        cuerpo, codigo = payload_kpis(numero)
+        return jsonify(cuerpo), codigo
         
     except Exception as e:
         logger.error("Error calculando KPIs: %s", str(e))
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+@decisiones_bp.route('/api/avisos/<int:numero>/decisiones-bundle', methods=['GET'])
+@respuesta_cacheable
+def api_decisiones_bundle(numero):
+    """
+    Todas las secciones del Centro de Decisiones en una sola respuesta
+    
+    Cada parte es idéntica al cuerpo de su endpoint individual:
+        resumen      -> clientes de /clientes-afectados?summary=1
+        estadisticas -> /estadisticas
+        agregaciones -> /agregaciones
+        kpis         -> /kpis
+        entidades    -> /kpis-entidades
+        cultivos     -> /kpis-cultivos
+        shp          -> /shp-geojson
+    
+    Las partes de KPIs comparten un solo cálculo del motor y estadisticas
+    reutiliza el resumen. Un error en una parte no invalida las demás: esa
+    parte se devuelve como {'error': ...}.
+    
+    Query params:
+        ?parts=kpis,entidades,... (default: todas)
+    """
+    partes = [p.strip() for p in request.args.get('parts', ','.join(PARTES_BUNDLE)).split(',') if p.strip()]
+    desconocidas = [p for p in partes if p not in PARTES_BUNDLE]
+    if desconocidas:
+        return jsonify({'error': f'Partes desconocidas: {desconocidas}', 'disponibles': PARTES_BUNDLE}), 400
+    
+    bundle = {'numero_aviso': numero}
+    resumen = None
+    for parte in partes:
+        try:
+            if parte == 'resumen':
+                resumen = resumen if resumen is not None else resumir_clientes_afectados(numero)
+                bundle[parte] = resumen
+            elif parte == 'estadisticas':
+                resumen = resumen if resumen is not None else resumir_clientes_afectados(numero)
+                bundle[parte] = get_estadisticas_aviso(numero, resumen)
+            elif parte == 'shp':
+                bundle[parte], _ = geojson_shp_aviso(numero)
+            else:
+                bundle[parte], _ = PAYLOADS_KPI[parte](numero)
+        except Exception as e:
+            logger.error("Error en parte '%s' del bundle del aviso %d: %s", parte, numero, str(e))
+            bundle[parte] = {'error': str(e)}
+    
+    # La parte shp llega serializada (FragmentoJSON) y se incrusta tal cual
+    return Response(dumps(bundle), mimetype='application/json')
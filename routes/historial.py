@@ -0,0 +1,94 @@
+"""
+Rutas de Historial - Exposición acumulada entre avisos
+Consulta el historial columnar de SERVICIOS/historial.py (series y top-N)
+"""
+import logging
+import re
+
+from flask import Blueprint, jsonify, request
+
+from SERVICIOS.historial import (
+    DIMENSIONES_TOP, HISTORIAL_DISPONIBLE, NIVELES_EXPUESTOS,
+    serie_exposicion, serie_kpis, top_exposicion
+)
+
+logger = logging.getLogger(__name__)
+historial_bp = Blueprint('historial', __name__, url_prefix='')
+
+PATRON_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def _parametros_historial():
+    """
+    Filtros comunes de /api/historial
+    
+    Raises:
+        ValueError: Si algún parámetro tiene formato inválido
+    """
+    desde, hasta = request.args.get('desde'), request.args.get('hasta')
+    for nombre, valor in (('desde', desde), ('hasta', hasta)):
+        if valor and not PATRON_FECHA.match(valor):
+            raise ValueError(f'{nombre} debe tener formato YYYY-MM-DD')
+    
+    niveles = [n.strip().capitalize() for n in request.args.get('niveles', 'Rojo').split(',') if n.strip()]
+    invalidos = [n for n in niveles if n not in NIVELES_EXPUESTOS]
+    if invalidos or not niveles:
+        raise ValueError(f'niveles debe contener valores de: {", ".join(NIVELES_EXPUESTOS)}')
+    
+    filtros = {
+        'entidad_id': request.args.get('entidad_id', type=int),
+        'cultivo_id': request.args.get('cultivo_id', type=int),
+        'cliente_id': request.args.get('cliente_id', type=int),
+        'departamento': (request.args.get('departamento') or '').strip().upper() or None,
+    }
+    return desde, hasta, niveles, filtros
+
+
+@historial_bp.route('/api/historial', methods=['GET'])
+def api_historial():
+    """
+    Exposición de clientes a lo largo de los avisos
+    
+    Query params:
+        ?tipo=serie|top|kpis   - serie por aviso (default), ranking o KPIs por aviso
+        ?desde=&hasta=         - rango de fecha de emisión (YYYY-MM-DD)
+        ?niveles=Rojo,Naranja  - niveles que cuentan como exposición (default Rojo)
+        ?entidad_id=&cultivo_id=&cliente_id=&departamento= - filtros
+        ?por=entidad|cultivo|departamento|provincia|distrito|cliente (tipo=top)
+        ?n=10&orden=avisos|clientes|hectareas|monto (tipo=top)
+    """
+    if not HISTORIAL_DISPONIBLE:
+        return jsonify({'error': 'Historial no disponible (pyarrow no instalado)'}), 503
+    
+    tipo = request.args.get('tipo', 'serie')
+    try:
+        desde, hasta, niveles, filtros = _parametros_historial()
+        
+        if tipo == 'kpis':
+            return jsonify({'tipo': tipo, 'desde': desde, 'hasta': hasta, 'avisos': serie_kpis(desde, hasta)})
+        
+        if tipo == 'serie':
+            serie = serie_exposicion(niveles, desde, hasta, **filtros)
+            return jsonify({
+                'tipo': tipo, 'desde': desde, 'hasta': hasta, 'niveles': niveles, 'filtros': filtros,
+                'avisos_con_exposicion': len(serie),
+                'serie': serie
+            })
+        
+        if tipo == 'top':
+            por = request.args.get('por', 'entidad')
+            top = top_exposicion(por, niveles, n=request.args.get('n', 10, type=int),
+                                 orden=request.args.get('orden', 'avisos'), desde=desde, hasta=hasta, **filtros)
+            return jsonify({
+                'tipo': tipo, 'por': por, 'desde': desde, 'hasta': hasta, 'niveles': niveles,
+                'filtros': filtros, 'top': top
+            })
+        
+        return jsonify({'error': 'tipo debe ser serie, top o kpis',
+                        'dimensiones': list(DIMENSIONES_TOP)}), 400
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Error en historial: %s", str(e))
+        return jsonify({'error': str(e)}), 500
@@ -1,11 +1,14 @@
 """
 Rutas de Mapas - Vistas y APIs para galería de mapas meteorológicos
 """
-from flask import Blueprint, render_template, request, send_from_directory, jsonify
+from flask import Blueprint, render_template, request, jsonify
 from pathlib import Path
-import os
 import logging
-from datetime import datetime
+from math import ceil
+from werkzeug.exceptions import NotFound
+
+from SERVICIOS.archivos_output import enviar_output
+from SERVICIOS.galeria_mapas import MAPAS_POR_PAGINA, consultar_mapas
 
 # Configuración
 BASE_DIR = Path(__file__).parent.parent
@@ -16,57 +19,55 @@ logger = logging.getLogger(__name__)
 mapas_bp = Blueprint('mapas', __name__, url_prefix='')
 
 
-def obtener_lista_mapas(aviso_filtro=None):
-    """Obtener lista de mapas para galería"""
-    mapas = []
-    
-    if OUTPUT_DIR.exists():
-        avisos_dirs = [d for d in OUTPUT_DIR.iterdir() 
-                      if d.is_dir() and d.name.startswith('aviso_')]
-        
-        if aviso_filtro:
-            avisos_dirs = [d for d in avisos_dirs if d.name == f'aviso_{aviso_filtro}']
-        
-        avisos_dirs = sorted(avisos_dirs, key=lambda x: x.stat().st_mtime, reverse=True)
-        
-        for aviso_dir in avisos_dirs:
-            numero_aviso = aviso_dir.name.replace('aviso_', '')
-            webp_files = [f for f in aviso_dir.iterdir() if f.suffix == '.webp']
-            
-            for webp_file in webp_files:
-                url_local = f"/mapas/imagen/{numero_aviso}/{webp_file.name}"
-                
-                mapas.append({
-                    'id': f"{numero_aviso}_{webp_file.stem}",
-                    'nombre': f"{webp_file.stem}.webp",
-                    'numero_aviso': numero_aviso,
-                    'departamento': webp_file.stem,
-                    'url': url_local,
-                    'fecha': datetime.fromtimestamp(aviso_dir.stat().st_mtime).strftime('%d/%m/%Y')
-                })
-    
-    return mapas
+def _parametros_galeria():
+    """Filtros y página de la galería desde la query (?aviso=&departamento=&page=)"""
+    aviso = request.args.get('aviso', type=int)
+    departamento = request.args.get('departamento') or None
+    pagina = max(request.args.get('page', 1, type=int), 1)
+    return aviso, departamento, pagina
 
 
 @mapas_bp.route('/mapas', methods=['GET'])
 def mapas():
-    """Galería de mapas"""
+    """
+    Galería de mapas
+
+    La página se arma en el cliente con /api/avisos?include=...; la lista
+    filtrable y paginada de mapas está en /api/mapas
+    """
+    return render_template('mapas.html')
+
+
+@mapas_bp.route('/api/mapas', methods=['GET'])
+def api_mapas():
+    """API de la galería (índice SQLite, ver SERVICIOS/galeria_mapas.py)"""
     try:
-        aviso_filtro = request.args.get('aviso')
-        mapas_lista = obtener_lista_mapas(aviso_filtro)
-        return render_template('mapas.html', mapas=mapas_lista)
+        aviso, departamento, pagina = _parametros_galeria()
+        mapas_lista, total = consultar_mapas(aviso, departamento, pagina)
+        return jsonify({
+            'success': True,
+            'mapas': mapas_lista,
+            'total': total,
+            'pagina': pagina,
+            'por_pagina': MAPAS_POR_PAGINA,
+            'paginas': max(ceil(total / MAPAS_POR_PAGINA), 1)
+        }), 200
     except Exception as e:
-        logger.error(f"Error en página mapas: {str(e)}")
-        return render_template('mapas.html', mapas=[])
+        logger.error(f"Error consultando galería: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
 
 @mapas_bp.route('/mapas/imagen/<int:numero>/<filename>')
 def servir_mapa(numero, filename):
-    """Sirve imágenes de mapas"""
+    """Sirve imágenes de mapas (en línea; ver SERVICIOS/archivos_output.py)"""
     try:
-        directorio = OUTPUT_DIR / f'aviso_{numero}'
-        return send_from_directory(directorio, filename)
-    except Exception as e:
+        return enviar_output(f'aviso_{numero}/{filename}')
+    except NotFound:
+        return "Archivo no encontrado", 404
+    except OSError as e:
         logger.error(f"Error sirviendo imagen: {str(e)}")
         return "Archivo no encontrado", 404
 
@@ -75,20 +76,13 @@ def servir_mapa(numero, filename):
 def api_mapas_por_aviso(numero):
     """API para obtener lista de mapas de un aviso"""
     try:
-        output_path = OUTPUT_DIR / f'aviso_{numero}'
-        mapas = []
-        
-        if output_path.exists():
-            for img_file in output_path.glob('*.*'):
-                if img_file.suffix.lower() in ['.webp', '.png']:
-                    depto = img_file.stem
-                    mapas.append({
-                        'nombre': depto,
-                        'archivo': img_file.name,
-                        'url': f'/mapas/imagen/{numero}/{img_file.name}',
-                        'ruta': str(img_file)
-                    })
-        
+        mapas = [{
+            'nombre': mapa['departamento'],
+            'archivo': mapa['nombre'],
+            'url': mapa['url'],
+            'ruta': str(OUTPUT_DIR / f'aviso_{numero}' / mapa['nombre'])
+        } for mapa in consultar_mapas(aviso=numero, por_pagina=None)[0]]
+
         return jsonify({
             'success': True,
             'aviso': numero,
@@ -2,12 +2,22 @@
 Rutas de Mapas y SHP - Endpoints para capas geoespaciales
 Maneja SHP de avisos y delimitaciones (departamentos, provincias, distritos)
 """
+import hashlib
 import logging
 import sys
 from pathlib import Path
 
 import geopandas as gpd
-from flask import Blueprint, jsonify
+import pandas as pd
+from flask import Blueprint, Response, jsonify, redirect, request, send_file
+
+from SERVICIOS.cache_respuestas import respuesta_cacheable
+from SERVICIOS.geojson import elegir_codificacion, feature_collection
+from SERVICIOS.json_rapido import FragmentoJSON, dumps
+from SERVICIOS.delimitaciones import (
+    ASSETS_DIR, CAPAS, consultar_capa, obtener_capa, parsear_bbox, url_capa, urls_delimitaciones
+)
+from SERVICIOS.riesgo_disuelto import COLOR_SIN_NIVEL, COLORES_NIVEL, geojson_disuelto, nombres_zona
 
 sys.path.insert(0, str(Path(__file__).parent.parent / 'LAYOUT'))
 try:
@@ -17,89 +27,131 @@ except ImportError:
 
 BASE_DIR = Path(__file__).parent.parent
 TEMP_DIR = BASE_DIR / 'TEMP'
-DELIMITACIONES_DIR = BASE_DIR / 'DELIMITACIONES'
 
 logger = logging.getLogger(__name__)
 mapas_shp_bp = Blueprint('mapas_shp', __name__, url_prefix='')
 
+FORMATOS_DELIMITACION = ('geojson', 'topojson')
+
 
 # ============================================================================
 # ENDPOINTS - SHP AVISOS
 # ============================================================================
 
+def shp_critico_aviso(numero):
+    """
+    SHP del día crítico del aviso (mayor área ALTO/MUY_ALTO)
+    
+    Returns:
+        Tupla ((dia_critico, ruta_shp), None) o (None, (cuerpo de error, código HTTP))
+    """
+    temp_base = TEMP_DIR / f'aviso_{numero}'
+
+    if not temp_base.exists():
+        return None, ({'error': f'Aviso {numero} no encontrado'}, 404)
+
+    # Buscar los 3 días
+    dict_shps = {}
+    for dia in range(1, 4):
+        dia_dir = temp_base / f'dia{dia}'
+        shp_path = dia_dir / 'view_aviso.shp'
+        if shp_path.exists():
+            dict_shps[f'dia{dia}'] = str(shp_path)
+
+    if not dict_shps:
+        return None, ({'error': 'No hay SHP disponibles'}, 404)
+
+    # Seleccionar día crítico
+    try:
+        return seleccionar_dia_critico(dict_shps), None
+    except (ValueError, AttributeError, TypeError):
+        # Si falla, usa dia1
+        if 'dia1' not in dict_shps:
+            return None, ({'error': 'No se pudo seleccionar día'}, 500)
+        return ('dia1', dict_shps['dia1']), None
+
+
+def geojson_shp_aviso(numero):
+    """
+    GeoJSON del SHP del día crítico coloreado por nivel
+    (usado por /shp-geojson y por el bundle de decisiones)
+    
+    Usa la capa disuelta por nivel (SERVICIOS/riesgo_disuelto.py); si no se
+    puede generar, serializa el SHP original polígono a polígono.
+    
+    Returns:
+        Tupla (cuerpo, código HTTP); con éxito el cuerpo es un FragmentoJSON
+    """
+    critico, error = shp_critico_aviso(numero)
+    if error:
+        return error
+    dia_critico, shp_critico = critico
+
+    disuelto = geojson_disuelto(shp_critico)
+    if disuelto:
+        return FragmentoJSON(disuelto[0].read_bytes()), 200
+
+    # Leer SHP
+    try:
+        gdf = gpd.read_file(shp_critico)
+    except (OSError, ValueError) as e:
+        logger.error("Error leyendo SHP: %s", str(e))
+        return {'error': f'Error leyendo SHP: {str(e)}'}, 500
+
+    # Propiedades para Leaflet (columnas completas, sin iterar filas)
+    propiedades = pd.DataFrame({
+        'nivel': gdf['nivel'],
+        'color': gdf['nivel'].map(COLORES_NIVEL).fillna(COLOR_SIN_NIVEL),
+        'name': nombres_zona(gdf)
+    }, index=gdf.index)
+    if gdf.crs and gdf.crs != 'EPSG:4326':
+        gdf = gdf.to_crs('EPSG:4326')
+
+    return feature_collection(gdf.geometry, propiedades, extra={
+        'dia_critico': dia_critico,
+        'total': len(gdf)
+    }), 200
+
+
+def enviar_precomprimido(ruta, codificaciones, cache_control='no-cache', etag=None):
+    """
+    send_file del .geojson en la mejor codificación aceptada por el cliente
+    
+    Args:
+        etag: Prefijo del ETag (se le añade la codificación); None = el de Flask
+    """
+    codificacion, sufijo = elegir_codificacion(request.headers.get('Accept-Encoding'), codificaciones)
+    respuesta = send_file(ruta.with_name(ruta.name + sufijo), mimetype='application/json', conditional=True,
+                          etag=f"{etag}-{codificacion or 'identity'}" if etag else True)
+    respuesta.headers.pop('Content-Disposition', None)
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.headers['Vary'] = 'Accept-Encoding'
+    respuesta.headers['Cache-Control'] = cache_control
+    return respuesta
+
+
 @mapas_shp_bp.route('/api/avisos/<int:numero>/shp-geojson', methods=['GET'])
+@respuesta_cacheable
 def obtener_shp_geojson(numero):
     """
     Devuelve GeoJSON del SHP coloreado por nivel de riesgo
-    Lee del día crítico (mayor área ALTO/MUY_ALTO)
+    Lee del día crítico (mayor área ALTO/MUY_ALTO), disuelto en una geometría
+    por nivel y servido precomprimido (br/gzip) cuando existe
     Colores: Rojo (#FF0000) = Nivel 4, Naranja (#FF8C00) = Nivel 3, Gris = otros
     """
     try:
-        temp_base = TEMP_DIR / f'aviso_{numero}'
-
-        if not temp_base.exists():
-            return jsonify({'error': f'Aviso {numero} no encontrado'}), 404
-
-        # Buscar los 3 días
-        dict_shps = {}
-        for dia in range(1, 4):
-            dia_dir = temp_base / f'dia{dia}'
-            shp_path = dia_dir / 'view_aviso.shp'
-            if shp_path.exists():
-                dict_shps[f'dia{dia}'] = str(shp_path)
-
-        if not dict_shps:
-            return jsonify({'error': 'No hay SHP disponibles'}), 404
-
-        # Seleccionar día crítico
-        dia_critico = 'dia1'
-        shp_critico = None
-        try:
-            dia_critico, shp_critico = seleccionar_dia_critico(dict_shps)
-        except (ValueError, AttributeError):
-            # Si falla, usa dia1
-            shp_critico = dict_shps.get('dia1')
-            if not shp_critico:
-                return jsonify({'error': 'No se pudo seleccionar día'}), 500
-
-        # Leer SHP
-        try:
-            gdf = gpd.read_file(shp_critico)
-        except (OSError, ValueError) as e:
-            logger.error("Error leyendo SHP: %s", str(e))
-            return jsonify({'error': f'Error leyendo SHP: {str(e)}'}), 500
-
-        # Mapear colores por nivel (guiado de MAPAS.py)
-        nivel_color = {
-            'Nivel 4': '#FF0000',  # Rojo - MUY_ALTO
-            'Nivel 3': '#FF8C00',  # Naranja - ALTO
-            'Nivel 2': '#FFFF00',  # Amarillo - MEDIO
-            'Nivel 1': '#90EE90'   # Verde - BAJO
-        }
-
-        # Agregar columna de color
-        gdf['fill_color'] = gdf['nivel'].map(nivel_color).fillna('#E8E8E8')
-
-        # Retornar features con propiedades para Leaflet
-        features = []
-        for _, row in gdf.iterrows():
-            feature = {
-                'type': 'Feature',
-                'geometry': row.geometry.__geo_interface__,
-                'properties': {
-                    'nivel': row.get('nivel', ''),
-                    'color': row['fill_color'],
-                    'name': row.get('DISTRITO', row.get('PROVINCIA', 'Sin nombre'))
-                }
-            }
-            features.append(feature)
-
-        return jsonify({
-            'type': 'FeatureCollection',
-            'features': features,
-            'dia_critico': dia_critico,
-            'total': len(features)
-        })
+        critico, error = shp_critico_aviso(numero)
+        if error:
+            cuerpo, codigo = error
+            return jsonify(cuerpo), codigo
+
+        disuelto = geojson_disuelto(critico[1])
+        if disuelto:
+            return enviar_precomprimido(*disuelto)
+
+        cuerpo, codigo = geojson_shp_aviso(numero)
+        return Response(dumps(cuerpo), status=codigo, mimetype='application/json')
 
     except (OSError, ValueError, KeyError, AttributeError) as e:
         logger.error("Error en SHP: %s", str(e))
@@ -107,55 +159,105 @@ def obtener_shp_geojson(numero):
 
 
 # ============================================================================
-# ENDPOINTS - DELIMITACIONES
+# ENDPOINTS - DELIMITACIONES (precompiladas en SERVICIOS/delimitaciones.py)
 # ============================================================================
 
-@mapas_shp_bp.route('/api/delimitaciones/departamentos', methods=['GET'])
-def obtener_departamentos():
-    """Devuelve GeoJSON de departamentos del Perú"""
+def filtros_delimitacion():
+    """
+    Lee ?bbox=&departamento=&provincia=&props_only= del request
+    
+    Returns:
+        Dict de argumentos para consultar_capa() o None si no hay filtros
+        
+    Raises:
+        ValueError: Si bbox no es válido
+    """
+    args = request.args
+    if not any(clave in args for clave in ('bbox', 'departamento', 'provincia', 'props_only')):
+        return None
+    return {
+        'bbox': parsear_bbox(args['bbox']) if args.get('bbox') else None,
+        'departamentos': [d for d in args.get('departamento', '').split(',') if d.strip()],
+        'provincia': args.get('provincia') or None,
+        'solo_propiedades': args.get('props_only', '').lower() in ('1', 'true', 'si')
+    }
+
+
+def respuesta_delimitacion(capa, version=None, formato=None):
+    """
+    Sirve la capa precompilada (br/gzip según Accept-Encoding) o, con filtros,
+    el subconjunto resuelto por el índice en memoria
+    
+    Con `version` (URL con hash) la respuesta es inmutable; sin ella se
+    revalida con ETag. Un hash que ya no es el vigente redirige al actual.
+    `formato` ('geojson' o 'topojson') se toma de ?format= si no se indica.
+    """
+    formato = formato or request.args.get('format', 'geojson').lower()
+    if formato not in FORMATOS_DELIMITACION:
+        return jsonify({'error': f'Formato no soportado: {formato}'}), 400
+    try:
+        filtros = filtros_delimitacion()
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+    if filtros and filtros['solo_propiedades'] and formato == 'topojson':
+        return jsonify({'error': 'props_only solo está disponible en GeoJSON'}), 400
+
+    entrada = obtener_capa(capa)
+    if entrada is None:
+        return jsonify({'error': 'Shapefile no encontrado'}), 404
+    if version is not None and version != entrada['hash']:
+        destino = url_capa(capa, entrada, formato)
+        if request.query_string:
+            destino += '?' + request.query_string.decode('utf-8')
+        return redirect(destino, code=302)
+
+    cache_control = 'public, max-age=31536000, immutable' if version is not None else 'no-cache'
+    if filtros is not None:
+        respuesta = Response(consultar_capa(capa, formato=formato, **filtros), mimetype='application/json')
+        respuesta.set_etag(f"{entrada['hash']}-{hashlib.sha1(request.query_string).hexdigest()[:12]}")
+        respuesta.headers['Cache-Control'] = cache_control
+        return respuesta.make_conditional(request)
+
+    if formato == 'topojson':
+        topo = entrada['topojson']
+        return enviar_precomprimido(ASSETS_DIR / topo['archivo'], topo['codificaciones'],
+                                    cache_control, etag=f"{entrada['hash']}-topo")
+    return enviar_precomprimido(ASSETS_DIR / entrada['archivo'], entrada['codificaciones'],
+                                cache_control, etag=entrada['hash'])
+
+
+@mapas_shp_bp.app_context_processor
+def inyectar_urls_delimitaciones():
+    """Plantillas: delimitaciones_urls() -> {capa: URL inmutable} de las capas ya precompiladas"""
+    return {'delimitaciones_urls': urls_delimitaciones}
+
+
+@mapas_shp_bp.route('/api/delimitaciones/<capa>.<version>.<any(geojson, topojson):formato>', methods=['GET'])
+def obtener_delimitacion_versionada(capa, version, formato):
+    """GeoJSON/TopoJSON de una capa de delimitación en su URL con hash (cacheable para siempre)"""
+    if capa not in CAPAS:
+        return jsonify({'error': f'Capa desconocida: {capa}'}), 404
     try:
-        shp_path = DELIMITACIONES_DIR / 'DEPARTAMENTOS' / 'DEPARTAMENTOS.shp'
-        if not shp_path.exists():
-            return jsonify({'error': 'Shapefile no encontrado'}), 404
+        return respuesta_delimitacion(capa, version, formato)
+    except (OSError, ValueError) as e:
+        logger.error("Error en delimitación %s: %s", capa, str(e))
+        return jsonify({'error': str(e)}), 500
 
-        gdf = gpd.read_file(str(shp_path))
-        logger.info("Columnas SHP departamentos: %s", list(gdf.columns))
-        logger.info("CRS original: %s", gdf.crs)
-        
-        # CONVERTIR A WGS84 (EPSG:4326) para Leaflet
-        if gdf.crs and gdf.crs != 'EPSG:4326':
-            gdf = gdf.to_crs('EPSG:4326')
-            logger.info("CRS convertido a EPSG:4326")
-        
-        features = []
-        for _, row in gdf.iterrows():
-            # Buscar nombre en diferentes columnas posibles
-            nombre_depto = 'Sin nombre'
-            for col in ['DPTONOM02', 'DEPARTAMEN', 'NAME', 'NOMBDEP', 'DEPARTAMENTO']:
-                if col in row.index and row[col]:
-                    nombre_depto = str(row[col]).upper().strip()
-                    break
-            
-            feature = {
-                'type': 'Feature',
-                'geometry': row.geometry.__geo_interface__,
-                'properties': {
-                    'DEPARTAMEN': nombre_depto,  # Estandarizar
-                    'nombre': nombre_depto,
-                    'tipo': 'departamento'
-                }
-            }
-            features.append(feature)
-
-        logger.info("Departamentos cargados: %d (ej: %s)", len(features), 
-                   features[0]['properties']['nombre'] if features else 'N/A')
-        
-        return jsonify({
-            'type': 'FeatureCollection',
-            'features': features,
-            'total': len(features)
-        })
 
+@mapas_shp_bp.route('/api/delimitaciones/departamentos', methods=['GET'])
+def obtener_departamentos():
+    """
+    Devuelve GeoJSON de departamentos del Perú
+    
+    Query params (opcionales):
+        ?bbox=minx,miny,maxx,maxy - solo las que intersectan el área
+        ?departamento=CUSCO,PUNO - solo de esos departamentos
+        ?provincia=CUSCO - solo de esa provincia
+        ?props_only=1 - sin geometría (propiedades + bbox de cada una)
+        ?format=topojson - TopoJSON cuantizado (bordes compartidos una sola vez)
+    """
+    try:
+        return respuesta_delimitacion('departamentos')
     except (OSError, ValueError) as e:
         logger.error("Error en departamentos: %s", str(e))
         return jsonify({'error': str(e)}), 500
@@ -163,33 +265,18 @@ def obtener_departamentos():
 
 @mapas_shp_bp.route('/api/delimitaciones/provincias', methods=['GET'])
 def obtener_provincias():
-    """Devuelve GeoJSON de provincias del Perú"""
+    """
+    Devuelve GeoJSON de provincias del Perú
+    
+    Query params (opcionales):
+        ?bbox=minx,miny,maxx,maxy - solo las que intersectan el área
+        ?departamento=CUSCO,PUNO - solo de esos departamentos
+        ?provincia=CUSCO - solo de esa provincia
+        ?props_only=1 - sin geometría (propiedades + bbox de cada una)
+        ?format=topojson - TopoJSON cuantizado (bordes compartidos una sola vez)
+    """
     try:
-        shp_path = DELIMITACIONES_DIR / 'PROVINCIAS' / 'PROVINCIAS.shp'
-        if not shp_path.exists():
-            return jsonify({'error': 'Shapefile no encontrado'}), 404
-
-        gdf = gpd.read_file(str(shp_path))
-        features = []
-        for _, row in gdf.iterrows():
-            feature = {
-                'type': 'Feature',
-                'geometry': row.geometry.__geo_interface__,
-                'properties': {
-                    'PROVINCIA': row.get('PROVINCIA', 'Sin nombre'),
-                    'DEPARTAMEN': row.get('DEPARTAMEN', ''),
-                    'nombre': row.get('PROVINCIA', 'Sin nombre'),
-                    'tipo': 'provincia'
-                }
-            }
-            features.append(feature)
-
-        return jsonify({
-            'type': 'FeatureCollection',
-            'features': features,
-            'total': len(features)
-        })
-
+        return respuesta_delimitacion('provincias')
     except (OSError, ValueError) as e:
         logger.error("Error en provincias: %s", str(e))
         return jsonify({'error': str(e)}), 500
@@ -197,34 +284,18 @@ def obtener_provincias():
 
 @mapas_shp_bp.route('/api/delimitaciones/distritos', methods=['GET'])
 def obtener_distritos():
-    """Devuelve GeoJSON de distritos del Perú"""
+    """
+    Devuelve GeoJSON de distritos del Perú
+    
+    Query params (opcionales):
+        ?bbox=minx,miny,maxx,maxy - solo las que intersectan el área
+        ?departamento=CUSCO,PUNO - solo de esos departamentos
+        ?provincia=CUSCO - solo de esa provincia
+        ?props_only=1 - sin geometría (propiedades + bbox de cada una)
+        ?format=topojson - TopoJSON cuantizado (bordes compartidos una sola vez)
+    """
     try:
-        shp_path = DELIMITACIONES_DIR / 'DISTRITOS' / 'DISTRITOS.shp'
-        if not shp_path.exists():
-            return jsonify({'error': 'Shapefile no encontrado'}), 404
-
-        gdf = gpd.read_file(str(shp_path))
-        features = []
-        for _, row in gdf.iterrows():
-            feature = {
-                'type': 'Feature',
-                'geometry': row.geometry.__geo_interface__,
-                'properties': {
-                    'DISTRITO': row.get('DISTRITO', 'Sin nombre'),
-                    'PROVINCIA': row.get('PROVINCIA', ''),
-                    'DEPARTAMEN': row.get('DEPARTAMEN', ''),
-                    'nombre': row.get('DISTRITO', 'Sin nombre'),
-                    'tipo': 'distrito'
-                }
-            }
-            features.append(feature)
-
-        return jsonify({
-            'type': 'FeatureCollection',
-            'features': features,
-            'total': len(features)
-        })
-
+        return respuesta_delimitacion('distritos')
     except (OSError, ValueError) as e:
         logger.error("Error en distritos: %s", str(e))
         return jsonify({'error': str(e)}), 500
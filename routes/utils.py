@@ -1,7 +1,7 @@
 """
 Rutas de Utilidades - Páginas principales, dashboard, estadísticas y configuración
 """
-from flask import Blueprint, render_template, request, jsonify, send_from_directory, send_file, make_response
+from flask import Blueprint, render_template, request, jsonify, send_file, make_response
 from pathlib import Path
 import os
 import logging
@@ -10,6 +10,11 @@ from datetime import datetime, timedelta
 import psycopg2
 import psycopg2.extras
 from io import StringIO
+from werkzeug.exceptions import NotFound
+
+from SERVICIOS.cache_respuestas import respuesta_cacheable
+from SERVICIOS.archivos_output import enviar_output
+from SERVICIOS.galeria_mapas import resumen_avisos, totales_galeria
 
 # Configuración
 BASE_DIR = Path(__file__).parent.parent
@@ -63,26 +68,12 @@ def obtener_stats_whatsapp():
 
 
 def obtener_avisos_para_whatsapp():
-    """Avisos disponibles para envío WhatsApp"""
-    avisos = []
-    
-    if OUTPUT_DIR.exists():
-        avisos_dirs = sorted([d for d in OUTPUT_DIR.iterdir() 
-                            if d.is_dir() and d.name.startswith('aviso_')], 
-                           key=lambda x: x.stat().st_mtime, reverse=True)[:10]
-        
-        for aviso_dir in avisos_dirs:
-            numero = aviso_dir.name.replace('aviso_', '')
-            mapas = len([f for f in aviso_dir.iterdir() if f.suffix == '.webp'])
-            
-            if mapas > 0:
-                avisos.append({
-                    'numero': numero,
-                    'fecha': datetime.fromtimestamp(aviso_dir.stat().st_mtime).strftime('%d/%m/%Y'),
-                    'departamentos': ['LIMA', 'LORETO']
-                })
-    
-    return avisos
+    """Avisos disponibles para envío WhatsApp (índice de la galería)"""
+    return [{
+        'numero': aviso['numero'],
+        'fecha': aviso['fecha'],
+        'departamentos': aviso['departamentos']
+    } for aviso in resumen_avisos(limite=10)]
 
 
 def obtener_historial_whatsapp():
@@ -194,6 +185,7 @@ def status():
     try:
         temp_dir = BASE_DIR / "TEMP"
         output_dir = BASE_DIR / "OUTPUT"
+        galeria = totales_galeria()
         
         return jsonify({
             'status': 'ok',
@@ -204,7 +196,8 @@ def status():
             'output_dir': {
                 'existe': output_dir.exists(),
                 'ruta': str(output_dir),
-                'avisos_procesados': len([d for d in output_dir.iterdir() if d.is_dir()]) if output_dir.exists() else 0
+                'avisos_procesados': galeria['avisos'],
+                'mapas': galeria['mapas']
             },
             'timestamp': datetime.now().isoformat()
         }), 200
@@ -223,15 +216,22 @@ def status():
 
 @utils_bp.route('/OUTPUT/<path:filepath>', methods=['GET'])
 def serve_output(filepath):
-    """Servir archivos estáticos desde OUTPUT"""
+    """
+    Servir archivos estáticos desde OUTPUT
+    Imágenes en línea, CSV/Excel como adjunto; ETag, 304 y Range, o
+    X-Accel-Redirect/X-Sendfile según MODO_ENVIO_ARCHIVOS
+    """
     try:
-        return send_from_directory(str(OUTPUT_DIR), filepath, as_attachment=True)
-    except Exception as e:
+        return enviar_output(filepath)
+    except NotFound:
+        return jsonify({'status': 'error', 'message': 'Archivo no encontrado'}), 404
+    except OSError as e:
         logger.error(f"Error sirviendo archivo {filepath}: {str(e)}")
         return jsonify({'status': 'error', 'message': 'Archivo no encontrado'}), 404
 
 
 @utils_bp.route('/api/avisos/<int:numero>/imagenes', methods=['GET'])
+@respuesta_cacheable
 def api_avisos_imagenes(numero):
     """API para obtener imágenes y CSV de afectados (para n8n)"""
     try:
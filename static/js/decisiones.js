@@ -13,6 +13,25 @@ let nivelSeleccionado = 'nacional';
 let agregacionesData = {};
 let filtroActual = { depto: null, provincia: null, distrito: null };
 
+// Clientes en el mapa: clusters del servidor que se refrescan al mover/zoom
+const COLORES_NIVEL = { 'Rojo': '#FF0000', 'Naranja': '#FFA500', 'Amarillo': '#FFD700', 'Verde': '#28A745' };
+let refrescarClusters = null;
+
+// Secciones del dashboard que llegan juntas en /decisiones-bundle
+const PARTES_BUNDLE = 'resumen,estadisticas,agregaciones,kpis,entidades,cultivos,shp';
+let bundleActual = null;
+
+/**
+ * Devuelve una parte del bundle del aviso actual; si no está (o el aviso
+ * cambió), la pide a su endpoint individual
+ */
+function obtenerParte(parte, url) {
+    if (bundleActual && String(bundleActual.numero_aviso) === String(avisoActual) && bundleActual[parte] !== undefined) {
+        return Promise.resolve(bundleActual[parte]);
+    }
+    return fetch(url).then(r => r.json());
+}
+
 document.addEventListener('DOMContentLoaded', function() {
     initializeDecisiones();
 });
@@ -54,8 +73,7 @@ function cargarCapaGeoJSON(numero) {
     
     console.log(`🗺️ Cargando SHP del aviso ${numero}`);
     
-    fetch(`/api/avisos/${numero}/shp-geojson`)
-        .then(r => r.json())
+    obtenerParte('shp', `/api/avisos/${numero}/shp-geojson`)
         .then(geojson => {
             console.log(`✅ GeoJSON: ${geojson.features.length} features`);
             
@@ -97,50 +115,100 @@ function cargarClientesMapa(numero) {
     if (clientesLayer) {
         mapa.removeLayer(clientesLayer);
     }
+    if (refrescarClusters) {
+        mapa.off('moveend', refrescarClusters);
+    }
     
     console.log(`👥 Cargando clientes del aviso ${numero}`);
     
-    fetch(`/api/avisos/${numero}/clientes-geojson`)
-        .then(r => r.json())
-        .then(geojson => {
-            console.log(`✅ ${geojson.total} clientes cargados`);
+    // Clusters por zoom/bbox calculados en el servidor; puntos sueltos solo con zoom alto
+    const capa = L.geoJSON(null, {
+        pointToLayer: (feature, latlng) => {
+            const props = feature.properties;
+            if (props.cluster) {
+                return marcadorCluster(latlng, props);
+            }
             
-            clientesLayer = L.geoJSON(geojson, {
-                pointToLayer: (feature, latlng) => {
-                    const marker = L.circleMarker(latlng, {
-                        radius: 3,
-                        fillColor: '#0066FF',
-                        color: '#003399',
-                        weight: 0.5,
-                        opacity: 0.8,
-                        fillOpacity: 0.6
-                    });
-                    
-                    marker.on('mouseover', function() {
-                        this.setStyle({radius: 5, fillOpacity: 0.9});
-                    });
-                    
-                    marker.on('mouseout', function() {
-                        this.setStyle({radius: 3, fillOpacity: 0.6});
-                    });
-                    
-                    return marker;
-                }
-            }).addTo(mapa);
+            const marker = L.circleMarker(latlng, {
+                radius: 3,
+                fillColor: COLORES_NIVEL[props.nivel] || '#0066FF',
+                color: '#003399',
+                weight: 0.5,
+                opacity: 0.8,
+                fillOpacity: 0.6
+            });
             
-            // Mantener puntos siempre arriba
-            clientesLayer.bringToFront();
+            marker.on('mouseover', function() {
+                this.setStyle({radius: 5, fillOpacity: 0.9});
+            });
             
-            console.log('✅ Clientes renderizados en mapa');
-        })
-        .catch(e => console.error('❌ Error clientes:', e));
+            marker.on('mouseout', function() {
+                this.setStyle({radius: 3, fillOpacity: 0.6});
+            });
+            
+            return marker;
+        }
+    }).addTo(mapa);
+    clientesLayer = capa;
+    
+    let solicitud = 0;
+    refrescarClusters = () => {
+        const actual = ++solicitud;
+        const url = `/api/avisos/${numero}/clientes-clusters?zoom=${Math.floor(mapa.getZoom())}` +
+                    `&bbox=${mapa.getBounds().toBBoxString()}`;
+        
+        fetch(url)
+            .then(r => r.json())
+            .then(geojson => {
+                // Descartar respuestas de otro aviso o de un movimiento anterior
+                if (clientesLayer !== capa || actual !== solicitud) return;
+                
+                capa.clearLayers();
+                capa.addData(geojson);
+                // Mantener puntos siempre arriba
+                capa.bringToFront();
+                console.log(`✅ ${geojson.total} clientes en mapa (${geojson.modo}, zoom ${geojson.zoom})`);
+            })
+            .catch(e => console.error('❌ Error clientes:', e));
+    };
+    
+    mapa.on('moveend', refrescarClusters);
+    refrescarClusters();
+}
+
+/**
+ * Marcador de cluster: tamaño según total, color del nivel más severo presente
+ */
+function marcadorCluster(latlng, props) {
+    const nivel = ['Rojo', 'Naranja', 'Amarillo', 'Verde'].find(n => props.por_color[n]) || 'Verde';
+    const marker = L.circleMarker(latlng, {
+        radius: Math.min(8 + 4 * Math.log10(props.total), 30),
+        fillColor: COLORES_NIVEL[nivel],
+        color: '#333333',
+        weight: 1,
+        opacity: 0.9,
+        fillOpacity: 0.7
+    });
+    
+    const filas = Object.entries(props.por_color).map(([color, d]) =>
+        `${color}: ${d.clientes.toLocaleString()} agr. · ${d.hectareas.toLocaleString()} ha · S/ ${d.monto.toLocaleString()}`
+    ).join('<br>');
+    marker.bindTooltip(`<strong>${props.total.toLocaleString()} clientes</strong><br>${filas}`);
+    
+    return marker;
+}
+
+// URL con hash (caché inmutable) inyectada por la página; si la capa aún no
+// está precompilada, la ruta clásica
+function urlDelimitacion(capa) {
+    return (window.DELIMITACIONES_URLS || {})[capa] || `/api/delimitaciones/${capa}`;
 }
 
 function cargarCapasDelimitaciones() {
     console.log('📍 Cargando delimitaciones ESTÁTICAS (departamentos + provincias)');
     
     // 1. Cargar DEPARTAMENTOS - ESTÁTICO (contorno grueso)
-    fetch('/api/delimitaciones/departamentos')
+    fetch(urlDelimitacion('departamentos'))
         .then(r => r.json())
         .then(geojson => {
             const deptoLayer = L.geoJSON(geojson, {
@@ -185,7 +253,7 @@ function cargarCapasDelimitaciones() {
         .catch(e => console.error('❌ Error depto:', e));
     
     // 2. Cargar PROVINCIAS - ESTÁTICO (contorno visible)
-    fetch('/api/delimitaciones/provincias')
+    fetch(urlDelimitacion('provincias'))
         .then(r => r.json())
         .then(geojson => {
             delimitacionesLayers['provinciasData'] = geojson; // Guardar data para zoom
@@ -224,8 +292,23 @@ function cargarCapasDelimitaciones() {
         })
         .catch(e => console.error('❌ Error provincias:', e));
     
-    // 3. Distritos - Solo guardar data para zoom (muy pesado para mostrar siempre)
-    delimitacionesLayers['distritosData'] = null;
+    // 3. Distritos - se piden por departamento al hacer zoom (capa nacional muy pesada)
+    delimitacionesLayers['distritosPorDepto'] = {};
+}
+
+// Distritos de un departamento, filtrados en el servidor; una petición por departamento
+function cargarDistritos(depto) {
+    const clave = (depto || '').toUpperCase().trim();
+    const cache = delimitacionesLayers['distritosPorDepto'] = delimitacionesLayers['distritosPorDepto'] || {};
+    if (!cache[clave]) {
+        cache[clave] = fetch(`${urlDelimitacion('distritos')}?departamento=${encodeURIComponent(clave)}`)
+            .then(r => r.json())
+            .catch(e => {
+                delete cache[clave];
+                throw e;
+            });
+    }
+    return cache[clave];
 }
 
 function filtrarYZoom(valor, layer) {
@@ -315,17 +398,18 @@ function cargarAviso() {
     
     console.log(`📊 Cargando aviso ${numero}`);
     
-    // Cargar datos en paralelo
-    Promise.all([
-        fetch(`/api/avisos/${numero}/clientes-afectados`).then(r => r.json()).catch(e => {console.error('Error clientes:', e); return {};}),
-        fetch(`/api/avisos/${numero}/estadisticas`).then(r => r.json()).catch(e => {console.error('Error stats:', e); return {};}),
-        fetch(`/api/avisos/${numero}/shp-geojson`).then(r => r.json()).catch(e => {console.error('Error shp:', e); return {};}),
-        fetch(`/api/avisos/${numero}/agregaciones`).then(r => r.json()).catch(e => {console.error('Error agregaciones:', e); return {};})
-    ])
-    .then(([clientesResp, statsResp, shpResp, agregacionesResp]) => {
-        const clientes = clientesResp.clientes || clientesResp;
-        const stats = statsResp;
-        agregacionesData = agregacionesResp.agregaciones || {};
+    // Cargar todas las secciones en una sola petición
+    bundleActual = null;
+    fetch(`/api/avisos/${numero}/decisiones-bundle?parts=${PARTES_BUNDLE}`)
+    .then(r => r.json())
+    .then(bundle => {
+        // El usuario cambió de aviso mientras cargaba
+        if (String(numero) !== String(avisoActual)) return;
+        bundleActual = bundle;
+        
+        const clientes = bundle.resumen || {};
+        const stats = bundle.estadisticas || {};
+        agregacionesData = (bundle.agregaciones || {}).agregaciones || {};
         
         console.log('📋 Clientes cargados:', clientes);
         console.log('📊 Stats:', stats);
@@ -366,16 +450,15 @@ function actualizarDatos() {
     console.log('📊 Actualizando datos:', filtroActual);
     
     // Construir URL con filtros
+    // Solo totales: el panel no usa la lista de agricultores
     let url = `/api/avisos/${avisoActual}/clientes-afectados`;
-    const params = [];
+    const params = ['summary=1'];
     
     if (filtroActual.depto) params.push(`depto=${encodeURIComponent(filtroActual.depto)}`);
     if (filtroActual.provincia) params.push(`provincia=${encodeURIComponent(filtroActual.provincia)}`);
     if (filtroActual.distrito) params.push(`distrito=${encodeURIComponent(filtroActual.distrito)}`);
     
-    if (params.length > 0) {
-        url += '?' + params.join('&');
-    }
+    url += '?' + params.join('&');
     
     fetch(url)
         .then(r => r.json())
@@ -455,8 +538,7 @@ function cargarKPIsNuevos(numero) {
      */
     console.log(`📊 Cargando KPIs para aviso ${numero}`);
     
-    fetch(`/api/avisos/${numero}/kpis`)
-        .then(r => r.json())
+    obtenerParte('kpis', `/api/avisos/${numero}/kpis`)
         .then(data => {
             console.log('✅ KPIs recibidos:', data);
             
@@ -613,8 +695,7 @@ function actualizarTablaZonas() {
     console.log('📊 Actualizando Tabla Zonas para aviso:', avisoActual);
     
     // Usar los datos del endpoint KPI (más reciente y correcto)
-    fetch(`/api/avisos/${avisoActual}/kpis`)
-        .then(r => r.json())
+    obtenerParte('kpis', `/api/avisos/${avisoActual}/kpis`)
         .then(data => {
             if (data.error) {
                 console.error('Error:', data.error);
@@ -662,8 +743,7 @@ function actualizarTablaEntidades() {
     console.log('📊 Actualizando Tabla Entidades para aviso:', avisoActual);
     
     // Usar el nuevo endpoint KPI Entidades
-    fetch(`/api/avisos/${avisoActual}/kpis-entidades`)
-        .then(r => r.json())
+    obtenerParte('entidades', `/api/avisos/${avisoActual}/kpis-entidades`)
         .then(data => {
             if (data.error) {
                 console.error('Error:', data.error);
@@ -709,8 +789,7 @@ function actualizarTablaCultivos() {
     console.log('🌾 Actualizando Tabla Cultivos para aviso:', avisoActual);
     
     // Usar el nuevo endpoint KPI Cultivos
-    fetch(`/api/avisos/${avisoActual}/kpis-cultivos`)
-        .then(r => r.json())
+    obtenerParte('cultivos', `/api/avisos/${avisoActual}/kpis-cultivos`)
         .then(data => {
             if (data.error) {
                 console.error('Error:', data.error);
@@ -755,11 +834,10 @@ function actualizarTablaCultivos() {
 // FUNCIONES DE VISUALIZACIÓN DE CAPAS
 // ============================================================================
 
-function mostrarDistritosDelimitacion(depto, provincia) {
+function mostrarDistritosDelimitacion(depto, provincia, distritosData) {
     console.log(`🗺️ Mostrando distritos de ${provincia}/${depto}`);
     
-    const distritosData = delimitacionesLayers['distritosData'];
-    if (!distritosData) return;
+    if (!distritosData || !distritosData.features) return;
     
     // Filtrar distritos de la provincia
     const distritosFiltered = {
@@ -951,32 +1029,19 @@ function cambiarProvincia() {
         });
     }
     
-    // Cargar y mostrar distritos de la provincia
-    if (!delimitacionesLayers['distritosData']) {
-        fetch('/api/delimitaciones/distritos')
-            .then(r => r.json())
-            .then(geojson => {
-                delimitacionesLayers['distritosData'] = geojson;
-                mostrarDistritosDelimitacion(deptoSeleccionado, provSeleccionada);
-                // Mantener puntos arriba después de cargar distritos
-                if (geojsonLayer) {
-                    geojsonLayer.bringToBack();
-                }
-                if (clientesLayer) {
-                    clientesLayer.bringToFront();
-                }
-            })
-            .catch(e => console.error('Error distritos:', e));
-    } else {
-        mostrarDistritosDelimitacion(deptoSeleccionado, provSeleccionada);
-        // Mantener puntos arriba después de mostrar distritos
-        if (geojsonLayer) {
-            geojsonLayer.bringToBack();
-        }
-        if (clientesLayer) {
-            clientesLayer.bringToFront();
-        }
-    }
+    // Cargar (solo el departamento) y mostrar distritos de la provincia
+    cargarDistritos(deptoSeleccionado)
+        .then(geojson => {
+            mostrarDistritosDelimitacion(deptoSeleccionado, provSeleccionada, geojson);
+            // Mantener puntos arriba después de mostrar distritos
+            if (geojsonLayer) {
+                geojsonLayer.bringToBack();
+            }
+            if (clientesLayer) {
+                clientesLayer.bringToFront();
+            }
+        })
+        .catch(e => console.error('Error distritos:', e));
     
     // Asegurar SHP atrás
     if (geojsonLayer) {
@@ -1205,20 +1270,16 @@ function zoomAProvincia(depto, provincia) {
 async function zoomADistrito(depto, provincia, distrito) {
     console.log(`🔍 Zoom a distrito: ${distrito}`);
     
-    // Cargar distritos bajo demanda
-    if (!delimitacionesLayers['distritosData']) {
-        console.log('📥 Cargando distritos...');
-        try {
-            const response = await fetch('/api/delimitaciones/distritos');
-            delimitacionesLayers['distritosData'] = await response.json();
-        } catch (e) {
-            console.error('❌ Error:', e);
-            zoomAProvincia(depto, provincia);
-            return;
-        }
+    // Cargar distritos del departamento bajo demanda
+    let distritosData;
+    try {
+        distritosData = await cargarDistritos(depto);
+    } catch (e) {
+        console.error('❌ Error:', e);
+        zoomAProvincia(depto, provincia);
+        return;
     }
     
-    const distritosData = delimitacionesLayers['distritosData'];
     const feature = distritosData.features?.find(f => {
         return (f.properties?.DISTRITO || '').toUpperCase() === distrito.toUpperCase() && 
                (f.properties?.PROVINCIA || '').toUpperCase() === provincia.toUpperCase() && 
@@ -4,6 +4,7 @@
    ============================================================================ */
 
 let avisos_cache = [];
+let mapas_cache = {};
 let logEventSource = null;
 let currentNumero = null;
 let processingAborted = false;
@@ -13,19 +14,15 @@ async function cargarAvisos() {
         const url = new URL(window.location);
         const avisoParam = url.searchParams.get('aviso');
         
-        let avisos = [];
+        // Una sola petición: info, departamentos y mapas vienen en cada aviso
+        const params = new URLSearchParams({ include: 'info,departamentos,mapas' });
+        if (avisoParam) params.set('aviso', parseInt(avisoParam));
+        const res = await fetch(`/api/avisos?${params}`);
+        const result = await res.json();
+        const avisos = result.avisos || [];
         
         if (avisoParam) {
-            const res = await fetch(`/api/avisos/${parseInt(avisoParam)}/info`);
-            const data = await res.json();
-            
-            if (data.success) {
-                avisos = [{
-                    numero: data.numero,
-                    titulo: data.titulo,
-                    nivel: data.nivel,
-                    color: data.color
-                }];
+            if (avisos.length) {
                 document.getElementById('filtro-orden').value = 'reciente';
                 document.getElementById('filtro-nivel').value = 'todos';
             } else {
@@ -37,30 +34,14 @@ async function cargarAvisos() {
                 `;
                 return;
             }
-        } else {
-            const res = await fetch('/api/avisos');
-            const result = await res.json();
-            avisos = result.avisos || [];
         }
         
-        const avisoPromises = avisos.map(async (aviso) => {
+        const results = avisos.map((aviso) => {
             try {
-                const infoRes = await fetch(`/api/avisos/${aviso.numero}/info`);
-                if (!infoRes.ok) return '';
-                const info = await infoRes.json();
-                if (!info.success) return '';
-                
-                let departamentos = [];
-                if (info.mapas_creados) {
-                    const deptosRes = await fetch(`/api/avisos/${aviso.numero}/departamentos`).catch(e => null);
-                    if (deptosRes && deptosRes.ok) {
-                        const deptosData = await deptosRes.json();
-                        departamentos = deptosData.departamentos || [];
-                    }
-                }
-                
-                const mapasRes = await fetch(`/api/mapas/aviso/${aviso.numero}`).catch(e => null);
-                const mapas = mapasRes ? await mapasRes.json().catch(() => ({ mapas: [] })) : { mapas: [] };
+                const info = aviso.info;
+                const departamentos = info.mapas_creados ? (aviso.departamentos || []) : [];
+                const mapas = { mapas: aviso.mapas || [] };
+                mapas_cache[aviso.numero] = mapas.mapas;
                 
                 const mapaStatus = info.mapas_creados ? 'ready' : 'pending';
                 const mapaStatusText = info.mapas_creados ? '✅ Mapas Creados' : '⏳ No Creados';
@@ -119,7 +100,6 @@ async function cargarAvisos() {
             }
         });
         
-        const results = await Promise.all(avisoPromises);
         let html = results.filter(r => r).join('');
         
         if (!html) {
@@ -278,8 +258,11 @@ function cancelarGeneracion() {
 }
 
 async function abrirTodosMapas(numero) {
-    const res = await fetch(`/api/mapas/aviso/${numero}`);
-    const data = await res.json();
+    let data = { success: true, mapas: mapas_cache[numero] };
+    if (!data.mapas) {
+        const res = await fetch(`/api/mapas/aviso/${numero}`);
+        data = await res.json();
+    }
     
     if (!data.success) {
         alert('Error al cargar mapas');
@@ -35,4 +35,31 @@ CREATE TABLE clientes (
 -- INDICES
 CREATE INDEX idx_cliente_ubicacion ON clientes(departamento, provincia, distrito);
 CREATE INDEX idx_cliente_coords ON clientes(latitud, longitud);
-CREATE INDEX idx_cliente_estado ON clientes(estado);
\ No newline at end of file
+CREATE INDEX idx_cliente_estado ON clientes(estado);
+CREATE INDEX idx_cliente_actualizacion ON clientes(ultima_actualizacion);
+
+-- ASIGNACIÓN DE DISTRITO (UBIGEO) POR COORDENADAS (ver asignar_distritos.py)
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS distrito_id INT;
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS distrito_asignado_en TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_cliente_distrito_id ON clientes(distrito_id);
+
+-- MARCA DE CAMBIO: ultima_actualizacion se mueve en todo UPDATE que no la fije
+-- explícitamente. De ella dependen el feed de cambios (snapshot_clientes /
+-- actualizar_kpis.py) y el modo incremental de asignar_distritos.py. Los UPDATE
+-- que solo tocan la asignación de distrito no la mueven (se siguen por
+-- distrito_asignado_en).
+CREATE OR REPLACE FUNCTION marcar_actualizacion_cliente() RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.ultima_actualizacion IS NOT DISTINCT FROM OLD.ultima_actualizacion
+     AND (to_jsonb(NEW) - 'distrito_id' - 'distrito_asignado_en')
+         IS DISTINCT FROM (to_jsonb(OLD) - 'distrito_id' - 'distrito_asignado_en') THEN
+    NEW.ultima_actualizacion := NOW();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cliente_actualizacion ON clientes;
+CREATE TRIGGER trg_cliente_actualizacion
+  BEFORE UPDATE ON clientes
+  FOR EACH ROW EXECUTE FUNCTION marcar_actualizacion_cliente();
@@ -0,0 +1,5 @@
+"""Configuración de pytest: la raíz del repo en sys.path para importar SERVICIOS/routes"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
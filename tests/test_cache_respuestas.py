@@ -0,0 +1,111 @@
+"""Clave e invalidación de SERVICIOS/cache_respuestas"""
+import pytest
+from flask import Flask, jsonify
+
+from SERVICIOS import cache_respuestas
+
+
+@pytest.fixture
+def entorno(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_respuestas, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(cache_respuestas, 'DB_PATH', tmp_path / 'respuestas.sqlite')
+    monkeypatch.setattr(cache_respuestas, 'CACHE_HABILITADO', True)
+    monkeypatch.setattr(cache_respuestas, '_esquema_listo', False)
+    version = {'clientes': 'v1'}
+    monkeypatch.setattr(cache_respuestas, '_version_clientes', lambda: version['clientes'])
+
+    llamadas = {'datos': 0, 'procesar': 0}
+    app = Flask(__name__)
+
+    @app.route('/api/avisos/<int:numero>/datos')
+    @cache_respuestas.respuesta_cacheable
+    def datos(numero):
+        llamadas['datos'] += 1
+        return jsonify({'numero': numero, 'llamada': llamadas['datos']})
+
+    @app.route('/api/avisos/<int:numero>/procesar', methods=['POST', 'GET'])
+    def procesar(numero):
+        llamadas['procesar'] += 1
+        return jsonify({'status': 'processing'})
+
+    cache_respuestas.registrar_cache_respuestas(app)
+    return app.test_client(), llamadas, version
+
+
+def test_segunda_peticion_sale_de_cache(entorno):
+    cliente, llamadas, _ = entorno
+    primera = cliente.get('/api/avisos/1/datos')
+    segunda = cliente.get('/api/avisos/1/datos')
+    assert primera.headers['X-Cache'] == 'MISS'
+    assert segunda.headers['X-Cache'] == 'HIT'
+    assert segunda.get_json() == primera.get_json()
+    assert llamadas['datos'] == 1
+    assert 'Accept' in segunda.headers['Vary']
+
+
+def test_etag_responde_304(entorno):
+    cliente, _, _ = entorno
+    etag = cliente.get('/api/avisos/1/datos').headers['ETag']
+    respuesta = cliente.get('/api/avisos/1/datos', headers={'If-None-Match': etag})
+    assert respuesta.status_code == 304
+
+
+def test_query_string_es_parte_de_la_clave(entorno):
+    cliente, llamadas, _ = entorno
+    cliente.get('/api/avisos/1/datos?zoom=3')
+    assert cliente.get('/api/avisos/1/datos?zoom=4').headers['X-Cache'] == 'MISS'
+    assert llamadas['datos'] == 2
+
+
+def test_vista_no_habilitada_no_se_cachea(entorno):
+    cliente, llamadas, _ = entorno
+    cliente.get('/api/avisos/1/procesar')
+    respuesta = cliente.get('/api/avisos/1/procesar')
+    assert 'X-Cache' not in respuesta.headers
+    assert llamadas['procesar'] == 2
+
+
+def test_ndjson_no_pasa_por_cache(entorno):
+    cliente, llamadas, _ = entorno
+    cliente.get('/api/avisos/1/datos')
+    respuesta = cliente.get('/api/avisos/1/datos', headers={'Accept': cache_respuestas.MIMETYPE_NDJSON})
+    assert 'X-Cache' not in respuesta.headers
+    assert llamadas['datos'] == 2
+
+
+def test_invalidar_aviso_solo_afecta_a_ese_aviso(entorno):
+    cliente, _, _ = entorno
+    cliente.get('/api/avisos/1/datos')
+    cliente.get('/api/avisos/2/datos')
+    cache_respuestas.invalidar_aviso(1)
+    assert cliente.get('/api/avisos/1/datos').headers['X-Cache'] == 'MISS'
+    assert cliente.get('/api/avisos/2/datos').headers['X-Cache'] == 'HIT'
+
+
+def test_invalidar_clientes_descarta_todo(entorno):
+    cliente, _, _ = entorno
+    cliente.get('/api/avisos/1/datos')
+    cliente.get('/api/avisos/2/datos')
+    cache_respuestas.invalidar_clientes()
+    assert cliente.get('/api/avisos/1/datos').headers['X-Cache'] == 'MISS'
+    assert cliente.get('/api/avisos/2/datos').headers['X-Cache'] == 'MISS'
+
+
+def test_cambio_de_version_de_clientes_cambia_la_clave(entorno):
+    cliente, llamadas, version = entorno
+    cliente.get('/api/avisos/1/datos')
+    version['clientes'] = 'v2'
+    assert cliente.get('/api/avisos/1/datos').headers['X-Cache'] == 'MISS'
+    assert llamadas['datos'] == 2
+
+
+def test_esquema_se_recrea_si_se_borra_la_base(entorno):
+    cliente, _, _ = entorno
+    cliente.get('/api/avisos/1/datos')
+    cache_respuestas.DB_PATH.unlink()
+    for sufijo in ('-wal', '-shm'):
+        cache_respuestas.DB_PATH.with_name(cache_respuestas.DB_PATH.name + sufijo).unlink(missing_ok=True)
+    # La petición que encuentra la base borrada se sirve sin caché
+    assert 'X-Cache' not in cliente.get('/api/avisos/1/datos').headers
+    assert cliente.get('/api/avisos/1/datos').headers['X-Cache'] == 'MISS'
+    assert cliente.get('/api/avisos/1/datos').headers['X-Cache'] == 'HIT'
@@ -0,0 +1,29 @@
+"""parsear_bbox de SERVICIOS/clusters_clientes (?bbox= de clientes-clusters)"""
+import pytest
+
+from SERVICIOS.clusters_clientes import BBOX_MUNDO, parsear_bbox
+
+
+@pytest.mark.parametrize('texto, esperado', [
+    ('-81.5,-18.4,-68.6,-0.03', (-81.5, -18.4, -68.6, -0.03)),
+    (' -81 , -18 , -68 , 0 ', (-81.0, -18.0, -68.0, 0.0)),
+    # Leaflet puede enviar longitudes fuera de ±180 al desplazar el mapa
+    ('-200,-10,200,10', (-200.0, -10.0, 200.0, 10.0)),
+    (None, BBOX_MUNDO),
+    ('', BBOX_MUNDO),
+])
+def test_bbox_valido(texto, esperado):
+    assert parsear_bbox(texto) == esperado
+
+
+@pytest.mark.parametrize('texto', [
+    '1,2,3',
+    '1,2,3,4,5',
+    'a,b,c,d',
+    '1,,3,4',
+    'nan,-18,-68,0',
+    '-inf,-90,inf,90',
+])
+def test_bbox_invalido(texto):
+    with pytest.raises(ValueError):
+        parsear_bbox(texto)
@@ -0,0 +1,26 @@
+"""parsear_bbox de SERVICIOS/delimitaciones (?bbox= de /api/delimitaciones)"""
+import pytest
+
+from SERVICIOS.delimitaciones import parsear_bbox
+
+
+@pytest.mark.parametrize('texto, esperado', [
+    ('-81.5,-18.4,-68.6,-0.03', (-81.5, -18.4, -68.6, -0.03)),
+    ('-75,-12,-75,-12', (-75.0, -12.0, -75.0, -12.0)),
+])
+def test_bbox_valido(texto, esperado):
+    assert parsear_bbox(texto) == esperado
+
+
+@pytest.mark.parametrize('texto', [
+    '1,2,3',
+    '1,2,3,4,5',
+    'a,b,c,d',
+    '-68,-18,-81,0',   # minx > maxx
+    '-81,0,-68,-18',   # miny > maxy
+    'nan,-18,-68,0',
+    '-inf,-90,inf,90',
+])
+def test_bbox_invalido(texto):
+    with pytest.raises(ValueError):
+        parsear_bbox(texto)
@@ -0,0 +1,29 @@
+"""Negociación de Accept-Encoding (SERVICIOS/geojson.elegir_codificacion)"""
+import pytest
+
+from SERVICIOS.geojson import elegir_codificacion
+
+AMBAS = ['br', 'gzip']
+
+
+@pytest.mark.parametrize('accept_encoding, disponibles, esperado', [
+    ('gzip, deflate, br', AMBAS, ('br', '.br')),
+    ('gzip', AMBAS, ('gzip', '.gz')),
+    ('GZIP', AMBAS, ('gzip', '.gz')),
+    ('br', ['gzip'], (None, '')),
+    ('', AMBAS, (None, '')),
+    (None, AMBAS, (None, '')),
+    ('identity', AMBAS, (None, '')),
+    # q=0 rechaza explícitamente la codificación
+    ('gzip;q=0', AMBAS, (None, '')),
+    ('br;q=0, gzip', AMBAS, ('gzip', '.gz')),
+    ('gzip;q=0, *', AMBAS, ('br', '.br')),
+    ('gzip;q=0, *', ['gzip'], (None, '')),
+    ('*;q=0.5, br;q=0', AMBAS, ('gzip', '.gz')),
+    # Mayor q gana; a igual q, el orden de preferencia (br antes que gzip)
+    ('br;q=0.2, gzip;q=0.8', AMBAS, ('gzip', '.gz')),
+    ('gzip;q=0.5, br;q=0.5', AMBAS, ('br', '.br')),
+    ('gzip;q=abc', AMBAS, (None, '')),
+])
+def test_elegir_codificacion(accept_encoding, disponibles, esperado):
+    assert elegir_codificacion(accept_encoding, disponibles) == esperado
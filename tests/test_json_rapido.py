@@ -0,0 +1,73 @@
+"""SERVICIOS/json_rapido.dumps con ambos backends (orjson y json estándar)"""
+import datetime
+import decimal
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from SERVICIOS import json_rapido
+from SERVICIOS.json_rapido import FragmentoJSON, dumps
+
+BACKENDS = [False] + ([True] if json_rapido.ORJSON_DISPONIBLE else [])
+
+
+@pytest.fixture(params=BACKENDS, ids=lambda orjson: 'orjson' if orjson else 'json')
+def backend(request, monkeypatch):
+    monkeypatch.setattr(json_rapido, 'ORJSON_DISPONIBLE', request.param)
+
+
+def cargar(obj):
+    return json.loads(dumps(obj))
+
+
+def test_nan_e_infinito_salen_como_null(backend):
+    datos = {'a': float('nan'), 'b': np.float64('inf'), 'c': np.float32('nan'),
+             'd': np.array([1.0, np.nan]), 'e': [float('-inf')]}
+    assert cargar(datos) == {'a': None, 'b': None, 'c': None, 'd': [1.0, None], 'e': [None]}
+
+
+def test_nat_sale_como_null(backend):
+    datos = {'pandas': pd.NaT, 'na': pd.NA, 'numpy': np.datetime64('NaT'),
+             'array': np.array(['2026-01-02', 'NaT'], dtype='datetime64[ns]')}
+    assert cargar(datos) == {'pandas': None, 'na': None, 'numpy': None,
+                             'array': ['2026-01-02T00:00:00', None]}
+
+
+def test_fechas_en_iso(backend):
+    datos = [datetime.date(2026, 1, 2), datetime.datetime(2026, 1, 2, 3, 4, 5),
+             pd.Timestamp('2026-01-02 03:04:05'), np.datetime64('2026-01-02T03:04')]
+    assert cargar(datos) == ['2026-01-02', '2026-01-02T03:04:05', '2026-01-02T03:04:05',
+                             '2026-01-02T03:04:00']
+
+
+def test_decimal_y_escalares_numpy(backend):
+    datos = {'monto': decimal.Decimal('1234.50'), 'n': np.int64(7), 'b': np.bool_(True), 1: 'clave int'}
+    assert cargar(datos) == {'monto': 1234.5, 'n': 7, 'b': True, '1': 'clave int'}
+
+
+def test_fragmento_se_inserta_tal_cual(backend):
+    fragmento = FragmentoJSON(b'{"type":"FeatureCollection","features":[]}')
+    salida = dumps({'success': True, 'capa': fragmento, 'lista': [1, FragmentoJSON(b'[2,3]')]})
+    assert b'"capa":{"type":"FeatureCollection","features":[]}' in salida
+    assert json.loads(salida)['lista'] == [1, [2, 3]]
+
+
+def test_fragmento_en_la_raiz(backend):
+    assert dumps(FragmentoJSON(b'[1]')) == b'[1]'
+
+
+def test_texto_con_aspecto_de_marcador_no_se_altera(backend):
+    texto = '"\\u0000fragmento0\\u0000" \x00fragmento0\x00'
+    assert cargar({'texto': texto, 'f': FragmentoJSON(b'1')}) == {'texto': texto, 'f': 1}
+
+
+def test_fragmento_junto_a_nat(backend):
+    datos = {'fecha': np.datetime64('NaT'), 'capa': FragmentoJSON(b'{"x":1}')}
+    assert cargar(datos) == {'fecha': None, 'capa': {'x': 1}}
+
+
+def test_tipo_desconocido_lanza_type_error(backend):
+    with pytest.raises(TypeError):
+        dumps({'x': object()})
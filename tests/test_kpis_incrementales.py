@@ -0,0 +1,120 @@
+"""
+KPIs incrementales (routes/decisiones.aplicar_deltas_kpis): aplicar el delta
+de los clientes cambiados debe dar lo mismo que recalcular toda la cartera
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from routes.areas import ETIQUETAS_BANDAS
+from routes.decisiones import aplicar_deltas_kpis, agregar_kpis, construir_frame_clientes
+
+ZONAS = [
+    {'departamento': 'PUNO', 'provincia': 'PUNO', 'distrito': 'PUNO', 'ubigeo': '210101'},
+    {'departamento': 'CUSCO', 'provincia': 'CUSCO', 'distrito': 'CUSCO', 'ubigeo': '080101'},
+]
+DEPARTAMENTOS = ['PUNO', 'CUSCO', 'LIMA']
+UBIGEOS = {'PUNO': [210101, 210102], 'CUSCO': [80101, 80102], 'LIMA': [150101]}
+NIVELES = ['Rojo', 'Naranja', 'Amarillo', 'Verde']
+
+
+def _cartera(n, semilla):
+    rng = np.random.default_rng(semilla)
+    departamentos = rng.choice(DEPARTAMENTOS, n)
+    asignado = rng.random(n) < 0.8
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'departamento_norm': departamentos,
+        'provincia_norm': [f'{d} PROV{rng.integers(2)}' for d in departamentos],
+        'distrito_norm': [f'{d} DIST{rng.integers(3)}' for d in departamentos],
+        'hectareas': rng.integers(1, 500, n) / 10,
+        'monto_asegurado': rng.integers(100, 10000, n).astype(float),
+        'entidad_id': pd.array(rng.choice([1, 2, None], n), dtype='Int64'),
+        'entidad_nombre': rng.choice(['CAJA A', 'CAJA B'], n),
+        'cultivo_id': pd.array(rng.integers(1, 4, n), dtype='Int64'),
+        'cultivo_nombre': rng.choice(['PAPA', 'MAIZ', None], n),
+        'latitud': rng.uniform(-18, -3, n),
+        'longitud': rng.uniform(-81, -68, n),
+        'distrito_id': pd.array([rng.choice(UBIGEOS[d]) if a else None
+                                 for d, a in zip(departamentos, asignado)], dtype='Int64'),
+        'distrito_asignado': asignado,
+        'estado': rng.choice(['activo', 'activo', 'activo', 'inactivo'], n),
+    })
+
+
+def _clasificacion(ids, semilla):
+    """CSV de clasificación: algunos clientes en dos polígonos solapados"""
+    rng = np.random.default_rng(semilla)
+    ids = np.asarray(ids)
+    duplicados = rng.choice(ids, len(ids) // 5, replace=False) if len(ids) else ids
+    todos = np.concatenate([ids, duplicados])
+    return pd.DataFrame({
+        'id': todos,
+        'nivel': rng.choice(NIVELES, len(todos)),
+        'nivel_cercano': rng.choice(['Rojo', 'Naranja', None], len(todos)),
+        'banda_cercania': rng.choice(ETIQUETAS_BANDAS + [None], len(todos)),
+    })
+
+
+def _kpis(cartera, clasificacion):
+    return agregar_kpis(construir_frame_clientes(cartera[cartera['estado'] == 'activo'], ZONAS, clasificacion))
+
+
+def _normalizar(valor):
+    """Redondeo y orden canónico: el delta puede ordenar empates distinto"""
+    if isinstance(valor, float):
+        return round(valor, 1)
+    if isinstance(valor, dict):
+        return {clave: _normalizar(v) for clave, v in valor.items()}
+    if isinstance(valor, list):
+        elementos = [_normalizar(v) for v in valor]
+        return sorted(elementos, key=lambda e: json.dumps(e, sort_keys=True, default=str))
+    return valor
+
+
+def _cambiar(antes, ids, semilla):
+    """Clientes de `ids` modificados (hectáreas, estado, ubicación) y 3 altas nuevas"""
+    rng = np.random.default_rng(semilla)
+    nuevas = antes[antes['id'].isin(ids)].copy()
+    nuevas['hectareas'] = nuevas['hectareas'] + rng.integers(1, 50, len(nuevas))
+    nuevas['estado'] = rng.choice(['activo', 'inactivo'], len(nuevas))
+    mover = rng.random(len(nuevas)) < 0.5
+    nuevas.loc[mover, 'departamento_norm'] = 'PUNO'
+    nuevas.loc[mover, 'distrito_id'] = 210101
+    nuevas.loc[mover, 'distrito_asignado'] = True
+    altas = _cartera(3, semilla + 1).assign(id=antes['id'].max() + np.arange(1, 4))
+    return pd.concat([nuevas, altas], ignore_index=True)
+
+
+@pytest.mark.parametrize('semilla', [1, 2, 3])
+def test_delta_igual_a_recalculo_completo(semilla):
+    antes = _cartera(300, semilla)
+    clasificacion_antes = _clasificacion(antes['id'], semilla)
+    kpis_antes = _kpis(antes, clasificacion_antes)
+
+    rng = np.random.default_rng(semilla + 100)
+    nuevas = _cambiar(antes, rng.choice(antes['id'], 40, replace=False), semilla)
+    anteriores = antes[antes['id'].isin(nuevas['id'])]
+    reclasificadas = _clasificacion(nuevas['id'], semilla + 200)
+
+    # Igual que decisiones._aplicar_cambios_aviso
+    en_delta = clasificacion_antes['id'].isin(nuevas['id'])
+    menos = _kpis(anteriores, clasificacion_antes[en_delta])
+    mas = _kpis(nuevas, reclasificadas)
+    kpis_delta = aplicar_deltas_kpis(kpis_antes, mas, menos)
+
+    despues = pd.concat([antes[~antes['id'].isin(nuevas['id'])], nuevas], ignore_index=True)
+    clasificacion_despues = pd.concat([clasificacion_antes[~en_delta], reclasificadas], ignore_index=True)
+    kpis_completos = _kpis(despues, clasificacion_despues)
+
+    assert _normalizar(kpis_delta) == _normalizar(kpis_completos)
+
+
+def test_delta_vacio_no_cambia_nada():
+    antes = _cartera(100, 7)
+    clasificacion = _clasificacion(antes['id'], 7)
+    kpis = _kpis(antes, clasificacion)
+    vacio = _kpis(antes.iloc[0:0], clasificacion.iloc[0:0])
+    assert _normalizar(aplicar_deltas_kpis(kpis, vacio, vacio)) == _normalizar(kpis)